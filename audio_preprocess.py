@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import argparse
+import subprocess
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisperに渡すサンプリング周波数
+FRAME_SEC = 0.03  # 無音判定の単位（この長さごとにRMSを求める）
+SILENCE_DB = -40.0  # これより小さい音量（dBFS）を無音とみなす
+MIN_SILENCE_SEC = 0.6  # これより長い無音だけを詰める（文中の間は残す）
+KEEP_SILENCE_SEC = 0.2  # 詰めた無音のうち残す長さ（単語の区切りが分かるように）
+MAX_TEMPO = 2.0  # FFmpeg の atempo 1段で扱える上限
+
+def load_audio(path, sample_rate=SAMPLE_RATE, duration=None):
+    """FFmpegでモノラル・float32に変換して読み込む（whisper.load_audio と同じ形式、duration 秒を指定すれば先頭だけ）"""
+    limit = ["-t", str(duration)] if duration else []
+    command = ["ffmpeg", "-nostdin", "-v", "error", "-i", path, *limit,
+               "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    process = subprocess.run(command, capture_output=True, check=True)
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+class TimeMap:
+    """前処理後の時刻を元の音声の時刻に戻す対応表
+
+    残した区間（元の音声での開始と長さ）を順に並べ、テンポを上げた分は一律に伸ばして戻す。
+    """
+
+    def __init__(self, original_starts, lengths, tempo=1.0):
+        self.original_starts = np.asarray(original_starts, dtype=np.float64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.kept_starts = np.concatenate([[0.0], np.cumsum(self.lengths)[:-1]]) if len(self.lengths) else np.zeros(0)
+        self.tempo = tempo
+
+    @classmethod
+    def identity(cls, duration, tempo=1.0):
+        return cls([0.0], [duration], tempo)
+
+    def to_original(self, times):
+        """前処理後の時刻（秒、スカラーか配列）を元の音声の時刻にする"""
+        times = np.asarray(times, dtype=np.float64)
+        if not len(self.lengths):
+            return times
+        kept = times * self.tempo
+        index = np.clip(np.searchsorted(self.kept_starts, kept, side="right") - 1, 0, len(self.lengths) - 1)
+        offset = np.clip(kept - self.kept_starts[index], 0.0, self.lengths[index])
+        return self.original_starts[index] + offset
+
+    def project_result(self, result):
+        """Whisperの結果のセグメント（と単語）の時刻を元の音声の時刻に戻す"""
+        for segment in result.get("segments", []):
+            segment["start"], segment["end"] = (float(t) for t in self.to_original([segment["start"], segment["end"]]))
+            for word in segment.get("words", []):
+                word["start"], word["end"] = (float(t) for t in self.to_original([word["start"], word["end"]]))
+        return result
+
+def frame_db(audio, sample_rate=SAMPLE_RATE):
+    """フレームごとの音量（dBFS）"""
+    frame = int(FRAME_SEC * sample_rate)
+    count = len(audio) // frame
+    frames = audio[:count * frame].reshape(count, frame).astype(np.float64)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(rms + 1e-10)
+
+def kept_intervals(audio, sample_rate=SAMPLE_RATE, silence_db=SILENCE_DB,
+                   min_silence_sec=MIN_SILENCE_SEC, keep_silence_sec=KEEP_SILENCE_SEC):
+    """長い無音を詰めたあとに残す区間を (開始, 終了) のサンプル位置の配列で返す"""
+    frame = int(FRAME_SEC * sample_rate)
+    silent = frame_db(audio, sample_rate) < silence_db
+    if not silent.any():
+        return np.array([[0, len(audio)]])
+
+    # 無音の連続区間（フレーム単位）の始まりと終わり
+    edges = np.diff(np.concatenate([[0], silent.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    long_runs = (run_ends - run_starts) * FRAME_SEC >= min_silence_sec
+    half_keep = int(keep_silence_sec / 2 * sample_rate)
+    cut_starts = run_starts[long_runs] * frame + half_keep
+    cut_ends = np.minimum(run_ends[long_runs] * frame, len(audio)) - half_keep
+    # 先頭と末尾の無音は残さない
+    if len(cut_starts) and run_starts[long_runs][0] == 0:
+        cut_starts[0] = 0
+    if len(cut_ends) and run_ends[long_runs][-1] * frame >= len(audio) - frame:
+        cut_ends[-1] = len(audio)
+
+    starts = np.concatenate([[0], cut_ends])
+    ends = np.concatenate([cut_starts, [len(audio)]])
+    keep = ends > starts
+    return np.stack([starts[keep], ends[keep]], axis=1)
+
+def change_tempo(audio, tempo, sample_rate=SAMPLE_RATE):
+    """音程を変えずに速さを tempo 倍にする（FFmpeg の atempo）"""
+    if not 1.0 <= tempo <= MAX_TEMPO:
+        raise ValueError(f"テンポは 1.0 以上 {MAX_TEMPO} 以下で指定してください: {tempo}")
+    command = ["ffmpeg", "-nostdin", "-v", "error", "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-i", "-",
+               "-filter:a", f"atempo={tempo}", "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    process = subprocess.run(command, input=audio.astype(np.float32).tobytes(), capture_output=True, check=True)
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+def preprocess(audio, trim_silence=True, tempo=1.0, silence_db=SILENCE_DB, sample_rate=SAMPLE_RATE):
+    """無音を詰めてテンポを上げた音声と、時刻の対応表・内訳を返す"""
+    original_sec = len(audio) / sample_rate
+    intervals = kept_intervals(audio, sample_rate, silence_db) if trim_silence else None
+    if intervals is not None and len(intervals):
+        processed = np.concatenate([audio[start:end] for start, end in intervals])
+        time_map = TimeMap(intervals[:, 0] / sample_rate, (intervals[:, 1] - intervals[:, 0]) / sample_rate, tempo)
+    else:
+        # 詰めないとき（全体が無音で何も残らないときを含む）は元の音声のまま
+        processed = audio
+        time_map = TimeMap.identity(original_sec, tempo)
+    trimmed_sec = len(processed) / sample_rate
+    if tempo != 1.0 and len(processed):
+        processed = change_tempo(processed, tempo, sample_rate)
+    processed_sec = len(processed) / sample_rate
+    stats = {
+        "original_sec": round(original_sec, 2),
+        "trimmed_sec": round(trimmed_sec, 2),
+        "processed_sec": round(processed_sec, 2),
+        "removed_silence_sec": round(original_sec - trimmed_sec, 2),
+        "kept_intervals": len(time_map.lengths),
+        "tempo": tempo,
+        "ratio": round(processed_sec / original_sec, 4) if original_sec else None,
+    }
+    return processed, time_map, stats
+
+def format_stats(stats):
+    return (f"前処理: {stats['original_sec']:.1f}秒 → 無音を詰めて {stats['trimmed_sec']:.1f}秒 "
+            f"(-{stats['removed_silence_sec']:.1f}秒, {stats['kept_intervals']}区間) → "
+            f"テンポ {stats['tempo']}倍で {stats['processed_sec']:.1f}秒 (元の {100 * (stats['ratio'] or 0):.0f}%)")
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='書き起こしの前に無音を詰め、テンポを上げた音声を作ります')
+    parser.add_argument('path', help='入力の音声ファイル')
+    parser.add_argument('--tempo', type=float, default=1.0,
+                        help='音程を変えずに速くする倍率（1.0〜2.0、1.25〜1.5 が目安）')
+    parser.add_argument('--no_trim', action='store_true',
+                        help='無音を詰めない')
+    parser.add_argument('--silence_db', type=float, default=SILENCE_DB,
+                        help='無音とみなす音量（dBFS）')
+    parser.add_argument('--output', type=str, default=None,
+                        help='前処理後の音声を書き出すパス（WAVなど、FFmpegが拡張子から形式を決める）')
+    parser.add_argument('--report', type=str, default=None,
+                        help='内訳と時刻の対応表をJSONで保存するパス')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    audio = load_audio(args.path)
+    processed, time_map, stats = preprocess(audio, not args.no_trim, args.tempo, args.silence_db)
+    print(format_stats(stats))
+
+    if args.output:
+        subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-y", "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+                        "-i", "-", args.output], input=processed.tobytes(), check=True)
+        print(f"前処理後の音声を保存しました: {args.output}")
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"stats": stats, "time_map": {
+                "original_starts": time_map.original_starts.round(3).tolist(),
+                "lengths": time_map.lengths.round(3).tolist(), "tempo": time_map.tempo}}, f, ensure_ascii=False, indent=2)
+        print(f"内訳を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
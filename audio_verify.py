@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import glob
+import json
+import hashlib
+import mmap
+import time
+import argparse
+
+from mp3_frames import Mp3FormatError, audio_range, scan_frames, info_tag
+from work_queue import file_lock
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+MAX_JUNK_RATIO = 0.01  # フレーム以外のバイトがこの割合を超えたら壊れているとみなす
+DURATION_TOLERANCE_SEC = 2.0  # プレイリストの長さとの許容差（秒）
+DURATION_TOLERANCE_RATIO = 0.02  # プレイリストの長さとの許容差（割合、秒数と大きい方を使う）
+BAD_AUDIO_FILE = os.path.join("output", "bad_audio.json")  # 検査に通らなかったエピソードの記録
+MAX_REDOWNLOADS = 3  # 検査に通らないエピソードを再ダウンロードする上限
+HASH_BYTES = 1024 * 1024  # 音声のハッシュに使う先頭のバイト数
+
+def _looks_like_html(head):
+    """エラーページなど、音声の代わりに返ってきたHTML/テキストか"""
+    head = head.lstrip().lower()
+    return head.startswith((b"<!doctype", b"<html", b"<?xml", b"<head", b"<body", b"{"))
+
+def _result(path, kind, size):
+    return {"path": path, "kind": kind, "ok": True, "size": size, "duration_sec": 0.0, "problems": []}
+
+def _check_duration(result, expected_sec):
+    """期待する長さ（プレイリストの #EXTINF の合計など）と比べる"""
+    if expected_sec:
+        result["expected_sec"] = round(expected_sec, 3)
+        tolerance = max(DURATION_TOLERANCE_SEC, expected_sec * DURATION_TOLERANCE_RATIO)
+        if abs(result["duration_sec"] - expected_sec) > tolerance:
+            result["problems"].append(f"長さが一致しません（実際 {result['duration_sec']:.1f}秒 / 期待 {expected_sec:.1f}秒）")
+    result["ok"] = not result["problems"]
+    return result
+
+def verify_mp3(path, expected_sec=None):
+    """MP3のフレーム同期をたどって長さを求め、途中の欠けやゴミ・長さの不一致を調べる"""
+    size = os.path.getsize(path)
+    result = _result(path, "mp3", size)
+    result.update({"frames": 0, "junk_bytes": 0})
+    if size == 0:
+        result["problems"].append("空のファイルです")
+        return _check_duration(result, None)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            start, end = audio_range(view)
+            if _looks_like_html(bytes(view[start:start + 64])):
+                result["problems"].append("音声ではなくHTML/テキストです")
+                return _check_duration(result, None)
+            frames = 0
+            audio_bytes = 0
+            duration = 0.0
+            header_frames = None
+            try:
+                for offset, header in scan_frames(view, start, end):
+                    if frames == 0 and header_frames is None and info_tag(view, offset, header):
+                        header_frames = _xing_frames(view, offset, header)
+                        audio_bytes += header.length
+                        continue
+                    frames += 1
+                    audio_bytes += header.length
+                    duration += header.samples / header.sample_rate
+            except Mp3FormatError as e:
+                result["problems"].append(str(e))
+        finally:
+            view.release()
+
+    result["frames"] = frames
+    result["duration_sec"] = round(duration, 3)
+    result["junk_bytes"] = (end - start) - audio_bytes
+    if not frames:
+        result["problems"].append("MP3フレームがありません")
+    elif result["junk_bytes"] > MAX_JUNK_RATIO * (end - start):
+        result["problems"].append(f"フレームとして読めない部分があります（{result['junk_bytes']}バイト）")
+    if header_frames and frames and abs(header_frames - frames) > max(2, header_frames * 0.01):
+        result["problems"].append(f"ヘッダーのフレーム数と一致しません（実際 {frames} / ヘッダー {header_frames}、途中で切れています）")
+    return _check_duration(result, expected_sec)
+
+def _xing_frames(view, offset, header):
+    """Xing / Info ヘッダーに書かれたフレーム数（なければNone）"""
+    pos = offset + 4 + (2 if header.protected else 0) + header.side_info_size
+    if bytes(view[pos:pos + 4]) not in (b"Xing", b"Info") or not view[pos + 7] & 1:
+        return None
+    return int.from_bytes(view[pos + 8:pos + 12], "big")
+
+def _pes_pts(packet, payload_offset):
+    """PESヘッダーのPTS（なければNone）"""
+    pes = packet[payload_offset:]
+    if len(pes) < 14 or pes[0:3] != b"\x00\x00\x01" or not 0xC0 <= pes[3] <= 0xEF or not pes[7] & 0x80:
+        return None
+    p = pes[9:14]
+    return (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+
+def verify_ts(path, expected_sec=None):
+    """MPEG-TS の同期バイトと連続性カウンタを調べ、PTSから長さを求める"""
+    size = os.path.getsize(path)
+    result = _result(path, "ts", size)
+    result.update({"packets": size // TS_PACKET_SIZE, "sync_errors": 0, "continuity_errors": 0})
+    if size < TS_PACKET_SIZE:
+        result["problems"].append("TSパケットがありません")
+        return _check_duration(result, None)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if _looks_like_html(mm[:64]):
+            result["problems"].append("音声ではなくHTML/テキストです")
+            return _check_duration(result, None)
+        n_packets = result["packets"]
+        if size % TS_PACKET_SIZE:
+            result["problems"].append(f"最後のパケットが途中で切れています（{size % TS_PACKET_SIZE}バイト）")
+
+        # ヘッダーの各バイトを一度に取り出し、パケットごとの処理を軽くする
+        limit = n_packets * TS_PACKET_SIZE
+        sync = mm[0:limit:TS_PACKET_SIZE]
+        result["sync_errors"] = n_packets - sync.count(TS_SYNC_BYTE)
+        if result["sync_errors"]:
+            result["problems"].append(f"同期バイトのないパケットがあります（{result['sync_errors']}個）")
+            return _check_duration(result, None)
+        b1 = mm[1:limit:TS_PACKET_SIZE]
+        b2 = mm[2:limit:TS_PACKET_SIZE]
+        b3 = mm[3:limit:TS_PACKET_SIZE]
+
+        last_cc = {}
+        pts_first = {}
+        pts_last = {}
+        pes_count = {}
+        for i in range(n_packets):
+            pid = ((b1[i] & 0x1F) << 8) | b2[i]
+            if pid == NULL_PID:
+                continue
+            flags = b3[i]
+            if not flags & 0x10:
+                continue  # ペイロードなし（カウンタは進まない）
+            cc = flags & 0x0F
+            previous = last_cc.get(pid)
+            if previous is not None and cc != (previous + 1) & 0x0F and cc != previous:
+                result["continuity_errors"] += 1
+            last_cc[pid] = cc
+
+            if b1[i] & 0x40:  # PESの先頭
+                base = i * TS_PACKET_SIZE
+                payload_offset = 4 + (1 + mm[base + 4] if flags & 0x20 else 0)
+                if payload_offset < TS_PACKET_SIZE:
+                    pts = _pes_pts(mm[base:base + TS_PACKET_SIZE], payload_offset)
+                    if pts is not None:
+                        pts_first.setdefault(pid, pts)
+                        pts_last[pid] = pts
+                        pes_count[pid] = pes_count.get(pid, 0) + 1
+
+    if result["continuity_errors"]:
+        result["problems"].append(f"連続性カウンタが飛んでいます（{result['continuity_errors']}箇所、パケット欠落）")
+    if not pts_first:
+        result["problems"].append("音声のPESがありません")
+    else:
+        # 最も多くPESを持つストリームを音声とみなし、最後のPESの長さは平均で補う
+        pid = max(pes_count, key=pes_count.get)
+        span_ticks = pts_last[pid] - pts_first[pid]
+        count = pes_count[pid]
+        average = span_ticks / (count - 1) if count > 1 else 0
+        result["duration_sec"] = round((span_ticks + average) / 90000, 3)
+    return _check_duration(result, expected_sec)
+
+def verify_file(path, expected_sec=None):
+    """拡張子に応じて検査する"""
+    if path.lower().endswith(".ts"):
+        return verify_ts(path, expected_sec)
+    return verify_mp3(path, expected_sec)
+
+def playlist_duration(m3u8_content):
+    """メディアプレイリストの #EXTINF の合計（秒）。なければNone"""
+    durations = re.findall(r"#EXTINF:\s*([\d.]+)", m3u8_content)
+    return sum(float(d) for d in durations) if durations else None
+
+def format_result(result):
+    """検査結果を1行にする"""
+    status = "OK" if result["ok"] else "NG"
+    line = f"[{status}] {os.path.basename(result['path'])}: {result['duration_sec']:.1f}秒"
+    if result.get("expected_sec"):
+        line += f" / 期待 {result['expected_sec']:.1f}秒"
+    if result["problems"]:
+        line += " - " + "; ".join(result["problems"])
+    return line
+
+def episode_id_from_path(path):
+    """{日付}_{タイトル}_{エピソードID}.mp3 からエピソードIDを取り出す"""
+    return os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[-1]
+
+def audio_hash(path, limit=HASH_BYTES):
+    """音声ファイルのサイズと先頭 limit バイトのハッシュ（同じ音声が別のエピソードに付いていないかの照合用）"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(limit))
+    return f"{os.path.getsize(path)}:{digest.hexdigest()}"
+
+def load_bad_audio(path=BAD_AUDIO_FILE):
+    """検査に通らなかったエピソードの記録を読み込む（エピソードID → 情報）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"検査記録の読み込みエラー: {e}")
+        return {}
+
+def save_bad_audio(bad, path=BAD_AUDIO_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(bad, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def mark_bad(episode_id, result, source, path=BAD_AUDIO_FILE):
+    """検査に通らなかったエピソードを記録し、これまでの回数を返す"""
+    with file_lock(path):
+        return _mark_bad(episode_id, result, source, path)
+
+def _mark_bad(episode_id, result, source, path):
+    bad = load_bad_audio(path)
+    entry = bad.get(episode_id, {"attempts": 0})
+    exists = os.path.exists(result["path"])
+    entry.update({
+        "file": os.path.basename(result["path"]),
+        # チェックアウトで更新時刻は変わるので、再ダウンロードされたかはサイズとハッシュで見分ける
+        "size": os.path.getsize(result["path"]) if exists else None,
+        "audio_hash": audio_hash(result["path"]) if exists else None,
+        "problems": result["problems"],
+        "duration_sec": result["duration_sec"],
+        "expected_sec": result.get("expected_sec"),
+        "source": source,
+        "checked_at": time.time(),
+        "attempts": entry["attempts"] + 1,
+    })
+    bad[episode_id] = entry
+    save_bad_audio(bad, path)
+    return entry["attempts"]
+
+def same_audio(entry, mp3_file, hash_value=None):
+    """検査記録を付けたときと同じ音声ファイルか（再ダウンロードされていなければTrue）
+
+    サイズが違えばハッシュを求めずに別のファイルとする。hash_value は索引などで分かっていれば渡す。
+    ハッシュのない古い記録だけは更新時刻で比べる。
+    """
+    if not os.path.exists(mp3_file):
+        return False
+    if not entry.get("audio_hash"):
+        return os.path.getmtime(mp3_file) <= entry.get("checked_at", 0)
+    if entry.get("size") is not None and entry["size"] != os.path.getsize(mp3_file):
+        return False
+    return (hash_value or audio_hash(mp3_file)) == entry["audio_hash"]
+
+def clear_bad(episode_id, path=BAD_AUDIO_FILE):
+    """再ダウンロードして検査に通ったエピソードを記録から外す"""
+    with file_lock(path):
+        bad = load_bad_audio(path)
+        if bad.pop(episode_id, None) is not None:
+            save_bad_audio(bad, path)
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='ダウンロードした音声ファイルが壊れていないか検査します')
+    parser.add_argument('paths', nargs='*', help='検査するファイル（省略時は --mp3_dir の全MP3）')
+    parser.add_argument('--mp3_dir', type=str, default='mp3_downloads',
+                        help='MP3ファイルのディレクトリパス')
+    parser.add_argument('--expected_sec', type=float, default=None,
+                        help='期待する長さ（秒）')
+    parser.add_argument('--mark', action='store_true',
+                        help='検査に通らなかったファイルを再ダウンロード対象として記録する')
+    parser.add_argument('--bad_audio_file', type=str, default=BAD_AUDIO_FILE,
+                        help='検査に通らなかったエピソードの記録ファイル')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    paths = args.paths or sorted(glob.glob(os.path.join(args.mp3_dir, '*.mp3')))
+    start = time.perf_counter()
+    total_bytes = 0
+    bad_count = 0
+    for path in paths:
+        result = verify_file(path, args.expected_sec)
+        total_bytes += result["size"]
+        print(format_result(result))
+        if not result["ok"]:
+            bad_count += 1
+            if args.mark:
+                mark_bad(episode_id_from_path(path), result, "audio_verify", args.bad_audio_file)
+    elapsed = time.perf_counter() - start
+    rate = total_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    print(f"\n検査完了: {len(paths)}件中 {bad_count}件に問題があります（{elapsed:.2f}秒, {rate:.0f}MB/秒）")
+
+if __name__ == "__main__":
+    main()
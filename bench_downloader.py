@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import downloader
+import instrumentation
+from http_cache import HttpCache, get_http_cache, set_http_cache
+from debug_capture import get_debug_capture
+from fake_voicy_server import start_server, add_server_args, config_from_args
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='疑似Voicyサーバーに対してダウンローダー全体のベンチマークを行います')
+    add_server_args(parser)
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='作業ディレクトリ（省略時は一時ディレクトリ）')
+    parser.add_argument('--keep', action='store_true',
+                        help='作業ディレクトリを削除せずに残す')
+    parser.add_argument('--no_debug', action='store_true',
+                        help='デバッグ情報の保存を無効にする')
+    parser.add_argument('--report', type=str, default=None,
+                        help='結果をJSONで保存するパス')
+    return parser.parse_args()
+
+def configure_downloader(workdir, max_downloads):
+    """ダウンローダーの保存先を作業ディレクトリに向ける"""
+    downloader.MP3_DIR = os.path.join(workdir, "mp3_downloads")
+    downloader.TEMP_DIR = os.path.join(workdir, "temp_segments")
+    downloader.DEBUG_DIR = os.path.join(workdir, "debug_files")
+    downloader.OUTPUT_DIR = os.path.join(workdir, "output")
+    downloader.JSON_FILE = os.path.join(downloader.OUTPUT_DIR, "voicy_urls_only.json")
+    downloader.DOWNLOAD_HISTORY_FILE = os.path.join(workdir, "download_history.json")
+    # チャンネル一覧は置かず、上のURLリストと履歴を1チャンネルとして扱わせる
+    downloader.CHANNELS_FILE = os.path.join(workdir, "channels.json")
+    downloader.CHANNELS_DIR = os.path.join(downloader.OUTPUT_DIR, "channels")
+    downloader.BAD_AUDIO_FILE = os.path.join(downloader.OUTPUT_DIR, "bad_audio.json")
+    downloader.EPISODE_INDEX_FILE = os.path.join(downloader.OUTPUT_DIR, "episode_index.bin")
+    downloader.MAX_DOWNLOADS_PER_RUN = max_downloads
+    set_http_cache(HttpCache(os.path.join(workdir, "http_cache")))
+
+def run_benchmark(config, workdir, debug=True):
+    """サーバーを起動してダウンローダーを1回実行し、スループットを返す"""
+    server, _ = start_server(config)
+    try:
+        urls = server.episode_urls()
+        configure_downloader(workdir, len(urls))
+        downloader.DEBUG_MODE = debug
+        os.makedirs(downloader.OUTPUT_DIR, exist_ok=True)
+        with open(downloader.JSON_FILE, "w") as f:
+            json.dump(urls, f, indent=2)
+
+        instrumentation.init("bench_downloader", os.path.join(workdir, "metrics"))
+        start = time.perf_counter()
+        try:
+            downloader.run()
+        finally:
+            elapsed = time.perf_counter() - start
+            instrumentation.finish()
+
+        history = downloader.load_download_history()
+        mp3_files = glob.glob(os.path.join(downloader.MP3_DIR, "*.mp3"))
+        output_bytes = sum(os.path.getsize(path) for path in mp3_files)
+        stats = server.stats
+        return {
+            "episodes": len(urls),
+            "succeeded": sum(1 for url in urls if url in history),
+            "elapsed_sec": round(elapsed, 3),
+            "episodes_per_min": round(60 * len(mp3_files) / elapsed, 3) if elapsed > 0 else None,
+            "server_requests": stats["requests"],
+            "server_bytes_sent": stats["bytes_sent"],
+            "bytes_per_sec": round(stats["bytes_sent"] / elapsed, 1) if elapsed > 0 else None,
+            "output_bytes": output_bytes,
+            "status_counts": {str(k): v for k, v in sorted(stats["status"].items())},
+            "http_cache": dict(get_http_cache().stats),
+            "debug_capture": dict(get_debug_capture().stats),
+            "config": vars(config),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def main():
+    args = setup_args()
+    config = config_from_args(args)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_downloader_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"作業ディレクトリ: {workdir}")
+
+    try:
+        result = run_benchmark(config, workdir, debug=not args.no_debug)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\nベンチマーク結果")
+    print(f"  成功エピソード: {result['succeeded']}/{result['episodes']}")
+    print(f"  所要時間: {result['elapsed_sec']:.2f}秒")
+    print(f"  エピソード/分: {result['episodes_per_min']}")
+    print(f"  受信量: {result['server_bytes_sent'] / (1024 * 1024):.2f}MB ({result['bytes_per_sec'] / 1024:.1f}KB/秒)")
+    print(f"  リクエスト数: {result['server_requests']} {result['status_counts']}")
+    print(f"  {get_http_cache().format_report()}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
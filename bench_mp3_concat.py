@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from mp3_frames import concat_mp3, probe_mp3
+from fake_voicy_server import mp3_frames, frames_for_duration
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='MP3のフレーム単位結合とFFmpegでの結合を比較します')
+    parser.add_argument('--segments', type=int, default=60,
+                        help='結合するセグメント数')
+    parser.add_argument('--segment_sec', type=float, default=10.0,
+                        help='セグメント1個の長さ（秒）')
+    parser.add_argument('--source', choices=['synthetic', 'lame'], default='lame',
+                        help='セグメントの作り方（synthetic: 無音フレームのみ / lame: FFmpegでエンコードしID3とInfoヘッダー付き）')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='計測の繰り返し回数（最短時間を採用）')
+    parser.add_argument('--report', type=str, default=None,
+                        help='結果をJSONで保存するパス')
+    return parser.parse_args()
+
+def make_segments(workdir, count, segment_sec, source):
+    """結合用のセグメントを作る"""
+    paths = []
+    for i in range(count):
+        path = os.path.join(workdir, f"segment_{i:04d}.mp3")
+        if source == "lame":
+            subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi",
+                            "-i", f"sine=frequency={300 + 10 * (i % 50)}:duration={segment_sec}",
+                            "-c:a", "libmp3lame", "-b:a", "128k", path], check=True)
+        else:
+            with open(path, "wb") as f:
+                f.write(mp3_frames(frames_for_duration(segment_sec)))
+        paths.append(path)
+    return paths
+
+def ffmpeg_concat(segment_files, output_file, workdir):
+    """downloader.merge_mp3_files と同じ FFmpeg の concat で結合する"""
+    input_list_file = os.path.join(workdir, "input_list.txt")
+    with open(input_list_file, "w", encoding="utf-8") as f:
+        for segment_file in segment_files:
+            f.write(f"file '{os.path.abspath(segment_file)}'\n")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "concat", "-safe", "0", "-i", input_list_file,
+                    "-c", "copy", "-y", output_file], check=True)
+
+def decode_check(path):
+    """FFmpegで最後まで復号し、エラー行数と長さ（ヘッダーから見た値）を返す"""
+    process = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-f", "null", "-"],
+                             capture_output=True, text=True)
+    probe = subprocess.run(["ffmpeg", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):([\d.]+)", probe.stderr)
+    duration = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3)) if match else None
+    errors = [line for line in process.stderr.splitlines() if line.strip()]
+    return len(errors), duration
+
+def measure(name, func, output_file, repeat):
+    """結合を repeat 回行い、最短時間と出力の検査結果を返す"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    info = probe_mp3(output_file)
+    decode_errors, header_duration = decode_check(output_file)
+    return {
+        "method": name,
+        "best_sec": round(min(times), 4),
+        "mean_sec": round(sum(times) / len(times), 4),
+        "output_bytes": os.path.getsize(output_file),
+        "frames": info["frames"],
+        "duration_sec": round(info["duration_sec"], 3),
+        "header": info["info_tag"],
+        "header_frames": info["info_frames"],
+        "ffmpeg_duration_sec": header_duration,
+        "decode_errors": decode_errors,
+    }
+
+def main():
+    args = setup_args()
+    workdir = tempfile.mkdtemp(prefix="bench_mp3_concat_")
+    try:
+        print(f"セグメントを作成中: {args.segments}個 × {args.segment_sec}秒 ({args.source})")
+        segments = make_segments(workdir, args.segments, args.segment_sec, args.source)
+        input_bytes = sum(os.path.getsize(path) for path in segments)
+
+        in_process_file = os.path.join(workdir, "in_process.mp3")
+        ffmpeg_file = os.path.join(workdir, "ffmpeg.mp3")
+        results = [
+            measure("in_process", lambda: concat_mp3(segments, in_process_file), in_process_file, args.repeat),
+            measure("ffmpeg", lambda: ffmpeg_concat(segments, ffmpeg_file, workdir), ffmpeg_file, args.repeat),
+        ]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nベンチマーク結果（入力 {input_bytes / (1024 * 1024):.2f}MB, 期待する長さ {args.segments * args.segment_sec:.1f}秒）")
+    print(f"{'方法':<12}{'最短(秒)':>10}{'平均(秒)':>10}{'出力MB':>9}{'フレーム':>9}{'長さ(秒)':>10}{'FFmpeg長さ':>12}{'ヘッダー':>8}{'復号エラー':>10}")
+    for r in results:
+        print(f"{r['method']:<12}{r['best_sec']:>10.3f}{r['mean_sec']:>10.3f}{r['output_bytes'] / (1024 * 1024):>9.2f}"
+              f"{r['frames']:>9}{r['duration_sec']:>10.2f}{str(r['ffmpeg_duration_sec']):>12}{str(r['header']):>8}"
+              f"{r['decode_errors']:>10}")
+    speedup = results[1]["best_sec"] / results[0]["best_sec"] if results[0]["best_sec"] > 0 else None
+    if speedup:
+        print(f"フレーム単位の結合は FFmpeg の {speedup:.1f}倍の速さです")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "input_bytes": input_bytes, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+
+import instrumentation
+import pipeline
+from bench_downloader import configure_downloader
+from fake_voicy_server import start_server, add_server_args, config_from_args
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='疑似Voicyサーバーに対してパイプライン全体を流し、エピソードごとの所要時間を測ります')
+    add_server_args(parser)
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='作業ディレクトリ（省略時は一時ディレクトリ）')
+    parser.add_argument('--keep', action='store_true',
+                        help='作業ディレクトリを削除せずに残す')
+    parser.add_argument('--transcribe', action='store_true',
+                        help='推論を模擬せず、実際にWhisperで書き起こす')
+    parser.add_argument('--report', type=str, default=None,
+                        help='結果をJSONで保存するパス')
+    return parser.parse_known_args()
+
+def run_benchmark(config, workdir, pipeline_argv):
+    """サーバーを起動し、空のURLリストから一覧ページで発見させてパイプラインを1回流す"""
+    server, _ = start_server(config)
+    try:
+        configure_downloader(workdir, config.episodes)
+        # 一覧ページから新着を発見させるため、URLリストは空のチャンネルを1つだけ置く
+        with open(pipeline.downloader.CHANNELS_FILE, "w", encoding="utf-8") as f:
+            json.dump([{"id": "9999", "name": "benchmark", "page_url": f"{server.base_url}/channel/9999/all"}], f)
+        args = pipeline.setup_args(["--discover_pages", "--limit", str(config.episodes),
+                                    "--text_dir", os.path.join(workdir, "mp3_text"),
+                                    "--segments_dir", os.path.join(workdir, "mp3_segments"),
+                                    "--index", os.path.join(workdir, "output", "related_index.json.gz"),
+                                    "--check_file", os.path.join(workdir, "output", "consistency_check.json")]
+                                   + pipeline_argv)
+        instrumentation.init("bench_pipeline", os.path.join(workdir, "metrics"))
+        try:
+            summary = pipeline.run(args)
+        finally:
+            instrumentation.finish()
+        summary["server_requests"] = server.stats["requests"]
+        summary["config"] = {"server": vars(config), "pipeline": vars(args)}
+        return summary
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def main():
+    args, pipeline_argv = setup_args()
+    config = config_from_args(args)
+    if not args.transcribe:
+        pipeline_argv = ["--dry_run"] + pipeline_argv
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"作業ディレクトリ: {workdir}")
+
+    try:
+        summary = run_benchmark(config, workdir, pipeline_argv)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\nベンチマーク結果")
+    print(pipeline.format_summary(summary))
+    # 段階を重ねずに1件ずつ順に処理した場合（従来の別々のジョブを続けて回した場合の下限）との比較
+    sequential = sum(times["service"] for row in summary["results"] for times in row["stages"].values())
+    if summary["elapsed_sec"] > 0:
+        print(f"1件ずつ順に処理した場合の見積もり {sequential:.1f}秒（パイプラインは {sequential / summary['elapsed_sec']:.2f}倍の速さ）")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import argparse
+import logging
+
+import instrumentation
+from audio_preprocess import load_audio, preprocess, format_stats
+from bench_speculative import char_error_rate, read_reference
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('bench_preprocess')
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='無音の詰めとテンポの変更が書き起こしの速度と精度に与える影響を測ります')
+    parser.add_argument('files', nargs='*', help='書き起こすMP3ファイル（省略時は --mp3_dir から --limit 件）')
+    parser.add_argument('--mp3_dir', type=str, default='mp3_downloads',
+                        help='MP3ファイルのディレクトリパス')
+    parser.add_argument('--limit', type=int, default=3,
+                        help='ベンチマークに使うファイル数')
+    parser.add_argument('--model', type=str, default='medium',
+                        help='Whisperモデルのサイズ')
+    parser.add_argument('--tempos', type=str, default='1.25,1.5',
+                        help='比べるテンポ（カンマ区切り、無音の詰めと組み合わせる）')
+    parser.add_argument('--reference_dir', type=str, default=None,
+                        help='基準にする書き起こしテキストのディレクトリ（省略時は前処理なしの結果を基準にする）')
+    parser.add_argument('--report', type=str, default=None,
+                        help='結果をJSONで保存するパス')
+    return parser.parse_args()
+
+def variants(tempos):
+    """比べる前処理の組み合わせ (名前, 無音を詰めるか, テンポ)"""
+    yield "raw", False, 1.0
+    yield "trim", True, 1.0
+    for tempo in tempos:
+        yield f"trim+x{tempo}", True, tempo
+
+def main():
+    args = setup_args()
+    files = args.files or sorted(glob.glob(os.path.join(args.mp3_dir, '*.mp3')))[:args.limit]
+    if not files:
+        raise SystemExit("ベンチマークに使うMP3ファイルがありません")
+    tempos = [float(tempo) for tempo in args.tempos.split(",") if tempo.strip()]
+
+    instrumentation.init("bench_preprocess")
+    from transcribe import load_model
+    model = load_model(args.model)
+
+    rows = []
+    for mp3_file in files:
+        base_name = os.path.basename(mp3_file)
+        audio = load_audio(mp3_file)
+        reference = read_reference(args.reference_dir, mp3_file) if args.reference_dir else None
+        for name, trim_silence, tempo in variants(tempos):
+            start = time.perf_counter()
+            processed, time_map, stats = preprocess(audio, trim_silence, tempo)
+            preprocess_sec = time.perf_counter() - start
+            logger.info(f"{base_name} [{name}] {format_stats(stats)}")
+            result = time_map.project_result(model.transcribe(processed, language="ja"))
+            elapsed = time.perf_counter() - start
+            if name == "raw" and reference is None:
+                reference = result["text"]
+            segments = result.get("segments", [])
+            rows.append({
+                "file": base_name,
+                "variant": name,
+                "original_sec": stats["original_sec"],
+                "processed_sec": stats["processed_sec"],
+                "preprocess_sec": round(preprocess_sec, 3),
+                "elapsed_sec": round(elapsed, 3),
+                "rtf": round(elapsed / stats["original_sec"], 4) if stats["original_sec"] else None,
+                "cer": char_error_rate(result["text"], reference),
+                # 元の時刻に戻したあとの最後のセグメントの終了時刻（元の長さに近いほど対応表が正しい）
+                "last_end_sec": round(segments[-1]["end"], 2) if segments else None,
+            })
+
+    instrumentation.finish()
+
+    print(f"\nベンチマーク結果（モデル {args.model}、基準 {args.reference_dir or '前処理なし'}）")
+    print(f"{'ファイル':<34}{'前処理':<12}{'元(秒)':>8}{'処理後(秒)':>11}{'所要(秒)':>10}{'RTF':>8}{'CER':>8}{'最終時刻':>10}")
+    for row in rows:
+        cer = "-" if row["cer"] is None else f"{100 * row['cer']:.2f}%"
+        last_end = "-" if row["last_end_sec"] is None else f"{row['last_end_sec']:.1f}"
+        print(f"{row['file'][:32]:<34}{row['variant']:<12}{row['original_sec']:>8.0f}{row['processed_sec']:>11.0f}"
+              f"{row['elapsed_sec']:>10.1f}{row['rtf']:>8.3f}{cer:>8}{last_end:>10}")
+
+    by_variant = {}
+    for row in rows:
+        by_variant.setdefault(row["variant"], []).append(row)
+    raw_elapsed = sum(row["elapsed_sec"] for row in by_variant["raw"])
+    for name, variant_rows in by_variant.items():
+        elapsed = sum(row["elapsed_sec"] for row in variant_rows)
+        print(f"{name:<12} 合計 {elapsed:.1f}秒（前処理なしの {raw_elapsed / elapsed:.2f}倍の速さ）")
+
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import glob
+import json
+import time
+import argparse
+import logging
+import unicodedata
+
+import instrumentation
+from instrumentation import import_span
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('bench_speculative')
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='2段階の書き起こし（下書き＋低信頼区間の再デコード）の速度と精度を比べます')
+    parser.add_argument('files', nargs='*', help='書き起こすMP3ファイル（省略時は --mp3_dir から --limit 件）')
+    parser.add_argument('--mp3_dir', type=str, default='mp3_downloads',
+                        help='MP3ファイルのディレクトリパス')
+    parser.add_argument('--limit', type=int, default=3,
+                        help='ベンチマークに使うファイル数')
+    parser.add_argument('--model', type=str, default='medium',
+                        help='再デコードに使う大きいモデル（基準の書き起こしにも使う）')
+    parser.add_argument('--draft_model', type=str, default='small',
+                        help='下書きに使う小さいモデル')
+    parser.add_argument('--reference_dir', type=str, default=None,
+                        help='基準にする書き起こしテキストのディレクトリ（mp3_text など。省略時は --model で全体を書き起こして基準にする）')
+    parser.add_argument('--report', type=str, default=None,
+                        help='結果をJSONで保存するパス')
+    return parser.parse_args()
+
+def normalize(text):
+    """文字誤り率を測るために、表記ゆれ（全角半角・空白・句読点）を除く"""
+    text = unicodedata.normalize("NFKC", text)
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+def edit_distance(a, b):
+    """文字単位の編集距離（Myers のビット並列アルゴリズム。a の長さ分のビット列を整数で持つ）"""
+    if not a:
+        return len(b)
+    if not b:
+        return len(a)
+    peq = {}
+    for i, ch in enumerate(a):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask = (1 << len(a)) - 1
+    high = 1 << (len(a) - 1)
+    pv, mv, score = mask, 0, len(a)
+    for ch in b:
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+def char_error_rate(hypothesis, reference):
+    """基準に対する文字誤り率（CER）"""
+    reference = normalize(reference)
+    if not reference:
+        return None
+    return edit_distance(reference, normalize(hypothesis)) / len(reference)
+
+def read_reference(reference_dir, mp3_file):
+    """mp3_text 形式の書き起こし（先頭のタイトルと日付の行を除く）を読む"""
+    text_file = os.path.join(reference_dir, os.path.basename(mp3_file).replace('.mp3', '.txt'))
+    if not os.path.exists(text_file):
+        return None
+    with open(text_file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return re.sub(r"\A# .*\n日付: .*\n\n", "", text)
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main():
+    args = setup_args()
+    files = args.files or sorted(glob.glob(os.path.join(args.mp3_dir, '*.mp3')))[:args.limit]
+    if not files:
+        raise SystemExit("ベンチマークに使うMP3ファイルがありません")
+
+    instrumentation.init("bench_speculative")
+    with import_span("whisper"):
+        import whisper
+    from transcribe import load_model
+    from speculative import transcribe_speculative
+    final_model = load_model(args.model)
+    draft_model = load_model(args.draft_model)
+
+    rows = []
+    for mp3_file in files:
+        base_name = os.path.basename(mp3_file)
+        audio = whisper.load_audio(mp3_file)
+        duration = len(audio) / 16000
+        logger.info(f"計測中: {base_name} ({duration:.0f}秒)")
+
+        row = {"file": base_name, "duration_sec": round(duration, 2)}
+        reference = read_reference(args.reference_dir, mp3_file) if args.reference_dir else None
+        if reference is None:
+            result, row["final_sec"] = timed(lambda: final_model.transcribe(audio, language="ja"))
+            reference = result["text"]
+            row["reference"] = args.model
+        else:
+            row["reference"] = args.reference_dir
+
+        draft, row["draft_sec"] = timed(lambda: draft_model.transcribe(audio, language="ja"))
+        speculative, row["speculative_sec"] = timed(
+            lambda: transcribe_speculative(audio, draft_model, final_model, args.draft_model, args.model))
+        row["draft_cer"] = char_error_rate(draft["text"], reference)
+        row["speculative_cer"] = char_error_rate(speculative["text"], reference)
+        row["redecoded_sec"] = speculative["speculative"]["redecoded_sec"]
+        row["spans"] = speculative["speculative"]["spans"]
+        rows.append(row)
+
+    instrumentation.finish()
+
+    def rate(value):
+        return "-" if value is None else f"{100 * value:.2f}%"
+
+    print(f"\nベンチマーク結果（下書き {args.draft_model} / 再デコード {args.model}）")
+    print(f"{'ファイル':<40}{'長さ(秒)':>9}{args.model + '(秒)':>12}{args.draft_model + '(秒)':>12}"
+          f"{'2段階(秒)':>11}{'再デコード':>11}{'下書きCER':>11}{'2段階CER':>11}")
+    for row in rows:
+        final = f"{row['final_sec']:.1f}" if "final_sec" in row else "-"
+        print(f"{row['file'][:38]:<40}{row['duration_sec']:>9.0f}{final:>12}{row['draft_sec']:>12.1f}"
+              f"{row['speculative_sec']:>11.1f}{100 * row['redecoded_sec'] / max(row['duration_sec'], 1e-9):>10.0f}%"
+              f"{rate(row['draft_cer']):>11}{rate(row['speculative_cer']):>11}")
+
+    total_audio = sum(row["duration_sec"] for row in rows)
+    total_speculative = sum(row["speculative_sec"] for row in rows)
+    print(f"2段階の実時間係数: {total_speculative / total_audio:.3f}")
+    timed_rows = [row for row in rows if "final_sec" in row]
+    if timed_rows:
+        speedup = sum(row["final_sec"] for row in timed_rows) / sum(row["speculative_sec"] for row in timed_rows)
+        print(f"2段階は {args.model} 単独の {speedup:.2f}倍の速さです")
+
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
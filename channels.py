@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import zlib
+import time
+import argparse
+
+from work_queue import file_lock
+
+CHANNELS_FILE = "channels.json"  # 追いかけるチャンネルの一覧
+CHANNELS_DIR = os.path.join("output", "channels")  # チャンネルごとのURLリスト・履歴・状態の保存先
+
+def _channel_paths(channel_id, channels_dir):
+    base = os.path.join(channels_dir, channel_id)
+    return {
+        "urls_file": os.path.join(base, "voicy_urls_only.json"),
+        "episodes_file": os.path.join(base, "voicy_episodes.json"),
+        "history_file": os.path.join(base, "download_history.json"),
+        "state_file": os.path.join(base, "state.json"),
+    }
+
+def load_channels(path=CHANNELS_FILE, channels_dir=CHANNELS_DIR, include_disabled=False):
+    """チャンネル一覧を読み込む（一覧ファイルがなければNone）
+
+    各チャンネルは id / name / weight とファイルの場所を持つ。ファイルの場所を
+    書かなければ channels_dir/<id>/ の下になる（既存のチャンネルは従来の場所を指定できる）。
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    channels = []
+    seen = set()
+    for entry in entries:
+        channel_id = str(entry["id"])
+        if channel_id in seen:
+            raise ValueError(f"チャンネルIDが重複しています: {channel_id}")
+        seen.add(channel_id)
+        if not include_disabled and not entry.get("enabled", True):
+            continue
+        channel = _channel_paths(channel_id, channels_dir)
+        channel.update({key: value for key, value in entry.items() if value is not None})
+        channel["id"] = channel_id
+        channel.setdefault("name", channel_id)
+        channel["weight"] = max(1, int(channel.get("weight", 1)))
+        channels.append(channel)
+    return channels
+
+def legacy_channel(urls_file, history_file, state_file=None):
+    """一覧ファイルがないときに使う、従来の1チャンネル構成"""
+    return {"id": "default", "name": "default", "weight": 1,
+            "urls_file": urls_file, "history_file": history_file, "state_file": state_file}
+
+def _load_json(path, default):
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"JSONファイルの読み込みエラー: {path}: {e}")
+        return default
+
+def _save_json(path, data):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def load_urls(channel):
+    """チャンネルのURLリストを読み込む"""
+    return _load_json(channel["urls_file"], [])
+
+def add_urls(channel, urls):
+    """新しく見つかったURLをURLリストの末尾に加えて保存し、加えたURLを返す"""
+    with file_lock(channel["urls_file"]):
+        known = load_urls(channel)
+        seen = set(known)
+        added = []
+        for url in urls:
+            if url not in seen:
+                added.append(url)
+                seen.add(url)
+        if added:
+            _save_json(channel["urls_file"], known + added)
+    return added
+
+def load_history(channel):
+    """チャンネルのダウンロード履歴を読み込む"""
+    return _load_json(channel["history_file"], [])
+
+def save_history(channel, history):
+    """チャンネルのダウンロード履歴を保存する"""
+    _save_json(channel["history_file"], history)
+
+def update_history(channel, added, removed=()):
+    """読み直した履歴に追加・削除を反映して保存する（同じチャンネルを処理する他のワーカーの追加を消さない）"""
+    removed = set(removed)
+    with file_lock(channel["history_file"]):
+        history = [url for url in load_history(channel) if url not in removed]
+        known = set(history)
+        for url in added:
+            if url not in known:
+                history.append(url)
+                known.add(url)
+        save_history(channel, history)
+    return history
+
+def load_state(channel):
+    """チャンネルの状態（最後に順番が回ってきた時刻・累計件数など）を読み込む"""
+    return _load_json(channel.get("state_file"), {})
+
+def save_state(channel, state):
+    _save_json(channel.get("state_file"), state)
+
+def parse_shard(text):
+    """"i/n" 形式のシャード指定を (i, n) にする"""
+    match = re.fullmatch(r"(\d+)/(\d+)", text.strip())
+    if not match:
+        raise ValueError(f"シャードは i/n の形式で指定してください: {text}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError(f"シャード番号は 0 以上 {count} 未満です: {text}")
+    return index, count
+
+def shard_of(key, count):
+    """チャンネルやエピソードを受け持つシャード番号（増減で他の割り当てが動かないようIDのハッシュで決める）"""
+    return zlib.crc32(str(key).encode("utf-8")) % count
+
+def in_shard(episode_id, shard):
+    """エピソードが (i, n) のシャードの受け持ちか（shard が None ならすべて）"""
+    return shard is None or shard_of(episode_id, shard[1]) == shard[0]
+
+def select_channels(channels, shard=None, channel_ids=None):
+    """シャードとチャンネルIDの指定で対象のチャンネルを絞り込む"""
+    if channel_ids:
+        wanted = {str(channel_id) for channel_id in channel_ids}
+        channels = [channel for channel in channels if channel["id"] in wanted]
+    if shard is not None:
+        index, count = shard
+        channels = [channel for channel in channels if shard_of(channel["id"], count) == index]
+    return channels
+
+def schedule_fair(pending, limit, channels, states):
+    """チャンネルごとの未処理URLから、重み付きラウンドロビンで最大 limit 件を選ぶ
+
+    順番は前回割り当てられた時刻が古いチャンネルから回すので、limit がチャンネル数より
+    少なくても同じチャンネルばかりが選ばれることはない。(チャンネル, URL) のリストを返す。
+    """
+    order = sorted((channel for channel in channels if pending.get(channel["id"])),
+                   key=lambda channel: (states.get(channel["id"], {}).get("last_scheduled", 0), channel["id"]))
+    cursors = {channel["id"]: 0 for channel in order}
+    selected = []
+    while order and len(selected) < limit:
+        remaining = []
+        for channel in order:
+            urls = pending[channel["id"]]
+            take = min(channel["weight"], len(urls) - cursors[channel["id"]], limit - len(selected))
+            for url in urls[cursors[channel["id"]]:cursors[channel["id"]] + take]:
+                selected.append((channel, url))
+            cursors[channel["id"]] += take
+            if cursors[channel["id"]] < len(urls):
+                remaining.append(channel)
+            if len(selected) >= limit:
+                break
+        order = remaining
+    return selected
+
+def mark_scheduled(channel, state, scheduled, downloaded, scheduled_at):
+    """実行結果をチャンネルの状態に反映する（scheduled_at は最後に処理したURLの開始時刻）"""
+    state["last_scheduled"] = scheduled_at
+    state["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    state["scheduled_total"] = state.get("scheduled_total", 0) + scheduled
+    state["downloaded_total"] = state.get("downloaded_total", 0) + downloaded
+    return state
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='追いかけるチャンネルの一覧とシャードの割り当てを表示します')
+    parser.add_argument('command', choices=['list', 'matrix'],
+                        help='list: 一覧とシャードの割り当てを表示 / matrix: GitHub Actions の matrix 用JSONを出力')
+    parser.add_argument('--channels_file', type=str, default=CHANNELS_FILE,
+                        help='チャンネル一覧のJSONファイル')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='シャード数')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    channels = load_channels(args.channels_file)
+    if channels is None:
+        raise SystemExit(f"チャンネル一覧がありません: {args.channels_file}")
+
+    if args.command == "matrix":
+        # スクレイパーの matrix にはチャンネルごとの出力先を渡す
+        include = [{"id": channel["id"], "name": channel["name"],
+                    "urls_file": channel["urls_file"], "episodes_file": channel["episodes_file"]}
+                   for channel in channels]
+        print(json.dumps({"include": include}, ensure_ascii=False))
+        return
+
+    for channel in channels:
+        urls = load_urls(channel)
+        history = set(load_history(channel))
+        pending = sum(1 for url in urls if url not in history)
+        state = load_state(channel)
+        print(f"{channel['id']:>8}  {channel['name']}  shard {shard_of(channel['id'], args.shards)}/{args.shards}  "
+              f"重み {channel['weight']}  URL {len(urls)}件  未ダウンロード {pending}件  "
+              f"前回 {state.get('last_run', '-')}")
+
+if __name__ == "__main__":
+    main()
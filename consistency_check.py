@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+import logging
+from collections import Counter
+
+from instrumentation import span
+from audio_verify import BAD_AUDIO_FILE, verify_mp3, mark_bad, episode_id_from_path, audio_hash
+from related_index import char_ngrams, normalize_text, read_transcript
+from segment_export import partition_path, load_segments
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('consistency_check')
+
+CHECK_FILE = os.path.join("output", "consistency_check.json")  # 先頭の書き起こしと判定結果のキャッシュ
+EPISODES_FILE = os.path.join("output", "voicy_episodes.json")  # タイトルの一覧（スクレイパーの出力）
+CHECK_MODEL = "tiny"  # 先頭を書き起こすモデル
+HEAD_SEC = 60.0  # 書き起こす先頭の長さ（秒）
+CHARS_PER_SEC = 6.0  # 書き起こし済みのテキストから先頭を切り出すときの1秒あたりの文字数の目安
+NGRAM_RANGE = (2, 2)  # 照合に使う文字n-gram（書き起こしの誤変換に強いよう短くする）
+MATCH_SCORE = 0.6  # タイトルがこれ以上一致すれば、音声はそのエピソードのものとみなす
+MATCH_MARGIN = 0.4  # 他のエピソードのタイトルが自分よりこれ以上よく一致すれば食い違いとみなす
+LOW_SCORE = 0.2  # 自分のタイトル・説明文の一致がこれ未満で、食い違いとも言えなければ判定を保留する
+MIN_HEAD_CHARS = 40  # 先頭の書き起こしがこれより短ければ判定しない（無音・音楽だけの冒頭など）
+MIN_REFERENCE_GRAMS = 3  # これより短いタイトルは他のエピソードの候補にしない（偶然の一致が多い）
+MAX_REQUEUES = 2  # 同じエピソードを食い違いで再ダウンロードに回す上限（音声のハッシュが変わった回数。超えたらそのまま書き起こす）
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='音声の先頭の書き起こしとタイトル・説明文を照合し、別のエピソードの音声を見つけます')
+    parser.add_argument('files', nargs='*', help='検査するMP3ファイル（省略時は --mp3_dir の全ファイル）')
+    parser.add_argument('--mp3_dir', type=str, default='mp3_downloads',
+                        help='MP3ファイルのディレクトリパス')
+    parser.add_argument('--text_dir', type=str, default='mp3_text',
+                        help='書き起こしテキストのディレクトリパス（書き起こし済みなら先頭を再利用する）')
+    parser.add_argument('--segments_dir', type=str, default='mp3_segments',
+                        help='セグメント単位の書き起こし結果のディレクトリパス（書き起こし済みなら先頭を再利用する）')
+    parser.add_argument('--audit_texts', action='store_true',
+                        help='MP3ではなく書き起こし済みのテキストを検査する（MP3が手元にないエピソードも対象）')
+    parser.add_argument('--model', type=str, default=CHECK_MODEL,
+                        help='先頭の書き起こしに使うWhisperモデル')
+    parser.add_argument('--head_sec', type=float, default=HEAD_SEC,
+                        help='書き起こす先頭の長さ（秒）')
+    parser.add_argument('--offline', action='store_true',
+                        help='エピソードページから説明文を取得しない')
+    parser.add_argument('--requeue', action='store_true',
+                        help='食い違ったエピソードを再ダウンロード対象に記録し、書き起こし済みの結果を削除して書き起こし直させる')
+    parser.add_argument('--bad_audio_file', type=str, default=BAD_AUDIO_FILE,
+                        help='再ダウンロード対象の記録ファイル')
+    parser.add_argument('--check_file', type=str, default=CHECK_FILE,
+                        help='先頭の書き起こしと判定結果のキャッシュ')
+    parser.add_argument('--report', type=str, default=None,
+                        help='判定結果をJSONで保存するパス')
+    return parser.parse_args()
+
+def load_catalog(episodes_files=None):
+    """エピソードID → タイトル・URL・日付（スクレイパーが出力したエピソード一覧から）"""
+    if episodes_files is None:
+        from channels import load_channels
+        channels = load_channels() or []
+        episodes_files = [channel["episodes_file"] for channel in channels if channel.get("episodes_file")]
+        episodes_files = episodes_files or [EPISODES_FILE]
+    catalog = {}
+    for path in episodes_files:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                episodes = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"エピソード一覧の読み込みエラー: {path}: {e}")
+            continue
+        for episode in episodes:
+            if episode.get("id") and episode.get("title"):
+                catalog[str(episode["id"])] = episode
+    return catalog
+
+def title_from_path(path):
+    """{日付}_{タイトル}_{エピソードID}.mp3 からタイトルを取り出す"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    parts = stem.split('_', 1)
+    return parts[1].rsplit('_', 1)[0] if len(parts) > 1 else stem
+
+class TitleMatcher:
+    """タイトル・説明文の文字n-gramのうち、先頭の書き起こしに現れる割合をidfで重み付けして測る
+
+    「の」「ます」のようにどのタイトルにも現れるn-gramは、タイトル一覧から求めたidfで軽くする。
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.grams = {episode_id: set(char_ngrams(episode["title"], NGRAM_RANGE))
+                      for episode_id, episode in catalog.items()}
+        df = Counter()
+        for grams in self.grams.values():
+            df.update(grams)
+        n_docs = len(self.grams)
+        self.idf = {gram: math.log((n_docs + 1) / (count + 1)) + 1.0 for gram, count in df.items()}
+        self.default_idf = math.log(n_docs + 1) + 1.0
+
+    def score(self, reference_grams, head_grams):
+        """reference のn-gramのうち先頭の書き起こしに現れる割合（idfの重み付き、0〜1）"""
+        if not reference_grams:
+            return 0.0
+        weights = {gram: self.idf.get(gram, self.default_idf) for gram in reference_grams}
+        total = sum(weights.values())
+        return sum(weight for gram, weight in weights.items() if gram in head_grams) / total
+
+    def best_other(self, head_grams, exclude):
+        """自分以外で最も一致するエピソード (スコア, エピソードID)"""
+        best = (0.0, None)
+        for episode_id, grams in self.grams.items():
+            if episode_id == exclude or len(grams) < MIN_REFERENCE_GRAMS:
+                continue
+            score = self.score(grams, head_grams)
+            if score > best[0]:
+                best = (score, episode_id)
+        return best
+
+class ConsistencyChecker:
+    """音声の先頭を安く書き起こし、ページのタイトル・説明文と食い違うエピソードを見つける
+
+    先頭の書き起こしは、キャッシュ → 書き起こし済みのセグメント → 書き起こし済みのテキスト →
+    小さいモデルの順に探す。自分のタイトル・説明文がほとんど一致せず、他のエピソードのタイトルが
+    よく一致するか、同じ音声が他のエピソードにも付いていれば食い違いと判定する。
+    """
+
+    def __init__(self, catalog=None, check_file=CHECK_FILE, text_dir="mp3_text", segments_dir="mp3_segments",
+                 model_name=CHECK_MODEL, head_sec=HEAD_SEC, fetch_pages=True):
+        self.catalog = load_catalog() if catalog is None else catalog
+        self.matcher = TitleMatcher(self.catalog)
+        self.check_file = check_file
+        self.text_dir = text_dir
+        self.segments_dir = segments_dir
+        self.model_name = model_name
+        self.head_sec = head_sec
+        self.fetch_pages = fetch_pages
+        self.cache = self._load_cache()
+        self.stats = Counter()
+        # キャッシュ・指紋・集計だけを守る（推論とページの取得はロックの外で行い、他の段階を止めない）
+        self._lock = threading.Lock()
+        # 音声のハッシュ・先頭の書き起こし → エピソードID（同じ音声が付いた別のエピソードを探す）
+        self.fingerprints = {}
+        for episode_id, entry in self.cache.items():
+            for key in self._fingerprint_keys(entry.get("audio_hash"), entry.get("head_text")):
+                self.fingerprints.setdefault(key, episode_id)
+
+    def _load_cache(self):
+        if not self.check_file or not os.path.exists(self.check_file):
+            return {}
+        try:
+            with open(self.check_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"キャッシュの読み込みエラー: {e}")
+            return {}
+
+    def save(self):
+        if not self.check_file:
+            return
+        os.makedirs(os.path.dirname(self.check_file) or '.', exist_ok=True)
+        tmp_path = self.check_file + ".tmp"
+        with self._lock, open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.check_file)
+
+    # --- 先頭の書き起こし ---
+
+    def cached_head(self, episode_id, mp3_file, hash_value=None):
+        """書き起こし済みの結果から先頭 head_sec 秒分の文字列を取り出す (文字列, 出どころ)
+
+        キャッシュは音声のハッシュが同じときだけ使う（チェックアウトで変わる更新時刻では判定しない）。
+        """
+        with self._lock:
+            entry = dict(self.cache.get(episode_id) or {})
+        if (entry and entry.get("head_text") and entry.get("audio_hash") == hash_value
+                and entry.get("head_sec") == self.head_sec):
+            return entry["head_text"], "cache"
+
+        # 書き起こしの時刻が残っていればそれで切り出し、なければ文字数の目安で切り出す
+        date_str = os.path.basename(mp3_file).split('_', 1)[0]
+        segments_path = partition_path(self.segments_dir, date_str, episode_id) if self.segments_dir else None
+        if segments_path and os.path.exists(segments_path):
+            columns = load_segments(segments_path, ["start", "text"])
+            return "".join(str(text) for start, text in zip(columns["start"], columns["text"])
+                           if start < self.head_sec), "segments"
+        text_file = os.path.join(self.text_dir, os.path.basename(mp3_file).replace('.mp3', '.txt')) if self.text_dir else None
+        if text_file and os.path.exists(text_file):
+            _, body = read_transcript(text_file)
+            return body.strip()[:int(self.head_sec * CHARS_PER_SEC)], "text"
+        return None, None
+
+    def transcribe_head(self, mp3_file, audio=None):
+        """小さいモデルで先頭 head_sec 秒だけを書き起こす（audio があればその先頭を使う）"""
+        from transcribe import load_model
+        model = load_model(self.model_name)
+        if audio is None:
+            from audio_preprocess import load_audio
+            audio = load_audio(mp3_file, duration=self.head_sec)
+        head = audio[:int(self.head_sec * 16000)]
+        with span("inference", model=self.model_name, audio_sec=len(head) / 16000, phase="consistency"):
+            result = model.transcribe(head, language="ja", condition_on_previous_text=False)
+        return result["text"]
+
+    # --- 照合 ---
+
+    def description(self, episode_id):
+        """エピソードページの説明文（HTTPキャッシュ経由、取得できなければ空）"""
+        url = self.catalog.get(episode_id, {}).get("url")
+        if not self.fetch_pages or not url:
+            return ""
+        from http_cache import get_http_cache
+        try:
+            response = get_http_cache().get(url)
+        except Exception as e:
+            logger.warning(f"エピソードページの取得エラー: {url}: {e}")
+            return ""
+        if response.status_code != 200:
+            return ""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(response.text, "html.parser")
+        for attrs in ({"name": "description"}, {"property": "og:description"}):
+            element = soup.find("meta", attrs=attrs)
+            if element and element.get("content"):
+                return element["content"]
+        return ""
+
+    @staticmethod
+    def _fingerprint_keys(hash_value, head_text):
+        keys = []
+        if hash_value:
+            keys.append("audio:" + hash_value)
+        head = normalize_text(head_text or "")
+        if len(head) >= MIN_HEAD_CHARS:
+            # 同じ音声なら書き起こしの先頭も同じになる（MP3が手元にないテキストどうしの照合用）
+            keys.append("text:" + hashlib.sha1(head[:MIN_HEAD_CHARS * 4].encode("utf-8")).hexdigest())
+        return keys
+
+    def duplicate_of(self, episode_id, hash_value, head_text):
+        """同じ音声が付いている他のエピソードID（なければ自分を登録してNone）"""
+        duplicate = None
+        for key in self._fingerprint_keys(hash_value, head_text):
+            other_id = self.fingerprints.setdefault(key, episode_id)
+            if other_id != episode_id and duplicate is None:
+                duplicate = other_id
+        return duplicate
+
+    def check(self, mp3_file, audio=None, transcribe=True, episode=None):
+        """1ファイルを照合し、判定（ok / mismatch / uncertain / accepted / unchecked）と根拠を返す
+
+        transcribe=False なら書き起こし済みの結果がない限り判定しない（Whisperを読み込まない）。
+        episode はエピソードの索引の件で、あればそのタイトルと音声のハッシュを使う。
+        """
+        episode = episode or {}
+        episode_id = episode.get("episode_id") or episode_id_from_path(mp3_file)
+        title = episode.get("title") or self.catalog.get(episode_id, {}).get("title") or title_from_path(mp3_file)
+        result = {"episode_id": episode_id, "file": os.path.basename(mp3_file), "title": title}
+        with span("consistency_check", file=os.path.basename(mp3_file)) as s:
+            hash_value = episode.get("audio_hash") or (audio_hash(mp3_file) if os.path.exists(mp3_file) else None)
+            head_text, source = self.cached_head(episode_id, mp3_file, hash_value)
+            if head_text is None and transcribe:
+                head_text, source = self.transcribe_head(mp3_file, audio), self.model_name
+            result["source"] = source
+            s["source"] = source
+            if head_text is None or len(normalize_text(head_text)) < MIN_HEAD_CHARS:
+                result["status"] = "unchecked"
+                with self._lock:
+                    self.stats["unchecked"] += 1
+                return result
+
+            head_grams = set(char_ngrams(head_text, NGRAM_RANGE))
+            own = self.matcher.score(set(char_ngrams(title, NGRAM_RANGE)), head_grams)
+            if own < MATCH_SCORE:
+                # タイトルで確かめられないときだけ説明文を取りに行く
+                own = max(own, self.matcher.score(set(char_ngrams(self.description(episode_id), NGRAM_RANGE)),
+                                                  head_grams))
+            best_score, best_id = self.matcher.best_other(head_grams, episode_id)
+            with self._lock:
+                duplicate = self.duplicate_of(episode_id, hash_value, head_text)
+                entry = self.cache.get(episode_id, {})
+                if own >= MATCH_SCORE:
+                    status = "ok"
+                elif (duplicate and own < best_score) or (best_score >= MATCH_SCORE and best_score - own >= MATCH_MARGIN):
+                    # 同じ音声が付いたエピソードのうち、音声の持ち主は最もよく一致する1件だけ
+                    status = "mismatch"
+                    # 再ダウンロードしても同じ音声しか得られない（前に回したときとハッシュが同じ）場合に繰り返さない
+                    unchanged = hash_value and entry.get("requeued_hash") == hash_value
+                    if unchanged or entry.get("requeued", 0) >= MAX_REQUEUES:
+                        status = "accepted"
+                else:
+                    status = "uncertain" if own < LOW_SCORE else "ok"
+                self.stats[status] += 1
+                entry.pop("mtime", None)
+                entry.update({"file": result["file"],
+                              "head_sec": self.head_sec, "head_text": head_text, "source": source,
+                              "audio_hash": hash_value, "status": status, "score": round(own, 3),
+                              "best_match": best_id, "checked_at": time.time()})
+                self.cache[episode_id] = entry
+            result.update({
+                "score": round(own, 3),
+                "best_match": {"episode_id": best_id, "title": self.catalog.get(best_id, {}).get("title"),
+                               "score": round(best_score, 3)} if best_id else None,
+                "duplicate_of": duplicate,
+                "head_text": head_text,
+                "status": status,
+            })
+            s["status"] = status
+        return result
+
+    def requeue(self, mp3_file, result, source, bad_audio_file=BAD_AUDIO_FILE):
+        """食い違ったエピソードを再ダウンロード対象に記録し、記録した回数を返す
+
+        回数は再ダウンロードで音声のハッシュが変わったときだけ増やす。同じ音声を記録済みなら記録し直さない。
+        """
+        check = verify_mp3(mp3_file) if os.path.exists(mp3_file) else {"duration_sec": 0.0}
+        best = result.get("best_match") or {}
+        problem = f"内容がタイトル「{result['title']}」と一致しません（一致度 {result['score']:.2f}"
+        if result.get("duplicate_of"):
+            problem += f"、エピソード {result['duplicate_of']} と同じ音声"
+        elif best:
+            problem += f"、「{best['title']}」と {best['score']:.2f}"
+        problem += "）"
+        with self._lock:
+            entry = self.cache.setdefault(result["episode_id"], {})
+            hash_value = entry.get("audio_hash")
+            if "requeued_hash" in entry and entry["requeued_hash"] == hash_value:
+                return entry.get("requeued", 0)
+            entry["requeued"] = entry.get("requeued", 0) + 1
+            entry["requeued_hash"] = hash_value
+        return mark_bad(result["episode_id"], {"path": mp3_file, "problems": [problem],
+                                               "duration_sec": check["duration_sec"], "expected_sec": None},
+                        source, bad_audio_file)
+
+    def format_report(self):
+        return "整合性の検査: " + ", ".join(f"{status} {count}件" for status, count in sorted(self.stats.items()))
+
+def format_check(result):
+    """判定結果を1行にする"""
+    line = f"[{result['status']}] {result['file']}"
+    if "score" in result:
+        line += f": 一致度 {result['score']:.2f}（{result['source']}）"
+    if result.get("duplicate_of"):
+        line += f" / エピソード {result['duplicate_of']} と同じ音声"
+    elif result.get("best_match") and result["status"] != "ok":
+        best = result["best_match"]
+        line += f" / 最も近いのは「{best['title']}」({best['score']:.2f})"
+    return line
+
+def remove_outputs(mp3_file, text_dir, segments_dir):
+    """書き起こし済みの結果を削除し、再ダウンロード後に書き起こし直させる"""
+    base_name = os.path.basename(mp3_file)
+    paths = [os.path.join(text_dir, base_name.replace('.mp3', '.txt')),
+             partition_path(segments_dir, base_name.split('_', 1)[0], episode_id_from_path(mp3_file))]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"削除しました: {path}")
+
+def main():
+    args = setup_args()
+    import instrumentation
+    instrumentation.init("consistency_check")
+    checker = ConsistencyChecker(text_dir=args.text_dir, segments_dir=args.segments_dir, model_name=args.model,
+                                 head_sec=args.head_sec, fetch_pages=not args.offline, check_file=args.check_file)
+    if args.audit_texts:
+        # テキストのファイル名から対応するMP3のパスを作る（手元になくても照合と再ダウンロードの記録はできる）
+        files = [os.path.join(args.mp3_dir, os.path.basename(path).replace('.txt', '.mp3'))
+                 for path in sorted(glob.glob(os.path.join(args.text_dir, '*.txt')))]
+    else:
+        files = args.files or sorted(glob.glob(os.path.join(args.mp3_dir, '*.mp3')))
+    logger.info(f"検査するファイル数: {len(files)}, タイトル一覧: {len(checker.catalog)}件")
+
+    results = []
+    try:
+        for mp3_file in files:
+            result = checker.check(mp3_file)
+            results.append(result)
+            log = logger.warning if result["status"] == "mismatch" else logger.info
+            log(format_check(result))
+            if result["status"] == "mismatch" and args.requeue:
+                attempts = checker.requeue(mp3_file, result, "consistency_check", args.bad_audio_file)
+                remove_outputs(mp3_file, args.text_dir, args.segments_dir)
+                logger.info(f"再ダウンロード対象に記録しました（{attempts}回目）: {result['episode_id']}")
+    finally:
+        checker.save()
+        instrumentation.finish()
+
+    logger.info(checker.format_report())
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "stats": dict(checker.stats),
+                       "results": [{key: value for key, value in result.items() if key != "head_text"}
+                                   for result in results]}, f, ensure_ascii=False, indent=2)
+        logger.info(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
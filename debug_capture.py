@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import zlib
+import queue
+import threading
+from collections import deque
+
+DEBUG_DIR = "debug_files"  # デバッグファイルの保存先ディレクトリ
+MAX_DEBUG_BYTES = 100 * 1024 * 1024  # 保存先全体の上限サイズ（超えたら古いものから削除）
+SUCCESS_SAMPLE_RATE = 0.05  # 成功したエピソードのうちデバッグ情報を残す割合
+QUEUE_SIZE = 64  # 書き込み待ちの上限（溢れたら成功時の分は捨て、失敗時の分は空くまで待つ）
+FAILURE_PUT_TIMEOUT = 30.0  # 失敗時の分を書き込み待ちに入れるまで待つ最長時間（秒）
+GZIP_MIN_BYTES = 512  # これより小さいテキストは圧縮しても縮まないのでそのまま保存する
+
+# レベル: off=保存しない / failure=失敗時のみ / sampled=失敗時＋成功の一部 / all=すべて
+LEVELS = ("off", "failure", "sampled", "all")
+
+class DebugCapture:
+    """デバッグ情報を失敗時は必ず、成功時は抽出して保存する
+
+    書き込みと圧縮は別スレッドで行い、呼び出し側は待たない。テキストは gzip で
+    圧縮し、保存先の合計サイズが上限を超えたら古いファイルから削除する（リングバッファ）。
+    """
+
+    def __init__(self, debug_dir=DEBUG_DIR, level="sampled", sample_rate=SUCCESS_SAMPLE_RATE,
+                 max_bytes=MAX_DEBUG_BYTES, queue_size=QUEUE_SIZE):
+        if level not in LEVELS:
+            raise ValueError(f"不明なデバッグレベル: {level}")
+        self.debug_dir = debug_dir
+        self.level = level
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.stats = {"captured": 0, "skipped": 0, "dropped": 0, "errors": 0,
+                      "bytes_in": 0, "bytes_written": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = deque()  # (パス, サイズ) を古い順に
+        self._total = 0
+        self._thread = None
+        if level != "off":
+            os.makedirs(debug_dir, exist_ok=True)
+            self._scan()
+            self._thread = threading.Thread(target=self._run, name="debug-writer", daemon=True)
+            self._thread.start()
+
+    def _scan(self):
+        """既存のファイルを古い順に並べ、リングバッファの初期状態にする"""
+        entries = []
+        for entry in os.scandir(self.debug_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files.append((path, size))
+            self._total += size
+        self._evict()
+
+    def sampled(self, key):
+        """成功時に保存する対象か（同じエピソードの成果物は揃って残るようキーから決める）"""
+        return zlib.crc32(str(key).encode("utf-8")) % 10000 < self.sample_rate * 10000
+
+    def wants(self, key, failure=False):
+        """このエピソードのデバッグ情報を保存するか"""
+        if self.level == "off":
+            return False
+        if failure or self.level == "all":
+            return True
+        return self.level == "sampled" and self.sampled(key)
+
+    def capture(self, name, data, key, failure=False):
+        """デバッグ情報を1件保存する（保存しない場合はFalse）
+
+        data は str か bytes。大きな str は gzip で圧縮して {name}.gz に書き出す。
+        失敗時の分は必ず残すため、書き込み待ちが溢れていれば空くまで待つ。
+        """
+        if not self.wants(key, failure):
+            self._count("skipped")
+            return False
+        try:
+            if failure:
+                self._queue.put((name, data), timeout=FAILURE_PUT_TIMEOUT)
+            else:
+                self._queue.put_nowait((name, data))
+        except queue.Full:
+            # 成功時の分は書き込みが追いつかなければ本処理を止めずに捨てる
+            self._count("dropped")
+            return False
+        return True
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                self._count("errors")
+                print(f"デバッグ情報保存エラー: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name, data):
+        """圧縮して書き込み、上限を超えた分を古い順に削除する"""
+        if isinstance(data, str):
+            raw = body = data.encode("utf-8")
+            if len(raw) >= GZIP_MIN_BYTES:
+                body = gzip.compress(raw, compresslevel=6)
+                name += ".gz"
+        else:
+            raw = body = data
+        path = os.path.join(self.debug_dir, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.stats["captured"] += 1
+            self.stats["bytes_in"] += len(raw)
+            self.stats["bytes_written"] += len(body)
+        # 同名のファイルを上書きした場合は古い記録を除く
+        for i, (old_path, old_size) in enumerate(self._files):
+            if old_path == path:
+                del self._files[i]
+                self._total -= old_size
+                break
+        self._files.append((path, len(body)))
+        self._total += len(body)
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popleft()
+            self._total -= size
+            try:
+                os.remove(path)
+                self.stats["evicted"] += 1
+            except OSError:
+                pass
+
+    def flush(self):
+        """書き込み待ちがなくなるまで待つ"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """残りを書き込んで書き込みスレッドを止める"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def format_report(self):
+        """保存件数・圧縮率を1行にする"""
+        st = self.stats
+        ratio = f"{100 * st['bytes_written'] / st['bytes_in']:.0f}%" if st["bytes_in"] else "-"
+        return (f"デバッグ情報: レベル {self.level}, 保存 {st['captured']}件 "
+                f"({st['bytes_in'] / 1024:.1f}KB → {st['bytes_written'] / 1024:.1f}KB, {ratio}), "
+                f"抽出外 {st['skipped']}件, 破棄 {st['dropped']}件, 削除 {st['evicted']}件, "
+                f"保存先 {self._total / (1024 * 1024):.1f}MB / 上限 {self.max_bytes / (1024 * 1024):.0f}MB")
+
+# プロセス全体で共有するキャプチャ
+_capture = None
+_capture_lock = threading.Lock()
+
+def get_debug_capture(create=True):
+    """共有のキャプチャを返す（初回に作成。create=False なら未作成のときNone）"""
+    global _capture
+    with _capture_lock:
+        if _capture is None and create:
+            _capture = DebugCapture(DEBUG_DIR)
+        return _capture
+
+def set_debug_capture(capture):
+    """共有のキャプチャを差し替える"""
+    global _capture
+    with _capture_lock:
+        _capture = capture
@@ -1,20 +1,30 @@
 import os
 import re
 import json
-import requests
 import subprocess
 from datetime import datetime
-from bs4 import BeautifulSoup
+from urllib.parse import urljoin
 import traceback
 import time
 import shutil
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+import argparse
+import sys
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+import profiling
+from instrumentation import span, import_span
+from fetch_controller import FetchError, get_controller
+from http_cache import get_http_cache
+from debug_capture import DebugCapture, get_debug_capture, set_debug_capture
+from mp3_frames import Mp3FormatError, concat_mp3
+from audio_verify import (MAX_REDOWNLOADS, verify_file, verify_mp3, playlist_duration, format_result,
+                          load_bad_audio, mark_bad, clear_bad, audio_hash)
+from channels import (load_channels, legacy_channel, select_channels, parse_shard, load_urls, load_history,
+                      update_history, load_state, save_state, schedule_fair, mark_scheduled, in_shard)
+from work_queue import QUEUE_FILE, WorkQueue, Heartbeat
+from episode_index import make_entry, update_index
 
 # 設定
 MP3_DIR = "mp3_downloads"  # MP3保存ディレクトリ
@@ -23,8 +33,39 @@ DEBUG_DIR = "debug_files"  # デバッグファイル用ディレクトリ
 OUTPUT_DIR = "output"  # 出力ディレクトリ
 JSON_FILE = os.path.join(OUTPUT_DIR, "voicy_urls_only.json")  # URLリストのJSONファイル
 DOWNLOAD_HISTORY_FILE = "download_history.json"  # ダウンロード履歴ファイル
-MAX_DOWNLOADS_PER_RUN = 10  # 1回の実行でダウンロードする最大件数
+CHANNELS_FILE = "channels.json"  # チャンネル一覧（なければ JSON_FILE と DOWNLOAD_HISTORY_FILE の1チャンネルとして扱う）
+CHANNELS_DIR = os.path.join(OUTPUT_DIR, "channels")  # チャンネルごとのURLリスト・履歴・状態
+BAD_AUDIO_FILE = os.path.join(OUTPUT_DIR, "bad_audio.json")  # 検査に通らなかったエピソード（再ダウンロード対象）
+EPISODE_INDEX_FILE = os.path.join(OUTPUT_DIR, "episode_index.bin")  # エピソードIDをキーにしたメタデータの索引（書き起こし側が読む）
+MAX_DOWNLOADS_PER_RUN = 10  # 1回の実行（シャードごと）でダウンロードする最大件数
+STATIC_PAGE_FIRST = True  # Seleniumの前に静的HTML（HTTPキャッシュ経由）での取得を試みる
+IN_PROCESS_MP3_CONCAT = True  # MP3はまずFFmpegを使わずフレーム単位で結合する
+MAX_PARALLEL_SEGMENTS = 8  # セグメントの最大並列数（実際の並列数はホストごとに自動調整）
 DEBUG_MODE = True  # デバッグモード
+DEBUG_LEVEL = "sampled"  # デバッグ情報の保存レベル（off / failure / sampled / all）
+DEBUG_SAMPLE_RATE = 0.05  # 成功したエピソードのうちデバッグ情報を残す割合
+DEBUG_MAX_MB = 100  # デバッグ情報の保存先の上限サイズ（MB）
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='VoicyのエピソードをMP3としてダウンロードします')
+    parser.add_argument('--profile', action='store_true',
+                        help='エピソードごとにプロファイルを取得する')
+    parser.add_argument('--profile_dir', type=str, default=profiling.PROFILE_DIR,
+                        help='プロファイル結果の出力先ディレクトリパス')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='i/n 形式で指定すると、チャンネルIDのハッシュで i 番目のシャードに割り当てられたチャンネルだけを処理する')
+    parser.add_argument('--episode_shard', type=parse_shard, default=None,
+                        help='i/n 形式で指定すると、エピソードIDのハッシュで i 番目のシャードに割り当てられたエピソードだけを'
+                             '処理する（チャンネルが1つでも別々のランナーで分担できる）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='2以上ならシャードごとに別プロセスを起動して並行に処理する')
+    parser.add_argument('--channel', action='append', default=None,
+                        help='処理するチャンネルID（複数指定可、省略時は一覧の全チャンネル）')
+    parser.add_argument('--queue', type=str, nargs='?', const=QUEUE_FILE, default=None,
+                        help=f'作業キュー（SQLite）から1件ずつ借りて処理する。複数のワーカーで同じキューを使っても'
+                             f'同じエピソードを重複して処理しない（パス省略時は {QUEUE_FILE}）')
+    return parser.parse_args()
 
 def setup_directories():
     """必要なディレクトリを作成"""
@@ -36,6 +77,7 @@ def create_sample_json():
     """サンプルのJSONファイルを作成（テスト用）"""
     if not os.path.exists(JSON_FILE):
         print(f"サンプルのJSONファイルを作成します: {JSON_FILE}")
+        os.makedirs(os.path.dirname(JSON_FILE) or ".", exist_ok=True)
         sample_urls = [
             "https://voicy.jp/channel/1234/567890",
             "https://voicy.jp/channel/1234/567891"
@@ -58,30 +100,6 @@ def load_download_history():
             return []
     return []
 
-def save_download_history(history):
-    """ダウンロード履歴を保存する"""
-    try:
-        with open(DOWNLOAD_HISTORY_FILE, "w") as f:
-            json.dump(history, f, indent=2)
-    except Exception as e:
-        print(f"履歴ファイルの保存エラー: {e}")
-
-def load_urls_from_json():
-    """JSONファイルからURLリストを読み込む"""
-    try:
-        if not os.path.exists(JSON_FILE):
-            print(f"JSONファイルが存在しません: {JSON_FILE}")
-            create_sample_json()
-            
-        with open(JSON_FILE, "r") as f:
-            urls = json.load(f)
-            print(f"JSONファイルから{len(urls)}件のURLを読み込みました: {JSON_FILE}")
-            return urls
-    except Exception as e:
-        print(f"JSONファイルの読み込みエラー: {e}")
-        traceback.print_exc()
-        return []
-
 def ensure_ffmpeg_installed():
     """FFmpegがインストールされていることを確認し、なければインストールを試みる"""
     try:
@@ -113,31 +131,24 @@ def ensure_ffmpeg_installed():
         traceback.print_exc()
         return False
 
-def save_debug_info(driver, episode_id, suffix=""):
-    """デバッグ情報を保存"""
-    if not DEBUG_MODE:
+def save_debug_info(driver, episode_id, suffix="", failure=False):
+    """デバッグ情報を保存（失敗時は必ず、成功時は抽出したエピソードだけ）"""
+    capture = get_debug_capture()
+    if not capture.wants(episode_id, failure):
         return
     
     try:
         # ページソースを保存
-        page_source = driver.page_source
-        debug_file = os.path.join(DEBUG_DIR, f"page_source_{episode_id}{suffix}.html")
-        with open(debug_file, "w", encoding="utf-8") as f:
-            f.write(page_source)
-        print(f"ページソースを保存しました: {debug_file}")
+        capture.capture(f"page_source_{episode_id}{suffix}.html", driver.page_source, episode_id, failure)
         
         # スクリーンショットを保存
-        screenshot_file = os.path.join(DEBUG_DIR, f"screenshot_{episode_id}{suffix}.png")
-        driver.save_screenshot(screenshot_file)
-        print(f"スクリーンショットを保存しました: {screenshot_file}")
+        capture.capture(f"screenshot_{episode_id}{suffix}.png", driver.get_screenshot_as_png(), episode_id, failure)
         
         # コンソールログを保存
         logs = driver.get_log('browser')
-        log_file = os.path.join(DEBUG_DIR, f"console_log_{episode_id}{suffix}.txt")
-        with open(log_file, "w", encoding="utf-8") as f:
-            for log in logs:
-                f.write(f"{log['level']}: {log['message']}\n")
-        print(f"コンソールログを保存しました: {log_file}")
+        log_text = "".join(f"{log['level']}: {log['message']}\n" for log in logs)
+        capture.capture(f"console_log_{episode_id}{suffix}.txt", log_text, episode_id, failure)
+        print(f"デバッグ情報を保存します: {episode_id}{suffix}")
     except Exception as e:
         print(f"デバッグ情報保存エラー: {e}")
 
@@ -178,12 +189,203 @@ def extract_audio_urls_from_javascript(page_source):
     
     return audio_urls
 
+def parse_m3u8(m3u8_content, m3u8_url):
+    """m3u8プレイリストを解析し、バリアント（マスタープレイリストの場合）とセグメントURLを返す"""
+    variants = []
+    segment_urls = []
+    bandwidth = 0
+    for line in m3u8_content.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF'):
+            match = re.search(r'BANDWIDTH=(\d+)', line)
+            bandwidth = int(match.group(1)) if match else 0
+        elif line and not line.startswith('#'):
+            # 相対URLを絶対URLに変換
+            absolute_url = urljoin(m3u8_url, line)
+            if bandwidth or '.m3u8' in line:
+                variants.append((bandwidth, absolute_url))
+                bandwidth = 0
+            else:
+                segment_urls.append(absolute_url)
+    return variants, segment_urls
+
+def format_episode_date(date_text):
+    """日付テキストをファイル名用の形式にする（例: 2023年2月1日 → 202302）。読めなければNone"""
+    date_match = re.search(r"(\d{4})年(\d{1,2})月(\d{1,2})日", date_text or "")
+    if not date_match:
+        return None
+    year, month, day = date_match.groups()
+    return f"{year}{month.zfill(2)}"
+
+def get_episode_info_static(url):
+    """ブラウザを起動せず、HTTPキャッシュ経由で取得したHTMLからエピソード情報を取得
+
+    タイトル・日付・オーディオURLが静的HTMLに揃っている場合だけ結果を返し、
+    足りなければNoneを返してSeleniumでの取得に任せる。
+    """
+    episode_id = url.rstrip("/").split("/")[-1]
+    with span("page_fetch", episode_id=episode_id) as s:
+        try:
+            response = get_http_cache().get(url)
+        except FetchError as e:
+            print(f"ページ取得エラー: {e}")
+            s["status"] = "error"
+            return None
+        s["bytes"] = len(response.content)
+        s["status_code"] = response.status_code
+        s["cache"] = response.from_cache or "miss"
+    if response.status_code != 200:
+        print(f"ページ取得エラー: ステータスコード {response.status_code}")
+        return None
+    
+    page_source = response.text
+    with import_span("bs4"):
+        from bs4 import BeautifulSoup
+    soup = BeautifulSoup(page_source, "html.parser")
+    
+    # get_episode_info と同じセレクタでタイトル・日付・有料放送を探す
+    title = ""
+    for selector in ["h1.title", "h2.title", ".episode-title", "h1", "h2"]:
+        element = soup.select_one(selector)
+        if element and element.get_text(strip=True):
+            title = element.get_text(strip=True)
+            break
+    formatted_date = None
+    for selector in ["p.date", ".date", ".episode-date", ".published-date"]:
+        element = soup.select_one(selector)
+        if element:
+            formatted_date = format_episode_date(element.get_text(strip=True))
+            break
+    is_premium = bool(soup.select(".premium-episode, .premium, .paid-content"))
+    
+    audio_urls = []
+    for audio in soup.find_all("audio"):
+        if audio.has_attr("src"):
+            audio_urls.append(audio["src"])
+        for source in audio.find_all("source"):
+            if source.has_attr("src"):
+                audio_urls.append(source["src"])
+    if not audio_urls:
+        audio_urls = extract_audio_urls_from_javascript(page_source)
+    
+    if not title or not formatted_date or not audio_urls:
+        print("静的HTMLから情報が揃わないため、ブラウザで取得します")
+        return None
+    
+    print(f"静的HTMLから取得しました: タイトル: {title}, 日付: {formatted_date}, 有料放送: {'はい' if is_premium else 'いいえ'}")
+    return resolve_audio_urls(episode_id, url, title, formatted_date, is_premium, audio_urls)
+
+def resolve_audio_urls(episode_id, url, title, formatted_date, is_premium, audio_urls):
+    """オーディオURLの一覧からダウンロード対象（m3u8セグメントまたはMP3）を決めてエピソード情報を返す"""
+    # 重複を削除
+    audio_urls = list(set(audio_urls))
+    
+    # URLの種類を判別
+    mp3_urls = []
+    m3u8_urls = []
+    
+    for audio_url in audio_urls:
+        if '.mp3' in audio_url:
+            mp3_urls.append(audio_url)
+        elif '.m3u8' in audio_url:
+            m3u8_urls.append(audio_url)
+    
+    # m3u8プレイリストを処理
+    if m3u8_urls:
+        print(f"{len(m3u8_urls)}個のm3u8 URLを処理します")
+        for m3u8_url in m3u8_urls:
+            try:
+                print(f"m3u8 URLを処理中: {m3u8_url}")
+                with span("playlist_fetch", episode_id=episode_id) as s:
+                    m3u8_response = get_http_cache().get(m3u8_url)
+                    s["bytes"] = len(m3u8_response.content)
+                    s["status_code"] = m3u8_response.status_code
+                    s["cache"] = m3u8_response.from_cache or "miss"
+                
+                if m3u8_response.status_code == 200:
+                    m3u8_content = m3u8_response.text
+                    
+                    # m3u8からセグメントURLを抽出
+                    variants, segment_urls = parse_m3u8(m3u8_content, m3u8_url)
+                    expected_duration = playlist_duration(m3u8_content)
+                    
+                    # デバッグ用にm3u8コンテンツを保存（中身が読めなかったときは必ず）
+                    get_debug_capture().capture(f"m3u8_content_{episode_id}.txt", m3u8_content, episode_id,
+                                                failure=not variants and not segment_urls)
+                    
+                    # マスタープレイリストなら最も高いビットレートのメディアプレイリストを取得
+                    if variants and not segment_urls:
+                        variant_url = max(variants)[1]
+                        print(f"マスタープレイリストからメディアプレイリストを取得中: {variant_url}")
+                        with span("playlist_fetch", episode_id=episode_id, variant=True) as s:
+                            variant_response = get_http_cache().get(variant_url)
+                            s["bytes"] = len(variant_response.content)
+                            s["status_code"] = variant_response.status_code
+                            s["cache"] = variant_response.from_cache or "miss"
+                        if variant_response.status_code == 200:
+                            _, segment_urls = parse_m3u8(variant_response.text, variant_url)
+                            expected_duration = playlist_duration(variant_response.text)
+                        else:
+                            print(f"メディアプレイリスト取得エラー: ステータスコード {variant_response.status_code}")
+                    
+                    if segment_urls:
+                        print(f"m3u8から{len(segment_urls)}個のセグメントURLを抽出しました")
+                        # セグメント情報を返す
+                        return {
+                            "id": episode_id,
+                            "title": title,
+                            "date": formatted_date,
+                            "is_premium": is_premium,
+                            "url": url,
+                            "type": "m3u8",
+                            "segment_urls": segment_urls,
+                            "expected_duration": expected_duration
+                        }
+            except Exception as e:
+                print(f"m3u8プレイリスト処理エラー: {e}")
+                traceback.print_exc()
+    
+    # MP3 URLが見つかった場合
+    if mp3_urls:
+        print(f"{len(mp3_urls)}個のMP3 URLを取得しました")
+        return {
+            "id": episode_id,
+            "title": title,
+            "date": formatted_date,
+            "is_premium": is_premium,
+            "url": url,
+            "type": "mp3",
+            "mp3_urls": mp3_urls
+        }
+    
+    # オーディオURLが見つからなかった場合
+    print(f"オーディオURLが見つかりませんでした")
+    return None
+
 def get_episode_info(url):
     """Voicyエピソードページから情報を取得"""
     print(f"::group::エピソード情報取得: {url}")
     driver = None
     
     try:
+        # まずブラウザを使わずに取得を試みる
+        if STATIC_PAGE_FIRST:
+            episode_info = get_episode_info_static(url)
+            if episode_info:
+                return episode_info
+        
+        # Selenium は実際にブラウザが必要になったときだけ読み込む
+        with import_span("selenium"):
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            from selenium.webdriver.chrome.service import Service
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            from webdriver_manager.chrome import ChromeDriverManager
+        with import_span("bs4"):
+            from bs4 import BeautifulSoup
+        
         # Chromeのオプション設定
         chrome_options = Options()
         chrome_options.add_argument("--headless")
@@ -196,45 +398,50 @@ def get_episode_info(url):
         
         # WebDriverの初期化
         print("WebDriverを初期化中...")
-        try:
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-        except Exception as e:
-            print(f"WebDriver初期化エラー: {e}")
-            traceback.print_exc()
-            return None
+        with span("driver_start") as s:
+            try:
+                service = Service(ChromeDriverManager().install())
+                driver = webdriver.Chrome(service=service, options=chrome_options)
+            except Exception as e:
+                print(f"WebDriver初期化エラー: {e}")
+                traceback.print_exc()
+                s["status"] = "error"
+                return None
         
         # エピソードID
         episode_id = url.split("/")[-1]
         print(f"エピソードID: {episode_id}")
         
-        # ページにアクセス
-        print(f"ページにアクセス中: {url}")
-        try:
-            driver.get(url)
-        except Exception as e:
-            print(f"ページアクセスエラー: {e}")
-            traceback.print_exc()
-            save_debug_info(driver, episode_id, "_access_error")
-            return None
-        
-        # ページが完全に読み込まれるまで待機
-        print("ページの読み込みを待機中...")
-        try:
-            # タイトル要素が表示されるまで待機
-            WebDriverWait(driver, 20).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "h1, h2, .title, .episode-title"))
-            )
-            
-            # JavaScriptが完全に実行されるまで少し待機
-            time.sleep(5)
-        except Exception as e:
-            print(f"ページ読み込み待機エラー: {e}")
-            traceback.print_exc()
-            save_debug_info(driver, episode_id, "_load_error")
+        with span("page_load", episode_id=episode_id) as s:
+            # ページにアクセス
+            print(f"ページにアクセス中: {url}")
+            try:
+                driver.get(url)
+            except Exception as e:
+                print(f"ページアクセスエラー: {e}")
+                traceback.print_exc()
+                s["status"] = "error"
+                save_debug_info(driver, episode_id, "_access_error", failure=True)
+                return None
             
-            # エラーでも続行を試みる
-            print("エラーが発生しましたが、処理を続行します...")
+            # ページが完全に読み込まれるまで待機
+            print("ページの読み込みを待機中...")
+            try:
+                # タイトル要素が表示されるまで待機
+                WebDriverWait(driver, 20).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, "h1, h2, .title, .episode-title"))
+                )
+                
+                # JavaScriptが完全に実行されるまで少し待機
+                time.sleep(5)
+            except Exception as e:
+                print(f"ページ読み込み待機エラー: {e}")
+                traceback.print_exc()
+                s["status"] = "timeout"
+                save_debug_info(driver, episode_id, "_load_error", failure=True)
+                
+                # エラーでも続行を試みる
+                print("エラーが発生しましたが、処理を続行します...")
         
         # デバッグ情報を保存
         save_debug_info(driver, episode_id)
@@ -266,12 +473,9 @@ def get_episode_info(url):
                     break
             
             # 日付フォーマット変換（例: 2023年2月1日 → 202302）
-            if date_text:
-                date_match = re.search(r"(\d{4})年(\d{1,2})月(\d{1,2})日", date_text)
-                if date_match:
-                    year, month, day = date_match.groups()
-                    formatted_date = f"{year}{month.zfill(2)}"
-                    print(f"フォーマット済み日付: {formatted_date}")
+            if format_episode_date(date_text):
+                formatted_date = format_episode_date(date_text)
+                print(f"フォーマット済み日付: {formatted_date}")
         except Exception as e:
             print(f"日付取得エラー: {e}")
         
@@ -288,202 +492,138 @@ def get_episode_info(url):
         # ページソースを取得
         page_source = driver.page_source
         
-        # オーディオURLを取得するための複数の方法を試す
-        audio_urls = []
-        
-        # 方法1: オーディオプレーヤーのソースを探す
-        print("方法1: オーディオプレーヤーのソースを探しています...")
-        try:
-            audio_elements = driver.find_elements(By.TAG_NAME, "audio")
-            for audio in audio_elements:
-                audio_url = audio.get_attribute("src")
-                if audio_url:
-                    audio_urls.append(audio_url)
-                    print(f"方法1でオーディオURLを取得: {audio_url}")
-        except Exception as e:
-            print(f"方法1でのオーディオURL取得エラー: {e}")
+        with span("url_extraction", episode_id=episode_id) as s:
+            # オーディオURLを取得するための複数の方法を試す
+            audio_urls = []
         
-        # 方法2: ページソースから直接探す
-        if not audio_urls:
-            print("方法2: ページソースからオーディオURLを探しています...")
+            # 方法1: オーディオプレーヤーのソースを探す
+            print("方法1: オーディオプレーヤーのソースを探しています...")
             try:
-                soup = BeautifulSoup(page_source, "html.parser")
-                audio_tags = soup.find_all("audio")
-                for audio in audio_tags:
-                    if audio.has_attr("src"):
-                        audio_urls.append(audio["src"])
-                        print(f"方法2でオーディオURLを取得: {audio['src']}")
-                    
-                    # source タグも確認
-                    source_tags = audio.find_all("source")
-                    for source in source_tags:
-                        if source.has_attr("src"):
-                            audio_urls.append(source["src"])
-                            print(f"方法2でsourceタグからオーディオURLを取得: {source['src']}")
+                audio_elements = driver.find_elements(By.TAG_NAME, "audio")
+                for audio in audio_elements:
+                    audio_url = audio.get_attribute("src")
+                    if audio_url:
+                        audio_urls.append(audio_url)
+                        print(f"方法1でオーディオURLを取得: {audio_url}")
             except Exception as e:
-                print(f"方法2でのオーディオURL取得エラー: {e}")
+                print(f"方法1でのオーディオURL取得エラー: {e}")
         
-        # 方法3: JavaScriptを実行してオーディオURLを取得
-        if not audio_urls:
-            print("方法3: JavaScriptを実行してオーディオURLを探しています...")
-            try:
-                # audioタグのsrc属性を取得
-                js_result = driver.execute_script("""
-                    var audioElements = document.getElementsByTagName('audio');
-                    var urls = [];
-                    for (var i = 0; i < audioElements.length; i++) {
-                        if (audioElements[i].src) {
-                            urls.push(audioElements[i].src);
-                        }
-                        // sourceタグも確認
-                        var sources = audioElements[i].getElementsByTagName('source');
-                        for (var j = 0; j < sources.length; j++) {
-                            if (sources[j].src) {
-                                urls.push(sources[j].src);
+            # 方法2: ページソースから直接探す
+            if not audio_urls:
+                print("方法2: ページソースからオーディオURLを探しています...")
+                try:
+                    soup = BeautifulSoup(page_source, "html.parser")
+                    audio_tags = soup.find_all("audio")
+                    for audio in audio_tags:
+                        if audio.has_attr("src"):
+                            audio_urls.append(audio["src"])
+                            print(f"方法2でオーディオURLを取得: {audio['src']}")
+                    
+                        # source タグも確認
+                        source_tags = audio.find_all("source")
+                        for source in source_tags:
+                            if source.has_attr("src"):
+                                audio_urls.append(source["src"])
+                                print(f"方法2でsourceタグからオーディオURLを取得: {source['src']}")
+                except Exception as e:
+                    print(f"方法2でのオーディオURL取得エラー: {e}")
+        
+            # 方法3: JavaScriptを実行してオーディオURLを取得
+            if not audio_urls:
+                print("方法3: JavaScriptを実行してオーディオURLを探しています...")
+                try:
+                    # audioタグのsrc属性を取得
+                    js_result = driver.execute_script("""
+                        var audioElements = document.getElementsByTagName('audio');
+                        var urls = [];
+                        for (var i = 0; i < audioElements.length; i++) {
+                            if (audioElements[i].src) {
+                                urls.push(audioElements[i].src);
+                            }
+                            // sourceタグも確認
+                            var sources = audioElements[i].getElementsByTagName('source');
+                            for (var j = 0; j < sources.length; j++) {
+                                if (sources[j].src) {
+                                    urls.push(sources[j].src);
+                                }
                             }
                         }
-                    }
-                    return urls;
-                """)
+                        return urls;
+                    """)
                 
-                if js_result:
-                    audio_urls.extend(js_result)
-                    print(f"方法3でオーディオURLを取得: {js_result}")
-            except Exception as e:
-                print(f"方法3でのオーディオURL取得エラー: {e}")
+                    if js_result:
+                        audio_urls.extend(js_result)
+                        print(f"方法3でオーディオURLを取得: {js_result}")
+                except Exception as e:
+                    print(f"方法3でのオーディオURL取得エラー: {e}")
         
-        # 方法4: ネットワークリクエストを監視してオーディオURLを取得
-        if not audio_urls:
-            print("方法4: ページ内のすべてのリンクからオーディオURLを探しています...")
-            try:
-                all_links = []
-                link_elements = driver.find_elements(By.TAG_NAME, "a")
-                for link in link_elements:
-                    href = link.get_attribute("href")
-                    if href and ('.mp3' in href or '.m3u8' in href or 'audio' in href):
-                        all_links.append(href)
-                        print(f"潜在的なオーディオリンクを発見: {href}")
+            # 方法4: ネットワークリクエストを監視してオーディオURLを取得
+            if not audio_urls:
+                print("方法4: ページ内のすべてのリンクからオーディオURLを探しています...")
+                try:
+                    all_links = []
+                    link_elements = driver.find_elements(By.TAG_NAME, "a")
+                    for link in link_elements:
+                        href = link.get_attribute("href")
+                        if href and ('.mp3' in href or '.m3u8' in href or 'audio' in href):
+                            all_links.append(href)
+                            print(f"潜在的なオーディオリンクを発見: {href}")
                 
-                if all_links:
-                    audio_urls.extend(all_links)
-                    print(f"方法4でオーディオURLを取得: {all_links}")
-            except Exception as e:
-                print(f"方法4でのオーディオURL取得エラー: {e}")
+                    if all_links:
+                        audio_urls.extend(all_links)
+                        print(f"方法4でオーディオURLを取得: {all_links}")
+                except Exception as e:
+                    print(f"方法4でのオーディオURL取得エラー: {e}")
         
-        # 方法5: JavaScriptからオーディオURLを抽出
-        if not audio_urls:
-            print("方法5: JavaScriptからオーディオURLを抽出しています...")
-            js_audio_urls = extract_audio_urls_from_javascript(page_source)
-            if js_audio_urls:
-                audio_urls.extend(js_audio_urls)
-                print(f"方法5でオーディオURLを取得: {js_audio_urls}")
+            # 方法5: JavaScriptからオーディオURLを抽出
+            if not audio_urls:
+                print("方法5: JavaScriptからオーディオURLを抽出しています...")
+                js_audio_urls = extract_audio_urls_from_javascript(page_source)
+                if js_audio_urls:
+                    audio_urls.extend(js_audio_urls)
+                    print(f"方法5でオーディオURLを取得: {js_audio_urls}")
         
-        # 方法6: ページを再読み込みして再試行
-        if not audio_urls:
-            print("方法6: ページを再読み込みして再試行しています...")
-            try:
-                driver.refresh()
-                time.sleep(5)  # ページが読み込まれるまで待機
+            # 方法6: ページを再読み込みして再試行
+            if not audio_urls:
+                print("方法6: ページを再読み込みして再試行しています...")
+                try:
+                    driver.refresh()
+                    time.sleep(5)  # ページが読み込まれるまで待機
                 
-                # 再度デバッグ情報を保存
-                save_debug_info(driver, episode_id, "_refresh")
+                    # 再度デバッグ情報を保存
+                    save_debug_info(driver, episode_id, "_refresh", failure=True)
                 
-                # 再度オーディオURLを探す
-                audio_elements = driver.find_elements(By.TAG_NAME, "audio")
-                for audio in audio_elements:
-                    audio_url = audio.get_attribute("src")
-                    if audio_url:
-                        audio_urls.append(audio_url)
-                        print(f"方法6でオーディオURLを取得: {audio_url}")
+                    # 再度オーディオURLを探す
+                    audio_elements = driver.find_elements(By.TAG_NAME, "audio")
+                    for audio in audio_elements:
+                        audio_url = audio.get_attribute("src")
+                        if audio_url:
+                            audio_urls.append(audio_url)
+                            print(f"方法6でオーディオURLを取得: {audio_url}")
                 
-                # JavaScriptからも再度抽出
-                if not audio_urls:
-                    js_audio_urls = extract_audio_urls_from_javascript(driver.page_source)
-                    if js_audio_urls:
-                        audio_urls.extend(js_audio_urls)
-                        print(f"方法6でJavaScriptからオーディオURLを取得: {js_audio_urls}")
-            except Exception as e:
-                print(f"方法6でのオーディオURL取得エラー: {e}")
-        
-        # 重複を削除
-        audio_urls = list(set(audio_urls))
-        
-        # URLの種類を判別
-        mp3_urls = []
-        m3u8_urls = []
-        
-        for url in audio_urls:
-            if '.mp3' in url:
-                mp3_urls.append(url)
-            elif '.m3u8' in url:
-                m3u8_urls.append(url)
-        
-        # m3u8プレイリストを処理
-        if m3u8_urls:
-            print(f"{len(m3u8_urls)}個のm3u8 URLを処理します")
-            for m3u8_url in m3u8_urls:
-                try:
-                    print(f"m3u8 URLを処理中: {m3u8_url}")
-                    m3u8_response = requests.get(m3u8_url, timeout=30)
-                    
-                    if m3u8_response.status_code == 200:
-                        m3u8_content = m3u8_response.text
-                        
-                        # デバッグ用にm3u8コンテンツを保存
-                        m3u8_debug_file = os.path.join(DEBUG_DIR, f"m3u8_content_{episode_id}.txt")
-                        with open(m3u8_debug_file, "w", encoding="utf-8") as f:
-                            f.write(m3u8_content)
-                        print(f"m3u8コンテンツを保存しました: {m3u8_debug_file}")
-                        
-                        # m3u8からセグメントURLを抽出
-                        segment_urls = []
-                        for line in m3u8_content.splitlines():
-                            if line and not line.startswith('#'):
-                                # 相対URLを絶対URLに変換
-                                if line.startswith('http'):
-                                    segment_url = line
-                                else:
-                                    base_url = '/'.join(m3u8_url.split('/')[:-1]) + '/'
-                                    segment_url = base_url + line
-                                segment_urls.append(segment_url)
-                        
-                        if segment_urls:
-                            print(f"m3u8から{len(segment_urls)}個のセグメントURLを抽出しました")
-                            # セグメント情報を返す
-                            return {
-                                "id": episode_id,
-                                "title": title,
-                                "date": formatted_date,
-                                "is_premium": is_premium,
-                                "url": url,
-                                "type": "m3u8",
-                                "segment_urls": segment_urls
-                            }
+                    # JavaScriptからも再度抽出
+                    if not audio_urls:
+                        js_audio_urls = extract_audio_urls_from_javascript(driver.page_source)
+                        if js_audio_urls:
+                            audio_urls.extend(js_audio_urls)
+                            print(f"方法6でJavaScriptからオーディオURLを取得: {js_audio_urls}")
                 except Exception as e:
-                    print(f"m3u8プレイリスト処理エラー: {e}")
-                    traceback.print_exc()
-        
-        # MP3 URLが見つかった場合
-        if mp3_urls:
-            print(f"{len(mp3_urls)}個のMP3 URLを取得しました")
-            return {
-                "id": episode_id,
-                "title": title,
-                "date": formatted_date,
-                "is_premium": is_premium,
-                "url": url,
-                "type": "mp3",
-                "mp3_urls": mp3_urls
-            }
+                    print(f"方法6でのオーディオURL取得エラー: {e}")
+            
+            s["found"] = len(set(audio_urls))
+            if not audio_urls:
+                s["status"] = "not_found"
         
-        # オーディオURLが見つからなかった場合
-        print(f"オーディオURLが見つかりませんでした")
-        return None
+        episode_info = resolve_audio_urls(episode_id, url, title, formatted_date, is_premium, audio_urls)
+        if not episode_info:
+            # オーディオURLが取れなかったページは必ず残す
+            save_debug_info(driver, episode_id, "_not_found", failure=True)
+        return episode_info
     except Exception as e:
         print(f"エピソード情報取得エラー: {e}")
         traceback.print_exc()
         if driver:
-            save_debug_info(driver, episode_id if 'episode_id' in locals() else "unknown", "_error")
+            save_debug_info(driver, episode_id if 'episode_id' in locals() else "unknown", "_error", failure=True)
         return None
     finally:
         try:
@@ -493,6 +633,53 @@ def get_episode_info(url):
             pass
         print(f"::endgroup::")
 
+def download_segment(segment_url, segment_path, headers, episode_id, index):
+    """セグメントを1つダウンロード（再試行と同時接続数の調整は FetchController が行う）
+
+    200 で返ってきた中身がHTMLだったり途中で切れていたりしたら、もう一度だけ取り直す。
+    """
+    with span("segment_download", episode_id=episode_id, index=index) as s:
+        for attempt in range(2):
+            try:
+                file_size = get_controller().download(segment_url, segment_path, headers=headers)
+            except FetchError as e:
+                print(f"セグメントダウンロードエラー: {e}")
+                s["status"] = "error"
+                return None
+            result = verify_file(segment_path)
+            if result["ok"]:
+                break
+            print(f"セグメントの検査に失敗しました（{attempt + 1}回目）: {format_result(result)}")
+        else:
+            s["status"] = "invalid"
+            os.remove(segment_path)
+            return None
+        s["bytes"] = file_size
+        print(f"ダウンロード完了: {segment_path} (サイズ: {file_size / (1024 * 1024):.2f}MB)")
+        return segment_path
+
+def download_segments(episode_info, segment_urls, extension):
+    """セグメントを並列にダウンロードし、成功したファイルを元の順番で返す"""
+    episode_id = episode_info["id"]
+    
+    # リクエストヘッダーを設定（Refererを含める）
+    headers = {
+        "Referer": episode_info["url"],
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Connection": "keep-alive"
+    }
+    
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_SEGMENTS) as executor:
+        futures = []
+        for i, segment_url in enumerate(segment_urls):
+            segment_path = os.path.join(TEMP_DIR, f"segment_{episode_id}_{i+1}.{extension}")
+            print(f"セグメント {i+1}/{len(segment_urls)} をダウンロード中: {segment_url}")
+            futures.append(executor.submit(download_segment, segment_url, segment_path, headers, episode_id, i + 1))
+        results = [future.result() for future in futures]
+    
+    return [path for path in results if path]
+
 def download_mp3_segments(episode_info, mp3_urls):
     """MP3セグメントをダウンロード"""
     episode_id = episode_info["id"]
@@ -510,62 +697,7 @@ def download_mp3_segments(episode_info, mp3_urls):
     safe_title = re.sub(r"[\\/*?:\"<>|]", "_", title)
     
     # セグメントをダウンロード
-    segment_files = []
-    
-    for i, mp3_url in enumerate(mp3_urls):
-        segment_filename = f"segment_{episode_id}_{i+1}.mp3"
-        segment_path = os.path.join(TEMP_DIR, segment_filename)
-        
-        print(f"セグメント {i+1}/{len(mp3_urls)} をダウンロード中: {mp3_url}")
-        
-        # リクエストヘッダーを設定（Refererを含める）
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Referer": episode_info["url"],
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive"
-        }
-        
-        # ダウンロード試行（最大3回）
-        max_retries = 3
-        success = False
-        
-        for retry in range(max_retries):
-            try:
-                response = requests.get(mp3_url, headers=headers, stream=True, timeout=30)
-                
-                if response.status_code == 200:
-                    with open(segment_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    
-                    # ファイルサイズを確認
-                    file_size = os.path.getsize(segment_path)
-                    print(f"ダウンロード完了: {segment_path} (サイズ: {file_size / (1024 * 1024):.2f}MB)")
-                    
-                    if file_size > 0:
-                        segment_files.append(segment_path)
-                        success = True
-                        break
-                    else:
-                        print(f"ダウンロードしたファイルのサイズが0です")
-                        os.remove(segment_path)
-                        if retry < max_retries - 1:
-                            print(f"リトライ中... ({retry + 1}/{max_retries})")
-                            time.sleep(2)  # 少し待機してから再試行
-                else:
-                    print(f"セグメントダウンロードエラー: ステータスコード {response.status_code}")
-                    if retry < max_retries - 1:
-                        print(f"リトライ中... ({retry + 1}/{max_retries})")
-                        time.sleep(2)  # 少し待機してから再試行
-            except Exception as e:
-                print(f"リクエスト中のエラー: {e}")
-                traceback.print_exc()
-                if retry < max_retries - 1:
-                    print(f"リトライ中... ({retry + 1}/{max_retries})")
-                    time.sleep(2)  # 少し待機してから再試行
+    segment_files = download_segments(episode_info, mp3_urls, "mp3")
     
     print(f"ダウンロードしたセグメント数: {len(segment_files)}/{len(mp3_urls)}")
     
@@ -611,62 +743,7 @@ def download_m3u8_segments(episode_info, segment_urls):
     safe_title = re.sub(r"[\\/*?:\"<>|]", "_", title)
     
     # セグメントをダウンロード
-    segment_files = []
-    
-    for i, segment_url in enumerate(segment_urls):
-        segment_filename = f"segment_{episode_id}_{i+1}.ts"
-        segment_path = os.path.join(TEMP_DIR, segment_filename)
-        
-        print(f"セグメント {i+1}/{len(segment_urls)} をダウンロード中: {segment_url}")
-        
-        # リクエストヘッダーを設定（Refererを含める）
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Referer": episode_info["url"],
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive"
-        }
-        
-        # ダウンロード試行（最大3回）
-        max_retries = 3
-        success = False
-        
-        for retry in range(max_retries):
-            try:
-                response = requests.get(segment_url, headers=headers, stream=True, timeout=30)
-                
-                if response.status_code == 200:
-                    with open(segment_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    
-                    # ファイルサイズを確認
-                    file_size = os.path.getsize(segment_path)
-                    print(f"ダウンロード完了: {segment_path} (サイズ: {file_size / (1024 * 1024):.2f}MB)")
-                    
-                    if file_size > 0:
-                        segment_files.append(segment_path)
-                        success = True
-                        break
-                    else:
-                        print(f"ダウンロードしたファイルのサイズが0です")
-                        os.remove(segment_path)
-                        if retry < max_retries - 1:
-                            print(f"リトライ中... ({retry + 1}/{max_retries})")
-                            time.sleep(2)  # 少し待機してから再試行
-                else:
-                    print(f"セグメントダウンロードエラー: ステータスコード {response.status_code}")
-                    if retry < max_retries - 1:
-                        print(f"リトライ中... ({retry + 1}/{max_retries})")
-                        time.sleep(2)  # 少し待機してから再試行
-            except Exception as e:
-                print(f"リクエスト中のエラー: {e}")
-                traceback.print_exc()
-                if retry < max_retries - 1:
-                    print(f"リトライ中... ({retry + 1}/{max_retries})")
-                    time.sleep(2)  # 少し待機してから再試行
+    segment_files = download_segments(episode_info, segment_urls, "ts")
     
     print(f"ダウンロードしたセグメント数: {len(segment_files)}/{len(segment_urls)}")
     
@@ -699,6 +776,22 @@ def merge_mp3_files(segment_files, output_file):
     """MP3ファイルを結合する"""
     print(f"MP3ファイルを結合しています: {len(segment_files)}個のファイル → {output_file}")
     
+    # タグと Xing ヘッダーを除いてフレーム単位で結合（サブプロセスを起動しない）
+    if IN_PROCESS_MP3_CONCAT:
+        try:
+            with span("mp3_concat", segments=len(segment_files)) as s:
+                stats = concat_mp3(segment_files, output_file)
+                s["bytes"] = stats["bytes"]
+                s["audio_sec"] = stats["duration_sec"]
+            print(f"MP3ファイルの結合に成功しました: {output_file} ({stats['frames']}フレーム, "
+                  f"{stats['duration_sec']:.1f}秒, 除いたヘッダー {stats['skipped_headers']}個)")
+            return output_file
+        except Mp3FormatError as e:
+            print(f"フレーム単位で結合できないため FFmpeg で結合します: {e}")
+        except Exception as e:
+            print(f"フレーム単位の結合エラー: {e}")
+            traceback.print_exc()
+    
     # FFmpegがインストールされているか確認
     ffmpeg_available = ensure_ffmpeg_installed()
     
@@ -706,7 +799,7 @@ def merge_mp3_files(segment_files, output_file):
         try:
             # FFmpegを使用してMP3ファイルを結合
             # 入力ファイルリストを作成
-            input_list_file = os.path.join(TEMP_DIR, "input_list.txt")
+            input_list_file = os.path.join(TEMP_DIR, f"input_list_{os.getpid()}_{threading.get_ident()}.txt")  # 別プロセス・別スレッドと衝突しないように
             with open(input_list_file, "w", encoding="utf-8") as f:
                 for segment_file in segment_files:
                     # パスをエスケープして絶対パスに変換
@@ -728,12 +821,15 @@ def merge_mp3_files(segment_files, output_file):
             
             print(f"FFmpegコマンド: {' '.join(ffmpeg_cmd)}")
             
-            process = subprocess.run(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            with span("ffmpeg_merge", segments=len(segment_files)) as s:
+                process = subprocess.run(
+                    ffmpeg_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True
+                )
+                if process.returncode != 0:
+                    s["status"] = "error"
             
             # 入力リストファイルを削除
             os.remove(input_list_file)
@@ -794,7 +890,7 @@ def merge_ts_files_to_mp3(segment_files, output_file):
         try:
             # FFmpegを使用してTSファイルを結合してMP3に変換
             # 入力ファイルリストを作成
-            input_list_file = os.path.join(TEMP_DIR, "input_list.txt")
+            input_list_file = os.path.join(TEMP_DIR, f"input_list_{os.getpid()}_{threading.get_ident()}.txt")  # 別プロセス・別スレッドと衝突しないように
             with open(input_list_file, "w", encoding="utf-8") as f:
                 for segment_file in segment_files:
                     # パスをエスケープして絶対パスに変換
@@ -817,12 +913,15 @@ def merge_ts_files_to_mp3(segment_files, output_file):
             
             print(f"FFmpegコマンド: {' '.join(ffmpeg_cmd)}")
             
-            process = subprocess.run(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            with span("ffmpeg_merge", segments=len(segment_files)) as s:
+                process = subprocess.run(
+                    ffmpeg_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True
+                )
+                if process.returncode != 0:
+                    s["status"] = "error"
             
             # 入力リストファイルを削除
             os.remove(input_list_file)
@@ -838,7 +937,7 @@ def merge_ts_files_to_mp3(segment_files, output_file):
                 try:
                     print(f"代替方法でTSファイルを結合しています...")
                     # まず一時的なTSファイルに結合
-                    temp_ts_file = os.path.join(TEMP_DIR, "temp_combined.ts")
+                    temp_ts_file = os.path.join(TEMP_DIR, f"temp_combined_{os.getpid()}_{threading.get_ident()}.ts")
                     with open(temp_ts_file, "wb") as outfile:
                         for segment_file in segment_files:
                             with open(segment_file, "rb") as infile:
@@ -856,12 +955,15 @@ def merge_ts_files_to_mp3(segment_files, output_file):
                     
                     print(f"代替FFmpegコマンド: {' '.join(ffmpeg_cmd2)}")
                     
-                    process2 = subprocess.run(
-                        ffmpeg_cmd2,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True
-                    )
+                    with span("ffmpeg_merge", segments=len(segment_files), fallback=True) as s:
+                        process2 = subprocess.run(
+                            ffmpeg_cmd2,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            text=True
+                        )
+                        if process2.returncode != 0:
+                            s["status"] = "error"
                     
                     # 一時ファイルを削除
                     os.remove(temp_ts_file)
@@ -885,6 +987,71 @@ def merge_ts_files_to_mp3(segment_files, output_file):
     print(f"FFmpegが利用できないため、TSファイルをMP3に変換できません")
     return None
 
+def verify_download(mp3_file, episode_info, url, download_history):
+    """結合したMP3を検査し、問題があれば再ダウンロード対象として記録する
+
+    プレイリストがあれば #EXTINF の合計と長さを比べる。再ダウンロードが上限に達した
+    エピソードはファイルを残して履歴に加える（書き起こしは検査記録を見て飛ばす）。
+    """
+    episode_id = episode_info["id"]
+    with span("verify", episode_id=episode_id) as s:
+        result = verify_mp3(mp3_file, episode_info.get("expected_duration"))
+        s["audio_sec"] = result["duration_sec"]
+        s["bytes"] = result["size"]
+        if not result["ok"]:
+            s["status"] = "invalid"
+    print(f"音声の検査: {format_result(result)}")
+    
+    if result["ok"]:
+        clear_bad(episode_id, BAD_AUDIO_FILE)
+        download_history.append(url)
+        record_episode(mp3_file, episode_info, url, result)
+        return True
+    
+    attempts = mark_bad(episode_id, result, "downloader", BAD_AUDIO_FILE)
+    if attempts < MAX_REDOWNLOADS:
+        print(f"検査に通らなかったため削除し、次回再ダウンロードします（{attempts}/{MAX_REDOWNLOADS}回目）")
+        os.remove(mp3_file)
+        forget_episode(episode_id)
+    else:
+        print(f"再ダウンロードしても検査に通りません。ファイルを残して書き起こしの対象外にします: {mp3_file}")
+        download_history.append(url)
+    return False
+
+_index_entries = []  # 索引にまだ書き出していない件
+_index_removed = []  # 索引からまだ消していないエピソードID（ファイルを削除した件）
+_index_lock = threading.Lock()
+
+def record_episode(mp3_file, episode_info, url, result):
+    """検査に通ったエピソードのメタデータを索引に書き出す件として溜める"""
+    entry = make_entry(episode_info["id"], mp3_file, episode_info["title"], episode_info["date"],
+                       duration_sec=result["duration_sec"], size=result["size"],
+                       is_premium=episode_info.get("is_premium", False),
+                       audio_hash=audio_hash(mp3_file), url=url)
+    with _index_lock:
+        _index_entries.append(entry)
+
+def forget_episode(episode_id):
+    """MP3ファイルを削除したエピソードを索引から消す件として溜める"""
+    with _index_lock:
+        _index_removed.append(episode_id)
+
+def save_episode_index():
+    """溜めた件を索引に書き出す（他のプロセスの追加は読み直して残す）
+
+    書き起こし側は走査済みの索引を信じてMP3ディレクトリを走査しないので、ファイルの追加と削除は
+    必ずここを通して索引に反映する。まだ走査していない索引なら、ここで一度走査する。
+    """
+    with _index_lock:
+        entries = list(_index_entries)
+        removed = list(_index_removed)
+        del _index_entries[:]
+        del _index_removed[:]
+    if not entries and not removed:
+        return
+    count = update_index(EPISODE_INDEX_FILE, entries, removed, MP3_DIR)
+    print(f"エピソードの索引を更新しました: {len(entries)}件追加, {len(removed)}件削除（全{count}件）")
+
 def process_episode(url, download_history):
     """エピソードを処理"""
     print(f"::group::エピソード処理: {url}")
@@ -907,16 +1074,14 @@ def process_episode(url, download_history):
     if episode_info["type"] == "mp3":
         # MP3ファイルをダウンロード
         mp3_file = download_mp3_segments(episode_info, episode_info["mp3_urls"])
-        if mp3_file:
+        if mp3_file and verify_download(mp3_file, episode_info, url, download_history):
             print(f"MP3ファイルのダウンロードに成功しました: {mp3_file}")
-            download_history.append(url)
             return mp3_file
     elif episode_info["type"] == "m3u8":
         # m3u8セグメントをダウンロード
         mp3_file = download_m3u8_segments(episode_info, episode_info["segment_urls"])
-        if mp3_file:
+        if mp3_file and verify_download(mp3_file, episode_info, url, download_history):
             print(f"m3u8セグメントのダウンロードと変換に成功しました: {mp3_file}")
-            download_history.append(url)
             return mp3_file
     
     print(f"エピソードの処理に失敗しました: {url}")
@@ -925,56 +1090,213 @@ def process_episode(url, download_history):
 
 def main():
     """メイン処理"""
+    args = setup_args()
+    if args.workers > 1 and args.shard is None:
+        run_workers(args)
+        return
     print("Voicy MP3ダウンローダーを開始します")
+    instrumentation.init("downloader" if args.shard is None else f"downloader_shard{args.shard[0]}")
+    if args.profile:
+        profiling.enable(args.profile_dir)
+    try:
+        run(args.shard, args.channel, args.queue, args.episode_shard)
+    finally:
+        # 通信しなかった実行ではキャッシュを開かない
+        cache = get_http_cache(create=False)
+        if cache is not None:
+            cache.evict()
+            print(cache.format_report())
+        get_controller().print_stats()
+        instrumentation.finish()
+        profiling.finish()
+
+def run_workers(args):
+    """シャードごとに別プロセスでダウンローダーを起動し、すべての終了を待つ"""
+    print(f"{args.workers}個のシャードを並行に処理します")
+    processes = []
+    for index in range(args.workers):
+        command = [sys.executable, os.path.abspath(__file__), "--shard", f"{index}/{args.workers}"]
+        for channel_id in args.channel or []:
+            command += ["--channel", channel_id]
+        if args.profile:
+            command += ["--profile", "--profile_dir", args.profile_dir]
+        if args.queue:
+            command += ["--queue", args.queue]
+        processes.append(subprocess.Popen(command))
+    return_codes = [process.wait() for process in processes]
+    failed = [index for index, code in enumerate(return_codes) if code != 0]
+    if failed:
+        print(f"異常終了したシャード: {failed}")
+        sys.exit(1)
+
+def load_target_channels(shard=None, channel_ids=None):
+    """処理するチャンネルを読み込む（一覧がなければ従来のURLリストと履歴を1チャンネルとして扱う）"""
+    channels = load_channels(CHANNELS_FILE, CHANNELS_DIR)
+    if channels is None:
+        if not os.path.exists(JSON_FILE):
+            print(f"JSONファイルが存在しません: {JSON_FILE}")
+            create_sample_json()
+        channels = [legacy_channel(JSON_FILE, DOWNLOAD_HISTORY_FILE)]
+    return select_channels(channels, shard, channel_ids)
+
+def claim_downloads(work_queue, channels, limit):
+    """作業キューから1件ずつ借りて (チャンネル, URL) を返す（借りるのは処理の直前）"""
+    channels_by_id = {channel["id"]: channel for channel in channels}
+    for _ in range(limit):
+        claimed = work_queue.claim("download", 1, groups=list(channels_by_id))
+        if not claimed:
+            return
+        url, channel_id, _, attempts = claimed[0]
+        if attempts > 1:
+            print(f"作業キュー: {attempts}回目の取り出しです（前回は失敗か期限切れ）: {url}")
+        yield channels_by_id[channel_id], url
+
+def find_pending(channels, bad_audio):
+    """チャンネルごとの履歴・履歴から外すURL・未ダウンロードのURLを求める（履歴は集合にして照合する）
+
+    書き起こし側で検査に通らなかったエピソードは、再ダウンロードの上限までは履歴から外す。
+    """
+    redownload_ids = {episode_id for episode_id, entry in bad_audio.items()
+                      if entry.get("attempts", 0) < MAX_REDOWNLOADS}
+    histories = {}
+    removed = {}
+    pending = {}
+    for channel in channels:
+        history = load_history(channel)
+        urls = load_urls(channel)
+        if redownload_ids:
+            kept = [url for url in history if url.rstrip("/").split("/")[-1] not in redownload_ids]
+            if len(kept) != len(history):
+                print(f"検査に通らなかったエピソードを再ダウンロードします: {channel['name']} {len(history) - len(kept)}件")
+                kept_set = set(kept)
+                removed[channel["id"]] = [url for url in history if url not in kept_set]
+                history = kept
+        downloaded = set(history)
+        histories[channel["id"]] = history
+        pending[channel["id"]] = [url for url in urls if url not in downloaded]
+        print(f"チャンネル {channel['name']}: URL {len(urls)}件, 履歴 {len(history)}件, "
+              f"未ダウンロード {len(pending[channel['id']])}件")
+    return histories, removed, pending
+
+def run(shard=None, channel_ids=None, queue_file=None, episode_shard=None):
+    """未ダウンロードのエピソードをチャンネル間で公平に選んで処理
+
+    queue_file を指定すると、未ダウンロードのURLを作業キューに登録し、そこから1件ずつ
+    借りて処理する。同じキューを使う他のワーカーとは同じエピソードを取り合わない。
+    episode_shard を指定すると、エピソードIDのハッシュで受け持ちのエピソードだけを処理する
+    （キューを共有できない別々のランナーで分担するとき）。
+    """
     
-    # 必要なディレクトリを作成
-    setup_directories()
+    # 対象のチャンネルを読み込む
+    channels = load_target_channels(shard, channel_ids)
+    shard_label = f"（シャード {shard[0]}/{shard[1]}）" if shard else ""
+    print(f"対象チャンネル: {len(channels)}件{shard_label}")
     
-    # FFmpegがインストールされているか確認
-    ensure_ffmpeg_installed()
+    # 書き起こし側で検査に通らなかったエピソードは履歴から外して再ダウンロードする
+    bad_audio = load_bad_audio(BAD_AUDIO_FILE)
+    histories, removed, pending = find_pending(channels, bad_audio)
+    if episode_shard:
+        pending = {channel_id: [url for url in urls if in_shard(url.rstrip("/").split("/")[-1], episode_shard)]
+                   for channel_id, urls in pending.items()}
+        print(f"エピソードのシャード {episode_shard[0]}/{episode_shard[1]} の受け持ちだけを処理します")
+    loaded_counts = {channel_id: len(history) for channel_id, history in histories.items()}
     
-    # ダウンロード履歴を読み込む
-    download_history = load_download_history()
-    print(f"ダウンロード履歴: {len(download_history)}件")
+    total_pending = sum(len(urls) for urls in pending.values())
+    print(f"未ダウンロードのURL: {total_pending}件")
+    startup_sec = instrumentation.mark_startup(pending=total_pending, channels=len(channels))
+    print(f"起動から処理対象の判定まで: {startup_sec * 1000:.1f}ms")
     
-    # URLリストを読み込む
-    urls = load_urls_from_json()
-    print(f"URLリスト: {len(urls)}件")
+    if not total_pending:
+        print("処理するURLがありません。すべてのURLが既にダウンロード済みです。")
+        return
     
-    # URLリストが空の場合、サンプルURLを使用
-    if not urls:
-        print("URLリストが空です。サンプルURLを使用します。")
-        urls = [
-            "https://voicy.jp/channel/1234/567890",
-            "https://voicy.jp/channel/1234/567891"
-        ]
+    # 必要なディレクトリを作成
+    setup_directories()
     
-    # 未ダウンロードのURLをフィルタリング
-    urls_to_process = [url for url in urls if url not in download_history]
-    print(f"未ダウンロードのURL: {len(urls_to_process)}件")
+    # FFmpegがインストールされているか確認
+    ensure_ffmpeg_installed()
     
-    if not urls_to_process:
-        print("処理するURLがありません。すべてのURLが既にダウンロード済みです。")
-        return
+    # デバッグ情報の保存先（書き込みは別スレッド）
+    debug_capture = DebugCapture(DEBUG_DIR, DEBUG_LEVEL if DEBUG_MODE else "off",
+                                 DEBUG_SAMPLE_RATE, DEBUG_MAX_MB * 1024 * 1024)
+    set_debug_capture(debug_capture)
     
-    # 最大ダウンロード数を制限
-    if len(urls_to_process) > MAX_DOWNLOADS_PER_RUN:
+    # 最大ダウンロード数までを、前回順番が回ってこなかったチャンネルから重み付きで順に割り当てる
+    states = {channel["id"]: load_state(channel) for channel in channels}
+    work_queue = None
+    if queue_file:
+        # キューにはすべての未ダウンロードを公平な順で登録し、処理する分だけ借りる
+        # （再ダウンロード対象は、検査に通らなかった時刻より前に完了した記録を未処理に戻す）
+        work_queue = WorkQueue(queue_file)
+        added = work_queue.enqueue("download", [
+            (url, channel["id"], None, bad_audio.get(url.rstrip("/").split("/")[-1], {}).get("checked_at", 0))
+            for channel, url in schedule_fair(pending, total_pending, channels, states)])
+        print(f"作業キューに登録しました: 新規 {added}件")
+        print(work_queue.format_report("download"))
+        schedule = claim_downloads(work_queue, channels, MAX_DOWNLOADS_PER_RUN)
+        planned = min(total_pending, MAX_DOWNLOADS_PER_RUN)
+    else:
+        schedule = schedule_fair(pending, MAX_DOWNLOADS_PER_RUN, channels, states)
+        planned = len(schedule)
+    if total_pending > MAX_DOWNLOADS_PER_RUN:
         print(f"ダウンロード数を{MAX_DOWNLOADS_PER_RUN}件に制限します")
-        urls_to_process = urls_to_process[:MAX_DOWNLOADS_PER_RUN]
     
     # 各URLを処理
     successful_downloads = 0
+    attempted = 0
+    scheduled = {}
+    succeeded = {}
+    scheduled_at = {}
+    
+    try:
+        for channel, url in schedule:
+            attempted += 1
+            print(f"\n--- URL {attempted}/{planned} 処理中（{channel['name']}） ---")
+            scheduled[channel["id"]] = scheduled.get(channel["id"], 0) + 1
+            scheduled_at[channel["id"]] = time.time()
+            episode_id = url.rstrip("/").split("/")[-1]
+            history = histories[channel["id"]]
+            # キューから借りた作業は、処理している間ずっと貸し出しを延ばす
+            lease = Heartbeat(work_queue, "download", [url]) if work_queue else nullcontext()
+            with lease, profiling.profile(f"episode_{episode_id}"), \
+                    span("episode", url=url, channel=channel["id"]) as s:
+                result = process_episode(url, history)
+                if not result:
+                    s["status"] = "failed"
+            if result:
+                successful_downloads += 1
+                succeeded[channel["id"]] = succeeded.get(channel["id"], 0) + 1
+            if work_queue:
+                # 履歴に入ったもの（検査に通らないまま上限に達したものを含む）は完了、それ以外は再試行
+                if url in history:
+                    if not work_queue.complete("download", url) or lease.lost:
+                        print(f"作業キュー: 処理中に貸し出し期限が切れていました: {url}")
+                else:
+                    work_queue.fail("download", url, "download failed")
+    finally:
+        # 書き込み待ちのデバッグ情報を書き出す
+        debug_capture.close()
+        print(debug_capture.format_report())
+        if work_queue:
+            print(work_queue.format_report("download"))
+            work_queue.close()
     
-    for url in urls_to_process:
-        print(f"\n--- URL {urls_to_process.index(url) + 1}/{len(urls_to_process)} 処理中 ---")
-        result = process_episode(url, download_history)
-        if result:
-            successful_downloads += 1
+    # 順番が回ってきたチャンネルのダウンロード履歴と状態を保存
+    # （他のワーカーが同じチャンネルの履歴を更新していても消さないよう、読み直して差分を反映する）
+    for channel in channels:
+        if channel["id"] not in scheduled:
+            continue
+        # process_episode は履歴の末尾に追加するので、読み込んだ件数より後ろが今回の追加分
+        added = histories[channel["id"]][loaded_counts[channel["id"]]:]
+        update_history(channel, added, removed.get(channel["id"], []))
+        save_state(channel, mark_scheduled(channel, states[channel["id"]], scheduled[channel["id"]],
+                                           succeeded.get(channel["id"], 0), scheduled_at[channel["id"]]))
+        print(f"チャンネル {channel['name']}: {succeeded.get(channel['id'], 0)}/{scheduled[channel['id']]}件成功")
     
-    # ダウンロード履歴を保存
-    save_download_history(download_history)
+    # ダウンロードしたエピソードのメタデータを索引に書き出す（書き起こし側はディレクトリを走査せずに引く）
+    save_episode_index()
     
-    print(f"\n処理完了: {successful_downloads}/{len(urls_to_process)}件のダウンロードに成功しました")
+    print(f"\n処理完了: {successful_downloads}/{attempted}件のダウンロードに成功しました")
 
 if __name__ == "__main__":
     main()
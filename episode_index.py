@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+
+from work_queue import file_lock
+
+INDEX_FILE = os.path.join("output", "episode_index.bin")  # エピソードのメタデータの索引
+MAGIC = b"VEIX"
+VERSION = 2
+FLAG_COMPLETE = 1  # MP3ディレクトリを走査して作った索引（以後は書き手がファイルの増減を反映する）
+MIN_CAPACITY = 16
+MAX_LOAD = 0.5  # スロットの使用率の上限（これを超えないようにスロット数を2倍ずつ増やす）
+
+# ヘッダー: マジック, 版, スロット数, 件数, レコード領域の開始位置, フラグ
+HEADER = struct.Struct("<4sIIIQI")
+# スロット: キーのハッシュ（0は空き）, レコードの位置
+SLOT = struct.Struct("<QQ")
+# レコード: 長さ + JSON（UTF-8）
+LENGTH = struct.Struct("<I")
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='エピソードIDをキーにしたメタデータの索引を作成・参照します')
+    parser.add_argument('command', choices=['build', 'get', 'stats'],
+                        help='build: MP3ファイルとエピソード一覧から作り直す / get: 1件表示 / stats: 件数などを表示')
+    parser.add_argument('episode_ids', nargs='*', help='get で表示するエピソードID')
+    parser.add_argument('--index', type=str, default=INDEX_FILE,
+                        help='索引ファイルのパス')
+    parser.add_argument('--mp3_dir', type=str, default='mp3_downloads',
+                        help='MP3ファイルのディレクトリパス')
+    parser.add_argument('--text_dir', type=str, default='mp3_text',
+                        help='書き起こしテキストのディレクトリパス（build で書き起こしの有無を表示する）')
+    return parser.parse_args()
+
+def key_hash(episode_id):
+    """エピソードIDの64ビットハッシュ（0は空きスロットの印なので使わない）"""
+    value = int.from_bytes(hashlib.blake2b(str(episode_id).encode("utf-8"), digest_size=8).digest(), "little")
+    return value or 1
+
+def make_entry(episode_id, mp3_file, title, date, **fields):
+    """索引の1件。成果物は各ディレクトリからの相対パスで持ち、書き起こしなどのパスはここで決める"""
+    stem = os.path.splitext(os.path.basename(mp3_file))[0]
+    entry = {
+        "episode_id": str(episode_id),
+        "title": title,
+        "date": date,
+        "duration_sec": None,
+        "size": None,
+        "is_premium": False,
+        "audio_hash": None,
+        "url": None,
+        "mp3_file": os.path.basename(mp3_file),
+        "text_file": stem + ".txt",
+        "segments_file": os.path.join(f"date={date}", f"{episode_id}.npz"),
+        "updated_at": time.time(),
+    }
+    entry.update(fields)
+    return entry
+
+class EpisodeIndex:
+    """mmap で開く、エピソードIDをキーにしたオープンアドレス法（線形探索）のハッシュ表
+
+    ファイルはヘッダー・スロット表・レコード（長さ付きのJSON）の順に並ぶ。引くときは
+    スロット表だけを辿り、一致したスロットのレコードを1件だけ読むので、件数によらず O(1)。
+    書き換えは一時ファイルに書いて置き換えるので、開いている読み手は古い内容を読み続けられる。
+    complete はMP3ディレクトリを走査して作った索引か。索引はリポジトリにコミットするので、
+    チェックアウトで変わるディレクトリの更新時刻ではなく、このフラグで走査を省けるかを決める。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, self.count, self.records_offset, flags = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"索引ファイルの形式が違います: {path}")
+        self.complete = bool(flags & FLAG_COMPLETE)
+
+    @classmethod
+    def open(cls, path=INDEX_FILE):
+        """索引を開く（なければNone。旧版の形式も作り直すためNone）"""
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except ValueError:
+            return None
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, episode_id):
+        return self.get(episode_id) is not None
+
+    def _record(self, offset):
+        (length,) = LENGTH.unpack_from(self._mmap, offset)
+        start = offset + LENGTH.size
+        return json.loads(self._mmap[start:start + length].decode("utf-8"))
+
+    def get(self, episode_id):
+        """エピソードIDの1件を返す（なければNone）"""
+        episode_id = str(episode_id)
+        target = key_hash(episode_id)
+        mask = self.capacity - 1
+        slot = target & mask
+        while True:
+            hash_value, offset = SLOT.unpack_from(self._mmap, HEADER.size + slot * SLOT.size)
+            if hash_value == 0:
+                return None
+            if hash_value == target:
+                entry = self._record(offset)
+                if entry["episode_id"] == episode_id:
+                    return entry
+            slot = (slot + 1) & mask
+
+    def __iter__(self):
+        """すべての件を書き込んだ順に返す"""
+        offset = self.records_offset
+        for _ in range(self.count):
+            (length,) = LENGTH.unpack_from(self._mmap, offset)
+            yield self._record(offset)
+            offset += LENGTH.size + length
+
+def write_index(path, entries, complete=False):
+    """すべての件から索引を書き出す（一時ファイル経由で置き換える）
+
+    complete はMP3ディレクトリを走査した結果か、走査済みの索引に増減を反映した結果のときだけ真にする。
+    """
+    entries = list(entries)
+    capacity = MIN_CAPACITY
+    while len(entries) > capacity * MAX_LOAD:
+        capacity *= 2
+    records_offset = HEADER.size + capacity * SLOT.size
+    slots = bytearray(capacity * SLOT.size)
+    records = bytearray()
+    mask = capacity - 1
+    for entry in entries:
+        hash_value = key_hash(entry["episode_id"])
+        slot = hash_value & mask
+        while SLOT.unpack_from(slots, slot * SLOT.size)[0] != 0:
+            slot = (slot + 1) & mask
+        SLOT.pack_into(slots, slot * SLOT.size, hash_value, records_offset + len(records))
+        data = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+        records += LENGTH.pack(len(data)) + data
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, capacity, len(entries), records_offset,
+                            FLAG_COMPLETE if complete else 0))
+        f.write(slots)
+        f.write(records)
+    os.replace(tmp_path, path)
+
+def load_entries(path):
+    """索引の全件をエピソードID → 件の辞書で返す（なければ空）"""
+    index = EpisodeIndex.open(path)
+    if index is None:
+        return {}
+    with index:
+        return {entry["episode_id"]: entry for entry in index}
+
+def update_index(path, entries, removed=(), mp3_dir=None):
+    """索引を読み直して件を追加・更新・削除し、書き出す（他のプロセスの追加を消さない）。全件数を返す
+
+    まだ走査していない索引なら、mp3_dir を指定すると先にディレクトリを走査して走査済みにする。
+    ダウンロードした件だけを書いた索引を走査済みと見なすと、ほかの未書き起こしのファイルを見落とすため。
+    """
+    with file_lock(path):
+        index = EpisodeIndex.open(path)
+        merged = {}
+        complete = False
+        if index is not None:
+            with index:
+                merged = {entry["episode_id"]: entry for entry in index}
+                complete = index.complete
+        if not complete and mp3_dir is not None:
+            merged = scan_entries(mp3_dir, merged)
+            complete = True
+        for entry in entries:
+            merged[entry["episode_id"]] = dict(merged.get(entry["episode_id"], {}), **entry)
+        for episode_id in removed:
+            merged.pop(str(episode_id), None)
+        write_index(path, merged.values(), complete)
+    return len(merged)
+
+def entry_from_file(mp3_file, catalog=None, inspect=False):
+    """索引にないMP3ファイルの件を作る（ファイル名を読むのはここだけ。エピソード一覧にあればそのタイトルを使う）
+
+    inspect=True ならフレームを数えて長さを、先頭のバイトから音声のハッシュを求める。
+    """
+    from audio_verify import episode_id_from_path, audio_hash
+    stem = os.path.splitext(os.path.basename(mp3_file))[0]
+    episode_id = episode_id_from_path(mp3_file)
+    date, _, rest = stem.partition('_')
+    title = rest[:-(len(episode_id) + 1)] if rest.endswith('_' + episode_id) else rest
+    known = (catalog or {}).get(episode_id, {})
+    fields = {"size": os.path.getsize(mp3_file), "url": known.get("url")}
+    if inspect:
+        from audio_verify import verify_mp3
+        fields["duration_sec"] = verify_mp3(mp3_file)["duration_sec"]
+        fields["audio_hash"] = audio_hash(mp3_file)
+    return make_entry(episode_id, mp3_file, known.get("title") or title, date, **fields)
+
+def scan_entries(mp3_dir, entries, catalog=None):
+    """MP3ディレクトリにあるファイルの件をエピソードID → 件で返す（索引にある件はそのまま使う）"""
+    from audio_verify import episode_id_from_path
+    present = {}
+    for mp3_file in glob.glob(os.path.join(mp3_dir, '*.mp3')):
+        episode_id = episode_id_from_path(mp3_file)
+        entry = entries.get(episode_id)
+        if entry is None or entry["mp3_file"] != os.path.basename(mp3_file):
+            entry = entry_from_file(mp3_file, catalog)
+        present[episode_id] = entry
+    return present
+
+def sync_index(path, mp3_dir, catalog=None, rescan=False):
+    """索引を開く。まだ走査していない索引（か rescan=True）なら、MP3ディレクトリを走査して開き直す
+
+    走査済みの索引はダウンロードと削除のたびに書き手が更新するので、ディレクトリは走査しない。
+    索引を書かない手段で置いたファイルは rescan=True で拾う。
+    """
+    index = EpisodeIndex.open(path)
+    if index is not None:
+        if index.complete and not rescan:
+            return index
+        index.close()
+    with file_lock(path):
+        present = scan_entries(mp3_dir, load_entries(path), catalog)
+        write_index(path, present.values(), complete=True)
+    return EpisodeIndex(path)
+
+def main():
+    args = setup_args()
+    if args.command == 'build':
+        from consistency_check import load_catalog
+        catalog = load_catalog()
+        start = time.perf_counter()
+        with file_lock(args.index):
+            known = load_entries(args.index)
+            entries = []
+            for mp3_file in sorted(glob.glob(os.path.join(args.mp3_dir, '*.mp3'))):
+                entry = entry_from_file(mp3_file, catalog, inspect=True)
+                entries.append(dict(known.get(entry["episode_id"], {}), **entry))
+            write_index(args.index, entries, complete=True)
+        print(f"索引を作成しました: {args.index} ({len(entries)}件, {time.perf_counter() - start:.2f}秒)")
+        return
+
+    index = EpisodeIndex.open(args.index)
+    if index is None:
+        print(f"索引がありません: {args.index}")
+        sys.exit(1)
+    with index:
+        if args.command == 'get':
+            for episode_id in args.episode_ids:
+                print(json.dumps(index.get(episode_id), ensure_ascii=False, indent=2))
+        else:
+            transcribed = sum(1 for entry in index
+                              if os.path.exists(os.path.join(args.text_dir, entry["text_file"])))
+            print(f"件数: {len(index)}, スロット数: {index.capacity}, 大きさ: {os.path.getsize(args.index)}バイト, "
+                  f"書き起こし済み: {transcribed}件, MP3ディレクトリを走査済み: {'はい' if index.complete else 'いいえ'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import hashlib
+import random
+import struct
+import argparse
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- 音声データの生成 ---
+
+# MPEG-1 Layer III, 128kbps, 44.1kHz, モノラル, CRCなし
+MP3_FRAME_HEADER = b"\xff\xfb\x90\xc0"
+MP3_FRAME_SIZE = 417  # 144 * 128000 // 44100
+MP3_FRAME_SAMPLES = 1152
+MP3_SAMPLE_RATE = 44100
+
+LAST_MODIFIED = "Mon, 01 Jul 2024 00:00:00 GMT"  # ページとプレイリストの更新日時（固定）
+
+TS_PACKET_SIZE = 188
+PMT_PID = 0x1000
+AUDIO_PID = 0x0100
+FRAMES_PER_PES = 10
+
+def mp3_frames(n_frames):
+    """無音のMP3フレームを n_frames 個並べたバイト列（サイド情報が全て0なので無音として復号される）"""
+    frame = MP3_FRAME_HEADER + b"\x00" * (MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * n_frames
+
+def frames_for_duration(duration_sec):
+    """指定秒数に必要なMP3フレーム数"""
+    return max(1, round(duration_sec * MP3_SAMPLE_RATE / MP3_FRAME_SAMPLES))
+
+def _crc32_mpeg(data):
+    """MPEG-2 の PSI で使う CRC32（多項式 0x04C11DB7, 反転なし）"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+            crc &= 0xFFFFFFFF
+    return crc
+
+def _psi_packet(pid, table):
+    """PAT/PMT のセクションを1パケットに収める"""
+    section = table + struct.pack(">I", _crc32_mpeg(table))
+    payload = b"\x00" + section  # pointer_field
+    header = struct.pack(">BHB", 0x47, 0x4000 | pid, 0x10)
+    return header + payload + b"\xff" * (TS_PACKET_SIZE - 4 - len(payload))
+
+def _pat():
+    body = struct.pack(">HBBB", 1, 0xC1, 0, 0) + struct.pack(">HH", 1, 0xE000 | PMT_PID)
+    return _psi_packet(0, struct.pack(">BH", 0x00, 0xB000 | (len(body) + 4)) + body)
+
+def _pmt():
+    # stream_type 0x03 = MPEG-1 Audio
+    body = (struct.pack(">HBBB", 1, 0xC1, 0, 0) + struct.pack(">HH", 0xE000 | AUDIO_PID, 0xF000)
+            + struct.pack(">BHH", 0x03, 0xE000 | AUDIO_PID, 0xF000))
+    return _psi_packet(PMT_PID, struct.pack(">BH", 0x02, 0xB000 | (len(body) + 4)) + body)
+
+def _pts_bytes(pts):
+    """PESヘッダのPTS（33ビット, マーカービット付き5バイト）"""
+    return bytes([
+        0x21 | ((pts >> 29) & 0x0E),
+        (pts >> 22) & 0xFF,
+        0x01 | ((pts >> 14) & 0xFE),
+        (pts >> 7) & 0xFF,
+        0x01 | ((pts << 1) & 0xFE),
+    ])
+
+def _packetize(pid, pes, cc):
+    """PESパケットをTSパケットに分割する（最後のパケットはアダプテーションフィールドで埋める）"""
+    packets = []
+    offset = 0
+    first = True
+    while offset < len(pes):
+        chunk = pes[offset:offset + TS_PACKET_SIZE - 4]
+        offset += len(chunk)
+        pusi = 0x4000 if first else 0
+        first = False
+        if len(chunk) == TS_PACKET_SIZE - 4:
+            header = struct.pack(">BHB", 0x47, pusi | pid, 0x10 | cc)
+            packets.append(header + chunk)
+        else:
+            stuffing = TS_PACKET_SIZE - 4 - len(chunk)
+            header = struct.pack(">BHB", 0x47, pusi | pid, 0x30 | cc)
+            if stuffing == 1:
+                adaptation = b"\x00"
+            else:
+                adaptation = bytes([stuffing - 1, 0x00]) + b"\xff" * (stuffing - 2)
+            packets.append(header + adaptation + chunk)
+        cc = (cc + 1) & 0x0F
+    return packets, cc
+
+def ts_segment(index, segment_sec):
+    """index番目のTSセグメント（PTSと連続性カウンタは前のセグメントから続く）"""
+    n_frames = frames_for_duration(segment_sec)
+    frame_ticks = MP3_FRAME_SAMPLES * 90000 // MP3_SAMPLE_RATE
+    pes_count = -(-n_frames // FRAMES_PER_PES)
+
+    # 1セグメントあたりの音声パケット数は一定なので、先頭の連続性カウンタを計算で求める
+    packets_per_segment = 0
+    frames_left = n_frames
+    for _ in range(pes_count):
+        size = 14 + min(FRAMES_PER_PES, frames_left) * MP3_FRAME_SIZE
+        packets_per_segment += -(-size // (TS_PACKET_SIZE - 4))
+        frames_left -= FRAMES_PER_PES
+    cc = (index * packets_per_segment) & 0x0F
+    psi_cc = index & 0x0F
+
+    pat = bytearray(_pat())
+    pmt = bytearray(_pmt())
+    pat[3] |= psi_cc
+    pmt[3] |= psi_cc
+    packets = [bytes(pat), bytes(pmt)]
+
+    pts = 90000 + index * n_frames * frame_ticks
+    frames_left = n_frames
+    for _ in range(pes_count):
+        count = min(FRAMES_PER_PES, frames_left)
+        payload = mp3_frames(count)
+        pes = (b"\x00\x00\x01\xc0" + struct.pack(">H", 8 + len(payload))
+               + b"\x80\x80\x05" + _pts_bytes(pts) + payload)
+        new_packets, cc = _packetize(AUDIO_PID, pes, cc)
+        packets.extend(new_packets)
+        pts += count * frame_ticks
+        frames_left -= count
+    return b"".join(packets)
+
+# --- サーバー ---
+
+class FakeVoicyConfig:
+    """疑似サーバーの設定"""
+
+    def __init__(self, episodes=10, segments=6, segment_sec=10.0, mode="m3u8", master=True,
+                 latency=0.0, bandwidth=0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 premium_every=0, soft_error_rate=0.0, seed=0):
+        self.episodes = episodes  # エピソード数（IDは 100001 から連番）
+        self.segments = segments  # 1エピソードあたりのセグメント数
+        self.segment_sec = segment_sec  # セグメントの長さ（秒）
+        self.mode = mode  # "m3u8" または "mp3"
+        self.master = master  # m3u8 でマスタープレイリストを挟むか
+        self.latency = latency  # 応答前の待ち時間（秒）
+        self.bandwidth = bandwidth  # 1接続あたりの帯域上限（バイト/秒, 0で無制限）
+        self.error_rate = error_rate  # 500 を返す確率（音声・プレイリストのみ）
+        self.throttle_rate = throttle_rate  # 429 を返す確率（音声・プレイリストのみ）
+        self.retry_after = retry_after  # 429 の Retry-After（秒）
+        self.premium_every = premium_every  # n件ごとに有料放送にする（0で無効）
+        self.soft_error_rate = soft_error_rate  # 音声の代わりにHTMLのエラーページを 200 で返す確率
+        self.seed = seed
+
+    def episode_ids(self):
+        return [str(100001 + i) for i in range(self.episodes)]
+
+class FakeVoicyServer(ThreadingHTTPServer):
+    """Voicyのエピソードページと音声配信を模したHTTPサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeVoicyHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes_sent": 0, "status": {}}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def episode_urls(self, channel_id="9999"):
+        return [f"{self.base_url}/channel/{channel_id}/{episode_id}" for episode_id in self.config.episode_ids()]
+
+    def record(self, status, sent):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_sent"] += sent
+            self.stats["status"][status] = self.stats["status"].get(status, 0) + 1
+
+    def roll(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+@lru_cache(maxsize=256)
+def _cached_ts_segment(index, segment_sec):
+    return ts_segment(index, segment_sec)
+
+@lru_cache(maxsize=16)
+def _cached_mp3(n_frames):
+    return mp3_frames(n_frames)
+
+class FakeVoicyHandler(BaseHTTPRequestHandler):
+    """ルーティングと障害注入"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+
+        path = self.path.split("?", 1)[0]
+        match = re.fullmatch(r"/channel/(\d+)/(\d+)", path)
+        if match:
+            return self._page(match.group(2))
+        match = re.fullmatch(r"/channel/(\d+)/all", path)
+        if match:
+            return self._listing(match.group(1))
+
+        match = re.fullmatch(r"/audio/(\d+)/(master\.m3u8|media\.m3u8|episode\.mp3|seg_(\d+)\.ts)", path)
+        if not match or match.group(1) not in config.episode_ids():
+            return self._send(404, b"not found", "text/plain")
+
+        # 音声・プレイリストにだけ障害を注入する
+        if config.throttle_rate and self.server.roll(config.throttle_rate):
+            return self._send(429, b"too many requests", "text/plain",
+                              {"Retry-After": str(config.retry_after)})
+        if config.error_rate and self.server.roll(config.error_rate):
+            return self._send(500, b"internal error", "text/plain")
+        # 音声にだけ、中身がHTMLのエラーページを 200 で返す
+        if (config.soft_error_rate and not match.group(2).endswith(".m3u8")
+                and self.server.roll(config.soft_error_rate)):
+            return self._send(200, b"<!DOCTYPE html><html><body>Service Unavailable</body></html>",
+                              "text/html; charset=utf-8")
+
+        episode_id, name, index = match.groups()
+        if name == "master.m3u8":
+            body = ("#EXTM3U\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=128000,CODECS=\"mp3\"\n"
+                    "media.m3u8\n")
+            return self._send(200, body.encode(), "application/vnd.apple.mpegurl")
+        if name == "media.m3u8":
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3",
+                     f"#EXT-X-TARGETDURATION:{int(-(-config.segment_sec // 1))}", "#EXT-X-MEDIA-SEQUENCE:0"]
+            actual_sec = frames_for_duration(config.segment_sec) * MP3_FRAME_SAMPLES / MP3_SAMPLE_RATE
+            for i in range(config.segments):
+                lines += [f"#EXTINF:{actual_sec:.3f},", f"seg_{i}.ts"]
+            lines.append("#EXT-X-ENDLIST")
+            return self._send(200, ("\n".join(lines) + "\n").encode(), "application/vnd.apple.mpegurl")
+        if name == "episode.mp3":
+            body = _cached_mp3(frames_for_duration(config.segment_sec) * config.segments)
+            return self._send(200, body, "audio/mpeg")
+
+        if int(index) >= config.segments:
+            return self._send(404, b"not found", "text/plain")
+        return self._send(200, _cached_ts_segment(int(index), config.segment_sec), "video/mp2t")
+
+    def _listing(self, channel_id):
+        """チャンネルのエピソード一覧（新しい順のリンク）"""
+        links = "\n".join(f'<a href="/channel/{channel_id}/{episode_id}">テスト放送 #{int(episode_id) - 100000}</a>'
+                          for episode_id in reversed(self.server.config.episode_ids()))
+        body = f"""<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"><title>テストチャンネル | Voicy</title></head>
+<body>
+{links}
+</body>
+</html>
+"""
+        return self._send(200, body.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _page(self, episode_id):
+        """get_episode_info のセレクタ（h1.title, p.date, .premium, audio）に合わせたページ"""
+        config = self.server.config
+        if episode_id not in config.episode_ids():
+            return self._send(404, b"not found", "text/plain")
+        number = int(episode_id) - 100000
+        audio_base = f"{self.server.base_url}/audio/{episode_id}"
+        if config.mode == "mp3":
+            audio_src = f"{audio_base}/episode.mp3"
+        else:
+            audio_src = f"{audio_base}/{'master' if config.master else 'media'}.m3u8"
+        premium = '<div class="premium">プレミアム放送</div>' if config.premium_every and number % config.premium_every == 0 else ""
+        day = (number - 1) % 28 + 1
+        body = f"""<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"><title>テスト放送 #{number} | Voicy</title>
+<meta name="description" content="ベンチマーク用のテスト放送 #{number} の説明文です"></head>
+<body>
+<h1 class="title">テスト放送 #{number}</h1>
+<p class="date">2024年7月{day}日</p>
+{premium}
+<audio src="{audio_src}" preload="none"></audio>
+</body>
+</html>
+"""
+        return self._send(200, body.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _send(self, status, body, content_type, headers=None):
+        # ページとプレイリストには ETag / Last-Modified を付け、条件付きリクエストに 304 で応える
+        if status == 200 and not content_type.startswith(("audio/", "video/")):
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            headers = dict(headers or {}, ETag=etag, **{"Last-Modified": LAST_MODIFIED})
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        bandwidth = self.server.config.bandwidth
+        sent = 0
+        try:
+            if bandwidth:
+                chunk_size = max(1024, bandwidth // 20)
+                view = memoryview(body)
+                while sent < len(body):
+                    chunk = view[sent:sent + chunk_size]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    time.sleep(len(chunk) / bandwidth)
+            else:
+                self.wfile.write(body)
+                sent = len(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.server.record(status, sent)
+
+def start_server(config, host="127.0.0.1", port=0):
+    """バックグラウンドスレッドでサーバーを起動する（port=0 なら空いているポート）"""
+    server = FakeVoicyServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name="fake-voicy", daemon=True)
+    thread.start()
+    return server, thread
+
+def add_server_args(parser):
+    """サーバー設定のコマンドライン引数を追加する（ベンチマークと共用）"""
+    parser.add_argument('--episodes', type=int, default=10, help='エピソード数')
+    parser.add_argument('--segments', type=int, default=6, help='1エピソードあたりのセグメント数')
+    parser.add_argument('--segment_sec', type=float, default=10.0, help='セグメントの長さ（秒）')
+    parser.add_argument('--mode', choices=['m3u8', 'mp3'], default='m3u8', help='音声の配信形式')
+    parser.add_argument('--no_master', action='store_true', help='マスタープレイリストを挟まない')
+    parser.add_argument('--latency', type=float, default=0.0, help='応答前の待ち時間（秒）')
+    parser.add_argument('--bandwidth', type=int, default=0, help='1接続あたりの帯域上限（バイト/秒）')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='500 を返す確率')
+    parser.add_argument('--throttle_rate', type=float, default=0.0, help='429 を返す確率')
+    parser.add_argument('--retry_after', type=int, default=1, help='429 の Retry-After（秒）')
+    parser.add_argument('--premium_every', type=int, default=0, help='n件ごとに有料放送にする')
+    parser.add_argument('--soft_error_rate', type=float, default=0.0,
+                        help='音声の代わりにHTMLのエラーページを 200 で返す確率')
+    parser.add_argument('--seed', type=int, default=0, help='障害注入の乱数シード')
+
+def config_from_args(args):
+    """コマンドライン引数から設定を作る"""
+    return FakeVoicyConfig(
+        episodes=args.episodes, segments=args.segments, segment_sec=args.segment_sec, mode=args.mode,
+        master=not args.no_master, latency=args.latency, bandwidth=args.bandwidth,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        premium_every=args.premium_every, soft_error_rate=args.soft_error_rate, seed=args.seed,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の疑似Voicyサーバーを起動します')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='待ち受けるホスト')
+    parser.add_argument('--port', type=int, default=8765, help='待ち受けるポート')
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    server = FakeVoicyServer((args.host, args.port), config_from_args(args))
+    print(f"疑似Voicyサーバーを起動しました: {server.base_url}")
+    for url in server.episode_urls()[:3]:
+        print(f"  {url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"リクエスト数: {server.stats['requests']}, 送信量: {server.stats['bytes_sent']}バイト")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from instrumentation import import_span
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+INITIAL_CONCURRENCY = 2  # ホストごとの初期同時接続数
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 5  # 1リクエストあたりの最大リトライ回数
+BASE_DELAY = 1.0  # 指数バックオフの基準待ち時間（秒）
+MAX_DELAY = 60.0  # バックオフの上限（秒）
+TIMEOUT = 30  # リクエストのタイムアウト（秒）
+
+THROTTLE_STATUSES = (429, 503)  # 混雑を示すステータス（同時接続数を半分にする）
+RETRY_STATUSES = (408, 500, 502, 504)  # 一時的なエラー（再試行する）
+
+def _requests():
+    """requests を必要になった時点で読み込む（作業がない実行の起動を軽くするため）"""
+    with import_span("requests"):
+        import requests
+        import requests.adapters
+    return requests
+
+class FetchError(Exception):
+    """リトライしても取得できなかった"""
+
+    def __init__(self, url, reason, status_code=None):
+        super().__init__(f"{reason}: {url}")
+        self.url = url
+        self.reason = reason
+        self.status_code = status_code
+
+def parse_retry_after(value):
+    """Retry-After ヘッダー（秒数または HTTP-date）を待ち秒数にする"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class HostState:
+    """ホストごとの同時接続数の上限・待機状態・統計"""
+
+    def __init__(self, initial, min_limit, max_limit):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.backoff_until = 0.0
+        self.cond = threading.Condition()
+        self.stats = {
+            "requests": 0, "ok": 0, "throttled": 0, "errors": 0, "retries": 0,
+            "bytes": 0, "elapsed_sec": 0.0, "waited_sec": 0.0,
+        }
+
+    def acquire(self):
+        """空きが出て、バックオフ期間が明けるまで待つ"""
+        start = time.monotonic()
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.backoff_until:
+                    self.cond.wait(self.backoff_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self.cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.stats["waited_sec"] += time.monotonic() - start
+
+    def count(self, key, amount=1):
+        """統計を加算する（上限と同じロックの下で、複数のダウンロードスレッドから呼ばれる）"""
+        with self.cond:
+            self.stats[key] += amount
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        """加算的に上限を上げる（上限 n のとき n 回成功でおよそ +1）"""
+        with self.cond:
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            self.cond.notify_all()
+
+    def on_throttle(self, delay):
+        """乗算的に上限を下げ、ホスト全体を delay 秒止める"""
+        with self.cond:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.backoff_until = max(self.backoff_until, time.monotonic() + delay)
+
+    def on_error(self, delay):
+        """エラー時は緩やかに上限を下げ、ホスト全体を delay 秒止める"""
+        with self.cond:
+            self.limit = max(self.min_limit, self.limit * 0.75)
+            self.backoff_until = max(self.backoff_until, time.monotonic() + delay)
+
+class FetchController:
+    """ホストごとに同時接続数を調整しながらHTTP取得するコントローラ
+
+    正常に応答している間は同時接続数を少しずつ増やし、429/503 やエラーでは
+    半減させてジッター付き指数バックオフで待つ。Retry-After があればそれに従う。
+    """
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, min_limit=MIN_CONCURRENCY, max_limit=MAX_CONCURRENCY,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY, timeout=TIMEOUT):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.hosts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._random = random.Random()
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState(self.initial, self.min_limit, self.max_limit)
+            return state
+
+    def _session(self):
+        """スレッドごとのセッション（接続を使い回す）"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            requests = _requests()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=self.max_limit)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            self._local.session = session
+        return session
+
+    def _backoff(self, attempt, retry_after=None):
+        """Retry-After があればそれを、なければフルジッターの指数バックオフを返す"""
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def request(self, url, headers=None, stream=False, consume=None, timeout=None):
+        """GETを送り、成功した応答（consume を渡せばその戻り値）を返す
+
+        consume(response) はスロットを確保したまま呼ばれるため、ストリーミングで
+        本文を読む処理もホストの同時接続数に数えられる。本文の途中で接続が切れた
+        場合も再試行の対象になる。4xx（429/408以外）はそのまま返す。
+        """
+        requests = _requests()
+        state = self._host(url)
+        last_reason = None
+        last_status = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                state.count("retries")
+            state.acquire()
+            start = time.monotonic()
+            delay = None
+            try:
+                state.count("requests")
+                response = self._session().get(url, headers=headers, stream=stream or consume is not None,
+                                               timeout=timeout or self.timeout)
+                status = response.status_code
+                if status in THROTTLE_STATUSES:
+                    state.count("throttled")
+                    delay = self._backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                    state.on_throttle(delay)
+                    last_reason, last_status = f"ステータスコード {status}", status
+                    response.close()
+                    print(f"混雑を検知しました: {url} (ステータスコード {status}, {delay:.1f}秒待機, 同時接続数 {state.limit:.1f})")
+                    continue
+                if status in RETRY_STATUSES:
+                    state.count("errors")
+                    delay = self._backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                    state.on_error(delay)
+                    last_reason, last_status = f"ステータスコード {status}", status
+                    response.close()
+                    print(f"一時的なエラー: {url} (ステータスコード {status}, {delay:.1f}秒待機)")
+                    continue
+
+                result = consume(response) if consume is not None and status < 400 else response
+                if status < 400:
+                    state.count("ok")
+                    state.on_success()
+                    if not stream and consume is None:
+                        state.count("bytes", len(response.content))
+                return result
+            except requests.RequestException as e:
+                state.count("errors")
+                delay = self._backoff(attempt)
+                state.on_error(delay)
+                last_reason, last_status = f"{type(e).__name__}: {e}", None
+                print(f"リクエスト中のエラー: {url} ({type(e).__name__}, {delay:.1f}秒待機)")
+            finally:
+                state.count("elapsed_sec", time.monotonic() - start)
+                state.release()
+        raise FetchError(url, last_reason or "取得失敗", last_status)
+
+    def get(self, url, headers=None, timeout=None):
+        """本文を読み込んだ応答を返す"""
+        return self.request(url, headers=headers, timeout=timeout)
+
+    def download(self, url, path, headers=None, chunk_size=64 * 1024):
+        """ファイルにストリーミングで保存し、バイト数を返す（空の本文はエラーとして再試行）"""
+        requests = _requests()
+        state = self._host(url)
+
+        def consume(response):
+            written = 0
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+            if written == 0:
+                raise requests.exceptions.ContentDecodingError("本文が空です")
+            state.count("bytes", written)
+            return written
+
+        response = self.request(url, headers=headers, consume=consume)
+        if isinstance(response, requests.Response):
+            # consume が呼ばれなかった = 4xx
+            response.close()
+            if os.path.exists(path):
+                os.remove(path)
+            raise FetchError(url, f"ステータスコード {response.status_code}", response.status_code)
+        return response
+
+    def format_stats(self):
+        """ホストごとの統計を表にする"""
+        lines = [f"{'ホスト':<40}{'要求':>6}{'成功':>6}{'429/503':>9}{'エラー':>6}{'再試行':>7}{'MB':>9}{'接続MB/秒':>10}{'上限':>6}{'最大並列':>8}"]
+        for host, state in sorted(self.hosts.items()):
+            st = state.stats
+            mb = st["bytes"] / (1024 * 1024)
+            mbps = mb / st["elapsed_sec"] if st["elapsed_sec"] > 0 else 0.0
+            lines.append(f"{host[:40]:<40}{st['requests']:>6}{st['ok']:>6}{st['throttled']:>9}{st['errors']:>6}"
+                         f"{st['retries']:>7}{mb:>9.2f}{mbps:>10.2f}{state.limit:>6.1f}{state.peak_in_flight:>8}")
+        return "\n".join(lines)
+
+    def print_stats(self):
+        if self.hosts:
+            print("ホスト別の取得統計")
+            print(self.format_stats())
+
+# プロセス全体で共有するコントローラ
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_controller():
+    """共有のコントローラを返す（初回に作成）"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = FetchController()
+        return _controller
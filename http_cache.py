@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import glob
+import hashlib
+import threading
+
+from fetch_controller import get_controller
+
+CACHE_DIR = "http_cache"  # キャッシュの保存先ディレクトリ
+MAX_CACHE_BYTES = 200 * 1024 * 1024  # キャッシュ全体の上限サイズ
+MAX_CACHE_AGE = 14 * 24 * 3600  # 最後に使ってからこの秒数を過ぎたエントリは削除
+
+class CachedResponse:
+    """キャッシュから返す応答（downloader が使う requests.Response の属性だけを持つ）"""
+
+    def __init__(self, status_code, content, headers, from_cache):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache  # "hit"（ローカル）/ "revalidated"（304）/ None（取得）
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+class HttpCache:
+    """ETag / Last-Modified を保存し、条件付きリクエストで再検証するディスクキャッシュ
+
+    エントリは {key}.json（メタデータ）と {key}.body（本文）の組で保存する。
+    サイズと最終利用時刻による削除は evict() でまとめて行う。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, max_age=MAX_CACHE_AGE, controller=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.controller = controller
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stored": 0, "evicted": 0,
+                      "bytes_from_cache": 0, "bytes_fetched": 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".body"
+
+    def _load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("url") != url or not os.path.exists(body_path):
+                return None, None
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def _store(self, url, meta, body=None):
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            tmp_path = body_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, body_path)
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def get(self, url, headers=None, fresh_for=0):
+        """URLを取得する。fresh_for 秒以内に保存・再検証したものは通信せずに返す"""
+        controller = self.controller or get_controller()
+        meta, body = self._load(url)
+        now = time.time()
+
+        if meta is not None and now - meta["validated_at"] < fresh_for:
+            meta["last_access"] = now
+            self._store(url, meta)
+            self._count("hits")
+            self._count("bytes_from_cache", len(body))
+            return CachedResponse(meta["status"], body, meta.get("headers", {}), "hit")
+
+        request_headers = dict(headers or {})
+        if meta is not None:
+            if meta.get("etag"):
+                request_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = controller.get(url, headers=request_headers)
+
+        if response.status_code == 304 and meta is not None:
+            meta["validated_at"] = meta["last_access"] = now
+            self._store(url, meta)
+            self._count("revalidated")
+            self._count("bytes_from_cache", len(body))
+            return CachedResponse(meta["status"], body, meta.get("headers", {}), "revalidated")
+
+        self._count("misses")
+        self._count("bytes_fetched", len(response.content))
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified or fresh_for):
+            self._store(url, {
+                "url": url,
+                "status": response.status_code,
+                "etag": etag,
+                "last_modified": last_modified,
+                "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+                "size": len(response.content),
+                "validated_at": now,
+                "last_access": now,
+            }, response.content)
+            self._count("stored")
+        return CachedResponse(response.status_code, response.content, dict(response.headers), None)
+
+    def evict(self):
+        """古いエントリと、上限サイズを超えた分を最終利用時刻の古い順に削除する"""
+        entries = []
+        for meta_path in glob.glob(os.path.join(self.cache_dir, "*.json")):
+            body_path = meta_path[:-len(".json")] + ".body"
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                size = os.path.getsize(body_path)
+            except (OSError, ValueError):
+                # 片方だけ残った壊れたエントリは削除する
+                for path in (meta_path, body_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                continue
+            entries.append((meta.get("last_access", 0), size, meta_path, body_path))
+
+        now = time.time()
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        evicted = 0
+        for last_access, size, meta_path, body_path in entries:
+            if now - last_access <= self.max_age and total <= self.max_bytes:
+                continue
+            for path in (meta_path, body_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+            evicted += 1
+        self._count("evicted", evicted)
+        return evicted, total
+
+    def format_report(self):
+        """ヒット・ミスの集計を1行にする"""
+        st = self.stats
+        requests = st["hits"] + st["revalidated"] + st["misses"]
+        hit_rate = 100 * (st["hits"] + st["revalidated"]) / requests if requests else 0.0
+        return (f"HTTPキャッシュ: {requests}件 (ローカルヒット {st['hits']}, 304 {st['revalidated']}, "
+                f"ミス {st['misses']}, ヒット率 {hit_rate:.1f}%), 保存 {st['stored']}件, 削除 {st['evicted']}件, "
+                f"キャッシュから {st['bytes_from_cache'] / 1024:.1f}KB / 取得 {st['bytes_fetched'] / 1024:.1f}KB")
+
+# プロセス全体で共有するキャッシュ
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_http_cache(create=True):
+    """共有のキャッシュを返す（初回に作成。create=False なら未作成のときNone）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None and create:
+            _cache = HttpCache(CACHE_DIR)
+        return _cache
+
+def set_http_cache(cache):
+    """共有のキャッシュを差し替える（ベンチマークなどで保存先を変えるとき）"""
+    global _cache
+    with _cache_lock:
+        _cache = cache
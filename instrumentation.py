@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+METRICS_DIR = "metrics"  # 計測結果の出力先ディレクトリ
+METRIC_PREFIX = "voicy"  # Prometheusのメトリクス名の接頭辞
+
+# 起動時間の基準（エントリーポイントが最初に読み込む自前モジュールなので、ほぼプロセスの起動時刻になる）
+LOADED_AT = time.perf_counter()
+LOADED_AT_WALL = time.time()
+
+class Recorder:
+    """処理段階ごとの所要時間・転送量を記録し、JSONL / Prometheus / 集計表として出力する"""
+
+    def __init__(self, job, metrics_dir=METRICS_DIR):
+        self.job = job
+        self.metrics_dir = metrics_dir
+        self.run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._stacks = {}  # スレッドID -> 実行中の段階名（別スレッドのプロファイラからも参照する）
+
+    def active_stages(self, thread_id=None):
+        """指定スレッド（省略時は現在のスレッド）で実行中の段階名を外側から順に返す"""
+        return list(self._stacks.get(thread_id or threading.get_ident(), ()))
+
+    def active_threads(self):
+        """実行中の段階があるスレッドのIDを返す"""
+        return [thread_id for thread_id, stack in list(self._stacks.items()) if stack]
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """段階の計測。yield した辞書に bytes や audio_sec などを追記できる"""
+        stack = self._stacks.setdefault(threading.get_ident(), [])
+        stack.append(stage)
+        record = dict(attrs)
+        start_wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record.setdefault("status", "error")
+            record.setdefault("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self.add(stage, start_wall, elapsed, stack[-1] if stack else None, record)
+
+    def add(self, stage, start_wall, elapsed, parent=None, record=None):
+        """計測済みの段階を1件追加する（span を使えない区間の記録用）"""
+        record = record if record is not None else {}
+        record.setdefault("status", "ok")
+        record.update({
+            "run_id": self.run_id,
+            "job": self.job,
+            "stage": stage,
+            "parent": parent,
+            "start": round(start_wall, 3),
+            "duration_sec": round(elapsed, 6),
+        })
+        if record.get("bytes") and elapsed > 0:
+            record["bytes_per_sec"] = round(record["bytes"] / elapsed, 1)
+        if record.get("audio_sec"):
+            record["real_time_factor"] = round(elapsed / record["audio_sec"], 4)
+        with self._lock:
+            self.spans.append(record)
+        return record
+
+    def summarize(self):
+        """段階ごとに件数・時間・転送量を集計する"""
+        summary = {}
+        for record in self.spans:
+            row = summary.setdefault(record["stage"], {
+                "count": 0, "errors": 0, "total_sec": 0.0, "max_sec": 0.0, "bytes": 0, "audio_sec": 0.0,
+            })
+            row["count"] += 1
+            row["errors"] += record["status"] != "ok"
+            row["total_sec"] += record["duration_sec"]
+            row["max_sec"] = max(row["max_sec"], record["duration_sec"])
+            row["bytes"] += record.get("bytes") or 0
+            row["audio_sec"] += record.get("audio_sec") or 0.0
+        return summary
+
+    def write_jsonl(self, path=None):
+        """計測結果をJSONLに追記する"""
+        path = path or os.path.join(self.metrics_dir, f"{self.job}_spans.jsonl")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in self.spans:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return path
+
+    def write_prometheus(self, path=None):
+        """node_exporter の textfile collector 形式で書き出す"""
+        path = path or os.path.join(self.metrics_dir, f"{self.job}.prom")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        summary = self.summarize()
+        p = METRIC_PREFIX
+        lines = [
+            f"# HELP {p}_stage_duration_seconds 段階ごとの所要時間",
+            f"# TYPE {p}_stage_duration_seconds summary",
+        ]
+        for stage, row in summary.items():
+            labels = f'job="{self.job}",stage="{stage}"'
+            lines.append(f"{p}_stage_duration_seconds_sum{{{labels}}} {row['total_sec']:.6f}")
+            lines.append(f"{p}_stage_duration_seconds_count{{{labels}}} {row['count']}")
+        lines += [f"# HELP {p}_stage_max_duration_seconds 段階ごとの最大所要時間",
+                  f"# TYPE {p}_stage_max_duration_seconds gauge"]
+        for stage, row in summary.items():
+            lines.append(f'{p}_stage_max_duration_seconds{{job="{self.job}",stage="{stage}"}} {row["max_sec"]:.6f}')
+        lines += [f"# HELP {p}_stage_errors_total 段階ごとのエラー件数",
+                  f"# TYPE {p}_stage_errors_total counter"]
+        for stage, row in summary.items():
+            lines.append(f'{p}_stage_errors_total{{job="{self.job}",stage="{stage}"}} {row["errors"]}')
+        lines += [f"# HELP {p}_stage_bytes_total 段階ごとの転送バイト数",
+                  f"# TYPE {p}_stage_bytes_total counter"]
+        for stage, row in summary.items():
+            if row["bytes"]:
+                lines.append(f'{p}_stage_bytes_total{{job="{self.job}",stage="{stage}"}} {row["bytes"]}')
+        lines += [f"# HELP {p}_stage_audio_seconds_total 段階ごとに処理した音声の長さ",
+                  f"# TYPE {p}_stage_audio_seconds_total counter"]
+        for stage, row in summary.items():
+            if row["audio_sec"]:
+                lines.append(f'{p}_stage_audio_seconds_total{{job="{self.job}",stage="{stage}"}} {row["audio_sec"]:.3f}')
+        lines += [f"# HELP {p}_run_duration_seconds 実行全体の所要時間",
+                  f"# TYPE {p}_run_duration_seconds gauge",
+                  f'{p}_run_duration_seconds{{job="{self.job}"}} {time.time() - self.started_at:.3f}',
+                  f"# HELP {p}_run_timestamp_seconds 最後に実行した時刻",
+                  f"# TYPE {p}_run_timestamp_seconds gauge",
+                  f'{p}_run_timestamp_seconds{{job="{self.job}"}} {time.time():.0f}']
+
+        # 収集中に中途半端なファイルを読まれないよう一時ファイル経由で置き換える
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        return path
+
+    def format_summary(self):
+        """実行の最後に表示する集計表を作る"""
+        summary = self.summarize()
+        run_sec = time.time() - self.started_at
+        header = f"{'段階':<22}{'件数':>6}{'エラー':>6}{'合計(秒)':>11}{'平均(秒)':>11}{'最大(秒)':>11}{'転送量(MB)':>12}{'MB/秒':>9}{'RTF':>8}{'割合':>8}"
+        lines = [f"計測結果 ({self.job}, run_id={self.run_id}, 全体 {run_sec:.2f}秒)", header, "-" * len(header)]
+        for stage, row in sorted(summary.items(), key=lambda item: -item[1]["total_sec"]):
+            mb = row["bytes"] / (1024 * 1024)
+            mbps = f"{mb / row['total_sec']:.2f}" if row["bytes"] and row["total_sec"] > 0 else "-"
+            rtf = f"{row['total_sec'] / row['audio_sec']:.3f}" if row["audio_sec"] else "-"
+            share = f"{100 * row['total_sec'] / run_sec:.1f}%" if run_sec > 0 else "-"
+            lines.append(f"{stage:<22}{row['count']:>6}{row['errors']:>6}{row['total_sec']:>11.2f}"
+                         f"{row['total_sec'] / row['count']:>11.3f}{row['max_sec']:>11.2f}"
+                         f"{(f'{mb:.2f}' if row['bytes'] else '-'):>12}{mbps:>9}{rtf:>8}{share:>8}")
+        return "\n".join(lines)
+
+    def finish(self):
+        """JSONLとPrometheusのファイルを書き出し、集計表を表示する"""
+        try:
+            jsonl_path = self.write_jsonl()
+            prom_path = self.write_prometheus()
+            print(self.format_summary())
+            print(f"計測結果を保存しました: {jsonl_path}, {prom_path}")
+        except Exception as e:
+            print(f"計測結果の保存エラー: {e}")
+
+# プロセス全体で共有する記録器
+_recorder = Recorder("default")
+
+def init(job, metrics_dir=METRICS_DIR):
+    """ジョブ名を指定して記録器を作り直す"""
+    global _recorder
+    _recorder = Recorder(job, metrics_dir)
+    return _recorder
+
+def get_recorder():
+    """現在の記録器を返す"""
+    return _recorder
+
+def span(stage, **attrs):
+    """現在の記録器で段階を計測する"""
+    return _recorder.span(stage, **attrs)
+
+def import_span(module):
+    """重いモジュールの初回の読み込みを import 段階として計測する（読み込み済みなら何もしない）"""
+    if module in sys.modules:
+        return nullcontext({})
+    return _recorder.span("import", module=module)
+
+def mark_startup(**attrs):
+    """起動から処理対象の判定までの時間を startup 段階として記録し、秒数を返す"""
+    elapsed = time.perf_counter() - LOADED_AT
+    # 実行全体の時間にも起動時間を含める
+    _recorder.started_at = min(_recorder.started_at, LOADED_AT_WALL)
+    _recorder.add("startup", LOADED_AT_WALL, elapsed, record=dict(attrs))
+    return elapsed
+
+def finish():
+    """現在の記録器の結果を出力する"""
+    _recorder.finish()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+from array import array
+
+# ビットレート表（kbps）: (MPEGバージョン1か, レイヤー) → インデックス1〜14
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# サンプリング周波数: バージョンのビット値 → インデックス0〜2（1は予約）
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+XING_FLAGS = 0x0007  # フレーム数 + バイト数 + TOC
+XING_SIZE = 4 + 4 + 4 + 4 + 100  # タグ + フラグ + フレーム数 + バイト数 + TOC
+
+class Mp3FormatError(Exception):
+    """フレーム単位で扱えないMP3（フリーフォーマット・形式の混在など）"""
+
+class FrameHeader:
+    """MPEGオーディオのフレームヘッダー（4バイト）"""
+
+    __slots__ = ("raw", "version_bits", "layer", "protected", "bitrate_index", "bitrate",
+                 "sample_rate_index", "sample_rate", "padding", "channel_mode", "length", "samples")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.version_bits = (raw >> 19) & 3
+        self.layer = 4 - ((raw >> 17) & 3)
+        self.protected = not (raw >> 16) & 1
+        self.bitrate_index = (raw >> 12) & 15
+        self.sample_rate_index = (raw >> 10) & 3
+        self.padding = (raw >> 9) & 1
+        self.channel_mode = (raw >> 6) & 3
+        mpeg1 = self.version_bits == 3
+        self.bitrate = BITRATES[(mpeg1, self.layer)][self.bitrate_index] * 1000
+        self.sample_rate = SAMPLE_RATES[self.version_bits][self.sample_rate_index]
+        if self.layer == 1:
+            self.samples = 384
+            self.length = (12 * self.bitrate // self.sample_rate + self.padding) * 4
+        else:
+            self.samples = 1152 if mpeg1 or self.layer == 2 else 576
+            self.length = self.samples // 8 * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def mono(self):
+        return self.channel_mode == 3
+
+    @property
+    def side_info_size(self):
+        """レイヤーIIIのサイド情報の大きさ（Xing/Info タグはこの直後に置かれる）"""
+        if self.version_bits == 3:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+    def format_key(self):
+        """結合できるかの判定に使う（バージョン・レイヤー・周波数・モノラルか）"""
+        return (self.version_bits, self.layer, self.sample_rate, self.mono)
+
+# 同じヘッダーは何度も現れるので解析結果を使い回す
+_header_cache = {}
+
+def parse_header(raw):
+    """4バイトの整数をフレームヘッダーとして解析する（フレームでなければNone）"""
+    header = _header_cache.get(raw)
+    if header is not None:
+        return header
+    if (raw >> 21) != 0x7FF:
+        return None
+    version_bits = (raw >> 19) & 3
+    layer_bits = (raw >> 17) & 3
+    bitrate_index = (raw >> 12) & 15
+    sample_rate_index = (raw >> 10) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index == 15 or sample_rate_index == 3:
+        return None
+    if bitrate_index == 0:
+        raise Mp3FormatError("フリーフォーマットのMP3には対応していません")
+    header = FrameHeader(raw)
+    if len(_header_cache) < 4096:
+        _header_cache[raw] = header
+    return header
+
+def _id3v2_size(view, offset):
+    """offset に ID3v2 タグがあればその大きさ（フッター込み）を返す"""
+    if len(view) - offset < 10 or bytes(view[offset:offset + 3]) != b"ID3":
+        return 0
+    flags = view[offset + 5]
+    size = 0
+    for byte in view[offset + 6:offset + 10]:
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size + (10 if flags & 0x10 else 0)
+
+def audio_range(view):
+    """先頭の ID3v2 と末尾の ID3v1 / APEv2 を除いた範囲 (start, end) を返す"""
+    start = 0
+    while True:
+        size = _id3v2_size(view, start)
+        if not size:
+            break
+        start += size
+    end = len(view)
+    if end - start >= 128 and bytes(view[end - 128:end - 125]) == b"TAG":
+        end -= 128
+    if end - start >= 32 and bytes(view[end - 32:end - 24]) == b"APETAGEX":
+        tag_size, flags = struct.unpack_from("<I4xI", view, end - 20)
+        end -= tag_size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+def info_tag(view, offset, header):
+    """フレームが Xing / Info / VBRI ヘッダーならその種類を返す"""
+    if header.layer != 3:
+        return None
+    pos = offset + 4 + (2 if header.protected else 0) + header.side_info_size
+    tag = bytes(view[pos:pos + 4])
+    if tag in (b"Xing", b"Info"):
+        return tag.decode("ascii")
+    if bytes(view[offset + 36:offset + 40]) == b"VBRI":
+        return "VBRI"
+    return None
+
+def _read_raw(view, offset):
+    return (view[offset] << 24) | (view[offset + 1] << 16) | (view[offset + 2] << 8) | view[offset + 3]
+
+def scan_frames(view, start=None, end=None):
+    """音声フレームを (offset, header) で順に返す
+
+    同期が外れた箇所（途中に挟まった ID3 タグやゴミ）は、次のフレームが続く位置まで読み飛ばす。
+    """
+    if start is None:
+        start, end = audio_range(view)
+    pos = start
+    while pos + 4 <= end:
+        header = parse_header(_read_raw(view, pos)) if view[pos] == 0xFF else None
+        if header is not None and pos + header.length <= end:
+            yield pos, header
+            pos += header.length
+            continue
+        # 再同期: 次の 0xFF から、その後ろにもフレームが続く位置を探す
+        tag_size = _id3v2_size(view, pos)
+        pos = pos + tag_size if tag_size else _resync(view, pos + 1, end)
+
+def _resync(view, pos, end):
+    while pos + 4 <= end:
+        if view[pos] == 0xFF:
+            header = parse_header(_read_raw(view, pos))
+            if header is not None:
+                next_pos = pos + header.length
+                if next_pos == end or (next_pos + 4 <= end and view[next_pos] == 0xFF
+                                       and parse_header(_read_raw(view, next_pos)) is not None):
+                    return pos
+        pos += 1
+    return end
+
+def build_info_frame(template, n_frames, n_bytes, toc, vbr):
+    """結合後のフレーム数・バイト数・TOC を持つ Xing（VBR）/ Info（CBR）フレームを作る
+
+    ヘッダーは音声の最初のフレームに合わせ、タグが入る大きさのビットレートを選ぶ。
+    サイド情報はすべて0なので、デコーダーには無音の1フレームとして扱われる。
+    """
+    bitrates = BITRATES[(template.version_bits == 3, 3)]
+    needed = 4 + template.side_info_size + XING_SIZE
+    for index in [template.bitrate_index] + list(range(1, 15)):
+        raw = (template.raw & 0xFFFE0DFF) | 0x00010000 | (index << 12)  # CRCなし・パディングなし
+        header = FrameHeader(raw)
+        if header.length >= needed:
+            break
+    else:
+        raise Mp3FormatError(f"Xingヘッダーを入れられません（{bitrates}）")
+    frame = bytearray(header.length)
+    struct.pack_into(">I", frame, 0, raw)
+    pos = 4 + header.side_info_size
+    frame[pos:pos + 4] = b"Xing" if vbr else b"Info"
+    struct.pack_into(">III", frame, pos + 4, XING_FLAGS, n_frames, n_bytes)
+    frame[pos + 16:pos + 116] = bytes(toc)
+    return bytes(frame)
+
+def _toc(frame_sizes, first_offset, total_bytes):
+    """再生位置 0〜99% に対応するファイル内の位置（全体を256とした値）"""
+    toc = []
+    n_frames = len(frame_sizes)
+    offset = first_offset
+    index = 0
+    for percent in range(100):
+        target = percent * n_frames // 100
+        while index < target:
+            offset += frame_sizes[index]
+            index += 1
+        toc.append(min(255, offset * 256 // total_bytes))
+    return toc
+
+def concat_mp3(input_paths, output_path):
+    """MP3ファイルをフレーム単位で結合する（サブプロセスを使わない）
+
+    各ファイルの ID3 / APE タグと Xing / Info / VBRI フレームを除き、音声フレームだけを
+    mmap からそのまま書き出す。先頭には結合後のフレーム数・長さを持つ Info（VBRなら Xing）
+    フレームを置く。形式の異なるファイルが混ざっていれば Mp3FormatError を送出する。
+    """
+    frame_sizes = array("I")
+    bitrates = set()
+    stats = {"inputs": len(input_paths), "frames": 0, "skipped_headers": 0, "skipped_bytes": 0,
+             "duration_sec": 0.0, "bytes": 0}
+    format_key = None
+    template = None
+    tmp_path = output_path + ".tmp"
+
+    try:
+        with open(tmp_path, "wb") as out:
+            # Info フレームの場所を空けておき、最後に書き戻す
+            placeholder = None
+            for path in input_paths:
+                size = os.path.getsize(path)
+                if size == 0:
+                    continue
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        start, end = audio_range(view)
+                        run_start = run_end = None
+                        audio_bytes = 0
+                        for offset, header in scan_frames(view, start, end):
+                            if template is None:
+                                if header.layer != 3:
+                                    raise Mp3FormatError(f"レイヤー{header.layer}には対応していません: {path}")
+                                template = header
+                                format_key = header.format_key()
+                                placeholder = build_info_frame(header, 0, 0, [0] * 100, False)
+                                out.write(placeholder)
+                            elif header.format_key() != format_key:
+                                raise Mp3FormatError(f"形式の異なるフレームが混ざっています: {path}")
+                            if info_tag(view, offset, header):
+                                stats["skipped_headers"] += 1
+                                continue
+                            # 連続しているフレームはまとめて書き出す
+                            if offset != run_end:
+                                if run_start is not None:
+                                    out.write(view[run_start:run_end])
+                                run_start = offset
+                            run_end = offset + header.length
+                            frame_sizes.append(header.length)
+                            bitrates.add(header.bitrate)
+                            audio_bytes += header.length
+                        if run_start is not None:
+                            out.write(view[run_start:run_end])
+                        stats["skipped_bytes"] += size - audio_bytes
+                    finally:
+                        view.release()
+
+            if template is None:
+                raise Mp3FormatError("MP3フレームが見つかりません")
+
+            n_frames = len(frame_sizes)
+            total_bytes = len(placeholder) + sum(frame_sizes)
+            toc = _toc(frame_sizes, len(placeholder), total_bytes)
+            info_frame = build_info_frame(template, n_frames, total_bytes, toc, len(bitrates) > 1)
+            out.seek(0)
+            out.write(info_frame)
+
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats["frames"] = n_frames
+    stats["bytes"] = total_bytes
+    stats["duration_sec"] = n_frames * template.samples / template.sample_rate
+    stats["vbr"] = len(bitrates) > 1
+    return stats
+
+def probe_mp3(path):
+    """フレームを数えて長さ・形式を調べる（Xing ヘッダーの値も返す）"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            start, end = audio_range(view)
+            info = {"frames": 0, "duration_sec": 0.0, "bitrates": set(), "sample_rate": None,
+                    "info_tag": None, "info_frames": None, "audio_bytes": 0, "size": len(view)}
+            first = True
+            for offset, header in scan_frames(view, start, end):
+                if first:
+                    first = False
+                    info["sample_rate"] = header.sample_rate
+                    tag = info_tag(view, offset, header)
+                    if tag:
+                        info["info_tag"] = tag
+                        if tag != "VBRI":
+                            pos = offset + 4 + (2 if header.protected else 0) + header.side_info_size
+                            flags = struct.unpack_from(">I", view, pos + 4)[0]
+                            if flags & 1:
+                                info["info_frames"] = struct.unpack_from(">I", view, pos + 8)[0]
+                        continue
+                info["frames"] += 1
+                info["duration_sec"] += header.samples / header.sample_rate
+                info["bitrates"].add(header.bitrate)
+                info["audio_bytes"] += header.length
+            info["bitrates"] = sorted(info["bitrates"])
+            return info
+        finally:
+            view.release()
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='MP3ファイルをフレーム単位で結合・検査します')
+    parser.add_argument('inputs', nargs='+', help='入力MP3ファイル')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='結合先のファイル（省略時は各ファイルの情報を表示）')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    if args.output:
+        try:
+            stats = concat_mp3(args.inputs, args.output)
+        except Mp3FormatError as e:
+            print(f"結合できません: {e}")
+            sys.exit(1)
+        print(f"結合しました: {args.output} ({stats['frames']}フレーム, {stats['duration_sec']:.2f}秒, "
+              f"除いたヘッダー {stats['skipped_headers']}個, 除いたバイト {stats['skipped_bytes']})")
+        return
+    for path in args.inputs:
+        info = probe_mp3(path)
+        print(f"{path}: {info['frames']}フレーム, {info['duration_sec']:.2f}秒, {info['sample_rate']}Hz, "
+              f"ビットレート {info['bitrates']}, ヘッダー {info['info_tag']} (フレーム数 {info['info_frames']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import queue
+import argparse
+import logging
+import threading
+from urllib.parse import urljoin
+
+import instrumentation
+import downloader
+from instrumentation import span
+from fetch_controller import FetchError, get_controller
+from http_cache import get_http_cache
+from debug_capture import DebugCapture, set_debug_capture
+from audio_verify import verify_mp3, format_result, load_bad_audio, mark_bad, episode_id_from_path
+from channels import add_urls, update_history, load_state, save_state, schedule_fair, mark_scheduled
+from related_index import INDEX_FILE, RelatedIndex, read_transcript
+from episode_index import EpisodeIndex
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('pipeline')
+
+STAGES = ["discover", "resolve", "download", "decode", "transcribe", "index"]
+WORKERS = {"resolve": 4, "download": 2, "decode": 1, "transcribe": 1, "index": 1}  # 段階ごとの既定のワーカー数
+QUEUE_SIZE = 2  # 段階の間のキューの長さ（いっぱいなら前の段階が待つ。デコード済みの音声を溜め込まない）
+DRY_RUN_RTF = 0.05  # --dry_run で推論の代わりに待つ時間（音声の長さに対する割合）
+SAMPLE_RATE = 16000
+
+_STOP = object()  # ワーカーに終了を知らせる印
+
+def new_episode(channel, url=None, mp3_file=None):
+    """パイプラインを流れる1エピソード（段階ごとの待ち時間・処理時間を記録していく）"""
+    episode_id = url.rstrip("/").split("/")[-1] if url else episode_id_from_path(mp3_file)
+    return {"episode_id": episode_id, "url": url, "channel": channel, "mp3_file": mp3_file,
+            "status": "ok", "error": None, "discovered_at": time.time(), "times": {}}
+
+class Stage:
+    """1つの段階のワーカー群。入力キューから取り出して処理し、次の段階のキューに渡す
+
+    次のキューがいっぱいなら空くまで待つ（その時間は blocked として記録する）。
+    最後のワーカーが終わるとき、次の段階のワーカーの数だけ終了の印を流す。
+    """
+
+    def __init__(self, name, func, workers, inbox, outbox=None, on_finish=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_finish = on_finish
+        self.next_stage = None
+        self.threads = []
+        self._alive = workers
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            times = item["times"].setdefault(self.name, {})
+            times["start"] = time.time()
+            try:
+                with span(f"pipeline_{self.name}", episode_id=item["episode_id"]) as s:
+                    forward = self.func(item)
+                    if not forward:
+                        s["status"] = item["status"]
+            except Exception as e:
+                logger.error(f"{self.name}: {item['episode_id']} - {e}")
+                item.update(status="error", error=f"{self.name}: {e}")
+                forward = False
+            times["end"] = time.time()
+            if forward and self.outbox is not None:
+                self.outbox.put(item)
+                times["blocked"] = time.time() - times["end"]
+            else:
+                self.on_finish(item)
+        with self._lock:
+            self._alive -= 1
+            last = self._alive == 0
+        if last and self.next_stage is not None:
+            for _ in range(self.next_stage.workers):
+                self.outbox.put(_STOP)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+class Pipeline:
+    """発見→ページ解決→ダウンロード→デコード→書き起こし→インデックス登録を1プロセスで流す
+
+    段階の間は長さ queue_size のキューでつなぎ、後ろが詰まれば前が待つ（バックプレッシャー）。
+    新しく公開されたエピソードは、同じ実行の中でダウンロードから書き起こし・インデックス登録まで進む。
+    """
+
+    def __init__(self, args, channels):
+        self.args = args
+        self.channels = channels
+        self.finished = []
+        self.states = {channel["id"]: load_state(channel) for channel in channels}
+        self.scheduled = {}
+        self.succeeded = {}
+        self.scheduled_at = {}
+        self._lock = threading.Lock()
+        self.preprocess_options = None
+        if args.trim_silence or args.tempo != 1.0:
+            self.preprocess_options = {"trim_silence": args.trim_silence, "tempo": args.tempo}
+        self.index = RelatedIndex.load(args.index)
+        self.indexed = 0
+        self.checker = None
+        if args.check_consistency:
+            from consistency_check import ConsistencyChecker
+            self.checker = ConsistencyChecker(check_file=args.check_file, text_dir=args.text_dir,
+                                              segments_dir=args.segments_dir, model_name=args.check_model)
+
+    # --- 段階 ---
+
+    def discover(self):
+        """チャンネルの新着と未ダウンロード・未書き起こしを探し、処理する順に返す"""
+        if self.args.discover_pages:
+            for channel in self.channels:
+                found = discover_channel(channel)
+                if found:
+                    logger.info(f"チャンネル {channel['name']}: 新しいエピソード {len(found)}件")
+
+        bad_audio = load_bad_audio(downloader.BAD_AUDIO_FILE)
+        _, removed, pending = downloader.find_pending(self.channels, bad_audio)
+        for channel in self.channels:
+            if removed.get(channel["id"]):
+                update_history(channel, [], removed[channel["id"]])
+        episodes = [new_episode(channel, url)
+                    for channel, url in schedule_fair(pending, self.args.limit, self.channels, self.states)]
+
+        # ダウンロード済みで書き起こしていないファイルは、ダウンロードを飛ばしてデコードから流す
+        if not self.args.no_backlog:
+            from transcribe import get_pending_files
+            files = get_pending_files(downloader.MP3_DIR, self.args.text_dir, downloader.BAD_AUDIO_FILE,
+                                      downloader.EPISODE_INDEX_FILE)
+            episodes += [new_episode(None, mp3_file=mp3_file) for mp3_file in sorted(files)[:self.args.limit]]
+        return episodes
+
+    def resolve(self, item):
+        """エピソードページからタイトル・日付・音声のURLを取得する"""
+        if item["mp3_file"]:
+            return True
+        with self._lock:
+            channel_id = item["channel"]["id"]
+            self.scheduled[channel_id] = self.scheduled.get(channel_id, 0) + 1
+            self.scheduled_at[channel_id] = time.time()
+        item["info"] = downloader.get_episode_info(item["url"])
+        if not item["info"]:
+            item.update(status="failed", error="resolve: エピソード情報を取得できませんでした")
+            return False
+        return True
+
+    def download(self, item):
+        """音声をダウンロードして結合し、検査に通ればすぐに履歴に加える"""
+        if item["mp3_file"]:
+            return True
+        info = item["info"]
+        if info["type"] == "mp3":
+            mp3_file = downloader.download_mp3_segments(info, info["mp3_urls"])
+        else:
+            mp3_file = downloader.download_m3u8_segments(info, info["segment_urls"])
+        added = []
+        ok = bool(mp3_file) and downloader.verify_download(mp3_file, info, item["url"], added)
+        if added:
+            update_history(item["channel"], added)
+        # 後ろの段階が索引から引けるよう、ダウンロードのたびに書き出す
+        downloader.save_episode_index()
+        if not ok:
+            item.update(status="failed", error="download: ダウンロードか検査に失敗しました")
+            return False
+        with self._lock:
+            channel_id = item["channel"]["id"]
+            self.succeeded[channel_id] = self.succeeded.get(channel_id, 0) + 1
+        item["mp3_file"] = mp3_file
+        item["verified"] = True
+        return True
+
+    def decode(self, item):
+        """MP3をPCMに読み込み、指定があれば無音を詰めてテンポを上げる"""
+        mp3_file = item["mp3_file"]
+        if not item.get("verified"):
+            check = verify_mp3(mp3_file)
+            if not check["ok"]:
+                attempts = mark_bad(episode_id_from_path(mp3_file), check, "transcriber", downloader.BAD_AUDIO_FILE)
+                logger.warning(f"音声の検査に通らないため書き起こしません（再ダウンロード対象, {attempts}回目）: "
+                               f"{format_result(check)}")
+                item.update(status="invalid", error="decode: 音声の検査に通りません")
+                return False
+        from audio_preprocess import load_audio, preprocess, format_stats
+        audio = load_audio(mp3_file)
+        item["audio_sec"] = len(audio) / SAMPLE_RATE
+        item["time_map"] = None
+        if self.preprocess_options:
+            audio, item["time_map"], item["preprocess"] = preprocess(audio, **self.preprocess_options)
+            logger.info(format_stats(item["preprocess"]))
+        item["audio"] = audio
+        item["episode"] = self.lookup_episode(mp3_file)
+        return self.check_consistency(item)
+
+    def lookup_episode(self, mp3_file):
+        """索引からエピソードのメタデータを1件引く（索引がないか、別の名前で保存されていればNone）"""
+        index = EpisodeIndex.open(downloader.EPISODE_INDEX_FILE)
+        if index is None:
+            return None
+        with index:
+            episode = index.get(episode_id_from_path(mp3_file))
+        if episode and episode["mp3_file"] != os.path.basename(mp3_file):
+            return None
+        return episode
+
+    def check_consistency(self, item):
+        """デコードした音声の先頭を小さいモデルで書き起こしてタイトルと照合し、食い違えば再ダウンロードに回す"""
+        if not self.checker:
+            return True
+        from consistency_check import format_check
+        # 照合器は自分のキャッシュだけをロックするので、先頭の書き起こしの間も他の段階は止まらない
+        # （--dry_run ではWhisperを使わず、書き起こし済みの結果があるときだけ照合する）
+        result = self.checker.check(item["mp3_file"], item["audio"], transcribe=not self.args.dry_run,
+                                    episode=item["episode"])
+        logger.info(format_check(result))
+        if result["status"] != "mismatch":
+            return True
+        attempts = self.checker.requeue(item["mp3_file"], result, "pipeline", downloader.BAD_AUDIO_FILE)
+        logger.warning(f"タイトルと内容が一致しないため書き起こしません（再ダウンロード対象, {attempts}回目）: "
+                       f"{item['episode_id']}")
+        item.update(status="mismatch", error="decode: タイトルと内容が一致しません", audio=None)
+        return False
+
+    def transcribe(self, item):
+        """デコード済みの音声を書き起こして保存する（--dry_run なら推論の時間だけ待つ）"""
+        audio = item.pop("audio")
+        if self.args.dry_run:
+            time.sleep(item["audio_sec"] * self.args.dry_run_rtf)
+            item["text"] = ""
+            return True
+        from transcribe import load_model, decode_audio, write_outputs
+        model = load_model(self.args.model)
+        result = decode_audio(audio, model, self.args.model, self.args.draft_model)
+        if item["time_map"] is not None:
+            item["time_map"].project_result(result)
+            result["preprocess"] = item["preprocess"]
+        item["text_file"] = write_outputs(item["mp3_file"], result, self.args.text_dir,
+                                          None if self.args.no_segments else self.args.segments_dir,
+                                          item["episode"])
+        return True
+
+    def add_to_index(self, item):
+        """書き起こしを関連エピソードのインデックスに加える（保存は最後に1回）"""
+        if self.args.dry_run:
+            return True
+        text_file = item["text_file"]
+        title, body = read_transcript(text_file)
+        with self._lock:
+            self.index.add(episode_id_from_path(text_file), title, body,
+                           os.path.basename(text_file), os.path.getmtime(text_file))
+            self.indexed += 1
+        return True
+
+    # --- 実行 ---
+
+    def finish(self, item):
+        item["finished_at"] = time.time()
+        with self._lock:
+            self.finished.append(item)
+        if item["status"] == "ok":
+            logger.info(f"完了: {item['episode_id']} ({item['finished_at'] - item['discovered_at']:.1f}秒)")
+
+    def run(self):
+        """すべての段階を起動し、発見したエピソードを流し終えるまで待つ"""
+        with span("pipeline_discover") as s:
+            episodes = self.discover()
+            s["episodes"] = len(episodes)
+        logger.info(f"流すエピソード: {len(episodes)}件")
+        if not episodes:
+            return []
+
+        funcs = {"resolve": self.resolve, "download": self.download, "decode": self.decode,
+                 "transcribe": self.transcribe, "index": self.add_to_index}
+        queues = {name: queue.Queue(maxsize=self.args.queue_size) for name in funcs}
+        stages = []
+        names = list(funcs)
+        for i, name in enumerate(names):
+            outbox = queues[names[i + 1]] if i + 1 < len(names) else None
+            stages.append(Stage(name, funcs[name], self.args.workers[name], queues[name], outbox, self.finish))
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        for stage in stages:
+            stage.start()
+
+        # 最初のキューもいっぱいなら待つので、発見した分を一度に抱え込まない
+        for item in episodes:
+            times = item["times"]["discover"] = {"start": item["discovered_at"], "end": time.time()}
+            queues["resolve"].put(item)
+            times["blocked"] = time.time() - times["end"]
+        for _ in range(stages[0].workers):
+            queues["resolve"].put(_STOP)
+        for stage in stages:
+            stage.join()
+
+        self.save()
+        return self.finished
+
+    def save(self):
+        """順番が回ってきたチャンネルの状態とインデックスを保存する"""
+        for channel in self.channels:
+            if channel["id"] not in self.scheduled:
+                continue
+            save_state(channel, mark_scheduled(channel, self.states[channel["id"]], self.scheduled[channel["id"]],
+                                               self.succeeded.get(channel["id"], 0), self.scheduled_at[channel["id"]]))
+        if self.checker:
+            self.checker.save()
+            logger.info(self.checker.format_report())
+        if self.indexed:
+            self.index.save(self.args.index)
+            logger.info(f"インデックスに {self.indexed}件を追加しました（合計 {len(self.index.docs)}件）")
+
+def channel_page_url(channel):
+    """チャンネルのエピソード一覧ページ（一覧に page_url がなければVoicyの既定の場所）"""
+    if channel.get("page_url"):
+        return channel["page_url"]
+    if channel["id"].isdigit():
+        return f"https://voicy.jp/channel/{channel['id']}/all"
+    return None
+
+def discover_channel(channel):
+    """エピソード一覧ページの静的HTMLからエピソードのリンクを集め、URLリストに加える
+
+    ページがJavaScriptで描画されていてリンクが見つからなければ何もしない（スクレイパーの結果を使う）。
+    """
+    page_url = channel_page_url(channel)
+    if not page_url:
+        return []
+    try:
+        response = get_http_cache().get(page_url)
+    except FetchError as e:
+        logger.warning(f"一覧ページの取得エラー: {page_url}: {e}")
+        return []
+    if response.status_code != 200:
+        logger.warning(f"一覧ページの取得エラー: {page_url}: ステータスコード {response.status_code}")
+        return []
+    pattern = re.compile(rf'href="([^"]*/channel/{re.escape(channel["id"])}/\d+)/?"')
+    urls = [urljoin(page_url, href) for href in pattern.findall(response.text)]
+    return add_urls(channel, urls)
+
+def summarize(finished, elapsed, workers):
+    """エピソードごとの所要時間（発見から完了まで）と段階ごとの待ち時間・処理時間を集計する"""
+    rows = []
+    for item in sorted(finished, key=lambda item: item["discovered_at"]):
+        row = {"episode_id": item["episode_id"], "status": item["status"], "error": item["error"],
+               "audio_sec": round(item.get("audio_sec", 0.0), 2),
+               "latency_sec": round(item["finished_at"] - item["discovered_at"], 3), "stages": {}}
+        # 待ち時間は、前の段階がキューに入れ終えてから取り出されるまで
+        ready = item["discovered_at"]
+        for name in STAGES:
+            times = item["times"].get(name)
+            if not times:
+                continue
+            row["stages"][name] = {"wait": round(max(0.0, times["start"] - ready), 3),
+                                   "service": round(times["end"] - times["start"], 3),
+                                   "blocked": round(times.get("blocked", 0.0), 3)}
+            ready = times["end"] + times.get("blocked", 0.0)
+        rows.append(row)
+
+    stages = {}
+    for name in STAGES:
+        timed = [row["stages"][name] for row in rows if name in row["stages"]]
+        if not timed:
+            continue
+        service = sum(times["service"] for times in timed)
+        stages[name] = {
+            "count": len(timed),
+            "workers": workers.get(name, 1),
+            "mean_wait_sec": round(sum(times["wait"] for times in timed) / len(timed), 3),
+            "mean_service_sec": round(service / len(timed), 3),
+            "mean_blocked_sec": round(sum(times["blocked"] for times in timed) / len(timed), 3),
+            # 1に近い段階がボトルネック（ワーカー数を増やす候補）
+            "utilization": round(service / (workers.get(name, 1) * elapsed), 3) if elapsed > 0 else None,
+        }
+    ok = [row["latency_sec"] for row in rows if row["status"] == "ok"]
+    return {"elapsed_sec": round(elapsed, 3), "episodes": len(rows), "succeeded": len(ok),
+            "mean_latency_sec": round(sum(ok) / len(ok), 3) if ok else None,
+            "max_latency_sec": max(ok) if ok else None, "stages": stages, "results": rows}
+
+def format_summary(summary):
+    lines = [f"{'エピソード':<12}{'状態':<9}{'音声(秒)':>9}{'所要(秒)':>10}  段階ごとの処理（待ち）秒"]
+    for row in summary["results"]:
+        stages = " ".join(f"{name}={times['service']:.2f}({times['wait']:.2f})" for name, times in row["stages"].items()
+                          if name != "discover")
+        lines.append(f"{row['episode_id']:<12}{row['status']:<9}{row['audio_sec']:>9.0f}{row['latency_sec']:>10.2f}  {stages}")
+    lines.append(f"\n{'段階':<12}{'件数':>6}{'ワーカー':>8}{'平均待ち':>10}{'平均処理':>10}{'平均詰まり':>11}{'稼働率':>8}")
+    for name, row in summary["stages"].items():
+        utilization = "-" if row["utilization"] is None else f"{100 * row['utilization']:.0f}%"
+        lines.append(f"{name:<12}{row['count']:>6}{row['workers']:>8}{row['mean_wait_sec']:>10.2f}"
+                     f"{row['mean_service_sec']:>10.2f}{row['mean_blocked_sec']:>11.2f}{utilization:>8}")
+    latency = "-" if summary["mean_latency_sec"] is None else f"{summary['mean_latency_sec']:.2f}秒"
+    lines.append(f"\n成功 {summary['succeeded']}/{summary['episodes']}件, 全体 {summary['elapsed_sec']:.1f}秒, "
+                 f"発見から完了までの平均 {latency}")
+    return "\n".join(lines)
+
+def setup_args(argv=None):
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='新着の発見からダウンロード・書き起こし・インデックス登録までを1つのプロセスで流します')
+    parser.add_argument('--channel', action='append', default=None,
+                        help='処理するチャンネルID（複数指定可、省略時は一覧の全チャンネル）')
+    parser.add_argument('--limit', type=int, default=downloader.MAX_DOWNLOADS_PER_RUN,
+                        help='1回の実行でダウンロードする最大件数（未書き起こしのファイルも同じ件数まで）')
+    parser.add_argument('--discover_pages', action='store_true',
+                        help='チャンネルのエピソード一覧ページから新着のURLを探してURLリストに加える')
+    parser.add_argument('--no_backlog', action='store_true',
+                        help='ダウンロード済みで未書き起こしのファイルを流さない')
+    for name, workers in WORKERS.items():
+        parser.add_argument(f'--{name}_workers', type=int, default=workers,
+                            help=f'{name} 段階のワーカー数')
+    parser.add_argument('--queue_size', type=int, default=QUEUE_SIZE,
+                        help='段階の間のキューの長さ（いっぱいなら前の段階が待つ）')
+    parser.add_argument('--text_dir', type=str, default='mp3_text',
+                        help='書き起こしテキストの出力先ディレクトリパス')
+    parser.add_argument('--segments_dir', type=str, default='mp3_segments',
+                        help='セグメント単位の書き起こし結果の出力先ディレクトリパス')
+    parser.add_argument('--no_segments', action='store_true',
+                        help='セグメント単位の結果を保存しない')
+    parser.add_argument('--index', type=str, default=INDEX_FILE,
+                        help='関連エピソードのインデックスファイル')
+    parser.add_argument('--model', type=str, default='medium',
+                        help='Whisperモデルのサイズ (tiny, base, small, medium, large)')
+    parser.add_argument('--draft_model', type=str, default=None,
+                        help='指定するとこのモデルで下書きし、低信頼の区間だけを --model で書き直す（例: small）')
+    parser.add_argument('--trim_silence', action='store_true',
+                        help='書き起こしの前に長い無音を詰める（タイムスタンプは元の音声の時刻に戻す）')
+    parser.add_argument('--tempo', type=float, default=1.0,
+                        help='書き起こしの前に音程を変えずに速くする倍率（1.0〜2.0）')
+    parser.add_argument('--check_consistency', action='store_true',
+                        help='デコードのあとに先頭を小さいモデルで書き起こしてタイトル・説明文と照合し、'
+                             '別のエピソードの音声なら書き起こさずに再ダウンロード対象にする')
+    parser.add_argument('--check_model', type=str, default='tiny',
+                        help='--check_consistency で先頭の書き起こしに使うモデル')
+    parser.add_argument('--check_file', type=str, default=os.path.join("output", "consistency_check.json"),
+                        help='--check_consistency の先頭の書き起こしと判定結果のキャッシュ')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Whisperを使わず、推論を音声の長さ×--dry_run_rtf 秒の待ちで模擬する'
+                             '（ダウンロードとデコードは行う。書き起こしとインデックスは保存しない）')
+    parser.add_argument('--dry_run_rtf', type=float, default=DRY_RUN_RTF,
+                        help='--dry_run で模擬する推論の実時間係数')
+    parser.add_argument('--report', type=str, default=None,
+                        help='エピソードごとの所要時間と段階ごとの集計をJSONで保存するパス')
+    args = parser.parse_args(argv)
+    if not 1.0 <= args.tempo <= 2.0:
+        parser.error(f"--tempo は 1.0 以上 2.0 以下で指定してください: {args.tempo}")
+    args.workers = {name: max(1, getattr(args, f"{name}_workers")) for name in WORKERS}
+    return args
+
+def run(args):
+    """パイプラインを1回流し、集計を返す"""
+    channels = downloader.load_target_channels(None, args.channel)
+    logger.info(f"対象チャンネル: {len(channels)}件, ワーカー数: {args.workers}, キューの長さ: {args.queue_size}")
+    downloader.setup_directories()
+    os.makedirs(args.text_dir, exist_ok=True)
+    downloader.ensure_ffmpeg_installed()
+    debug_capture = DebugCapture(downloader.DEBUG_DIR, downloader.DEBUG_LEVEL if downloader.DEBUG_MODE else "off",
+                                 downloader.DEBUG_SAMPLE_RATE, downloader.DEBUG_MAX_MB * 1024 * 1024)
+    set_debug_capture(debug_capture)
+    if not args.dry_run:
+        # 最初のエピソードが届く前にモデルを読み込んでおく（複数のワーカーで同じモデルを使う）
+        from transcribe import load_model
+        load_model(args.model)
+        if args.draft_model:
+            load_model(args.draft_model)
+
+    pipeline = Pipeline(args, channels)
+    start = time.time()
+    try:
+        finished = pipeline.run()
+    finally:
+        debug_capture.close()
+    return summarize(finished, time.time() - start, args.workers)
+
+def main():
+    args = setup_args()
+    instrumentation.init("pipeline")
+    try:
+        summary = run(args)
+    finally:
+        cache = get_http_cache(create=False)
+        if cache is not None:
+            cache.evict()
+            logger.info(cache.format_report())
+        get_controller().print_stats()
+        instrumentation.finish()
+
+    print(format_summary(summary))
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), **summary},
+                      f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+import instrumentation
+
+PROFILE_DIR = "profiles"  # プロファイル結果の出力先ディレクトリ
+SAMPLE_INTERVAL = 0.005  # 壁時計サンプリングの間隔（秒）
+TOP_N = 25  # ホットスポット一覧の件数
+
+# 待ち時間として分類するフレーム（ファイル名の末尾で判定）
+WAIT_KINDS = [
+    ("subprocess", ("subprocess.py",)),
+    ("network", ("socket.py", "ssl.py", "http/client.py", "urllib3/response.py", "urllib3/connection.py",
+                 "urllib3/connectionpool.py", "selenium/webdriver/remote/remote_connection.py")),
+    ("sleep", ("selenium/webdriver/support/wait.py",)),
+    ("workers", ("concurrent/futures/_base.py",)),
+]
+
+def _frame_name(code):
+    """フレームを flamegraph 用の名前（ファイル名:関数名）にする"""
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _wait_kind(frames):
+    """スタックの内側から見て、待ち時間の種類を判定する"""
+    for code in frames:
+        filename = code.co_filename.replace(os.sep, "/")
+        for kind, suffixes in WAIT_KINDS:
+            if filename.endswith(suffixes):
+                return kind
+    return None
+
+class StackSampler:
+    """対象スレッドのスタックを一定間隔で採取し、collapsed-stack 形式で数える
+
+    壁時計でサンプリングするため、ffmpeg の終了待ちやソケットの読み込み待ちのように
+    CPUを使っていない時間もスタックとして現れる。段階を実行中の別のスレッド（セグメントを
+    並列にダウンロードするワーカーなど）も採取し、対象スレッドの段階の下に [worker] を挟んで数える。
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.waits = Counter()
+        self.worker_waits = Counter()  # ワーカースレッドの待ち（スレッドごとの時間なので対象スレッドの待ちとは分ける）
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        recorder = instrumentation.get_recorder()
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            base = [f"[stage:{stage}]" for stage in recorder.active_stages(self.thread_id)]
+            if self._sample(frames.get(self.thread_id), base, self.waits):
+                self.samples += 1
+            for thread_id in recorder.active_threads():
+                if thread_id not in (self.thread_id, own_thread):
+                    stages = [f"[stage:{stage}]" for stage in recorder.active_stages(thread_id)]
+                    self._sample(frames.get(thread_id), base + ["[worker]"] + stages, self.worker_waits)
+
+    def _sample(self, frame, prefix, waits):
+        """1スレッドのスタックを「段階 → 関数」の順に組み立てて数える"""
+        codes = []
+        while frame is not None:
+            if frame.f_code.co_filename != __file__:
+                codes.append(frame.f_code)
+            frame = frame.f_back
+        if not codes:
+            return False
+        stack = prefix + [_frame_name(code) for code in reversed(codes)]
+        wait = _wait_kind(codes)
+        if wait:
+            stack.append(f"[wait:{wait}]")
+            waits[wait] += 1
+        self.stacks[";".join(stack)] += 1
+        return True
+
+class Profiler:
+    """エピソード/ファイルごとに cProfile と壁時計サンプリングを行い、成果物を書き出す"""
+
+    def __init__(self, profile_dir=PROFILE_DIR, interval=SAMPLE_INTERVAL, top_n=TOP_N):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.top_n = top_n
+        self.run_stacks = Counter()
+        self.run_waits = Counter()
+        self.run_worker_waits = Counter()
+        self.run_samples = 0
+        self.run_stats = None
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def profile(self, label):
+        """ブロック内の処理をプロファイルし、{label}.collapsed / .prof / .top.txt を書き出す"""
+        safe_label = re.sub(r"[^\w.-]+", "_", label)
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            elapsed = time.perf_counter() - start
+            try:
+                self._write(safe_label, profile, sampler, elapsed)
+            except Exception as e:
+                print(f"プロファイル結果の保存エラー: {e}")
+
+    def _write(self, label, profile, sampler, elapsed):
+        """1件分の成果物を書き出し、実行全体の集計に加える"""
+        base = os.path.join(self.profile_dir, label)
+        write_collapsed(base + ".collapsed", sampler.stacks)
+        profile.dump_stats(base + ".prof")
+
+        stats = pstats.Stats(profile)
+        if self.run_stats is None:
+            self.run_stats = pstats.Stats(profile)
+        else:
+            self.run_stats.add(profile)
+        with open(base + ".top.txt", "w", encoding="utf-8") as f:
+            f.write(format_report(label, elapsed, stats, sampler.stacks, sampler.waits, sampler.samples,
+                                  self.interval, self.top_n, sampler.worker_waits))
+
+        self.run_stacks.update(sampler.stacks)
+        self.run_waits.update(sampler.waits)
+        self.run_worker_waits.update(sampler.worker_waits)
+        self.run_samples += sampler.samples
+        print(f"プロファイルを保存しました: {base}.collapsed ({elapsed:.2f}秒, {sampler.samples}サンプル)")
+
+    def finish(self, label="run"):
+        """実行全体をまとめた collapsed-stack とホットスポット一覧を書き出す"""
+        if not self.run_samples and self.run_stats is None:
+            return
+        base = os.path.join(self.profile_dir, label)
+        write_collapsed(base + ".collapsed", self.run_stacks)
+        report = format_report(label, self.run_samples * self.interval, self.run_stats, self.run_stacks,
+                               self.run_waits, self.run_samples, self.interval, self.top_n, self.run_worker_waits)
+        with open(base + ".top.txt", "w", encoding="utf-8") as f:
+            f.write(report)
+        print(report)
+        print(f"実行全体のプロファイルを保存しました: {base}.collapsed, {base}.top.txt")
+
+def write_collapsed(path, stacks):
+    """flamegraph.pl / speedscope で読める collapsed-stack 形式で書き出す"""
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+def format_report(label, elapsed, stats, stacks, waits, samples, interval, top_n, worker_waits=None):
+    """段階別の内訳・待ち時間・ホットスポットをテキストにまとめる
+
+    ワーカースレッドのサンプルは段階別・関数別の時間に含まれるため、合計が100%を超えることがある。
+    """
+    lines = [f"# プロファイル: {label} (所要時間 約{elapsed:.2f}秒, サンプル数 {samples}, 間隔 {interval * 1000:.0f}ms)", ""]
+
+    # 段階ごとの壁時計時間（最も内側の段階に計上）
+    by_stage = Counter()
+    self_time = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        stages = [f for f in frames if f.startswith("[stage:")]
+        by_stage[stages[-1][7:-1] if stages else "(段階外)"] += count
+        leaf = [f for f in frames if not f.startswith("[")]
+        if leaf:
+            self_time[leaf[-1]] += count
+    if samples:
+        lines.append("## 段階別の時間（壁時計）")
+        for stage, count in by_stage.most_common():
+            lines.append(f"{count * interval:>10.2f}秒 {100 * count / samples:>6.1f}%  {stage}")
+        lines.append("")
+        lines.append("## 待ち時間")
+        for kind, count in waits.most_common():
+            lines.append(f"{count * interval:>10.2f}秒 {100 * count / samples:>6.1f}%  {kind}")
+        busy = samples - sum(waits.values())
+        lines.append(f"{busy * interval:>10.2f}秒 {100 * busy / samples:>6.1f}%  (待ち以外)")
+        lines.append("")
+        if worker_waits:
+            lines.append("## ワーカースレッドの待ち時間（スレッドごとの合計）")
+            for kind, count in worker_waits.most_common():
+                lines.append(f"{count * interval:>10.2f}秒  {kind}")
+            lines.append("")
+        lines.append(f"## 自己時間の多い関数（壁時計サンプル, 上位{top_n}件）")
+        for name, count in self_time.most_common(top_n):
+            lines.append(f"{count * interval:>10.2f}秒 {100 * count / samples:>6.1f}%  {name}")
+        lines.append("")
+
+    if stats is not None:
+        for sort_key, title in (("tottime", "自己時間"), ("cumulative", "累積時間")):
+            lines.append(f"## cProfile {title}順 (上位{top_n}件)")
+            rows = sorted(stats.stats.items(), key=lambda item: -item[1][2 if sort_key == "tottime" else 3])
+            for (filename, lineno, func), (cc, nc, tt, ct, _) in rows[:top_n]:
+                lines.append(f"{tt:>10.3f}秒 {ct:>10.3f}秒 {nc:>8}回  {os.path.basename(filename)}:{lineno}({func})")
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+# プロセス全体で共有するプロファイラ（--profile 指定時のみ有効）
+_profiler = None
+
+def enable(profile_dir=PROFILE_DIR, interval=SAMPLE_INTERVAL):
+    """プロファイルを有効にする"""
+    global _profiler
+    _profiler = Profiler(profile_dir, interval)
+    print(f"プロファイルを有効にしました: {profile_dir}")
+    return _profiler
+
+def profile(label):
+    """有効ならブロックをプロファイルし、無効なら何もしない"""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.profile(label)
+
+def finish():
+    """実行全体のプロファイルを書き出す"""
+    if _profiler is not None:
+        _profiler.finish()
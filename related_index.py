@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import time
+import glob
+import heapq
+import argparse
+import logging
+import unicodedata
+from collections import Counter
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('related_index')
+
+TEXT_DIR = "mp3_text"  # 書き起こしテキストのディレクトリ
+INDEX_FILE = os.path.join("output", "related_index.json.gz")  # インデックスの保存先
+INDEX_VERSION = 1
+NGRAM_RANGE = (2, 3)  # 文字n-gramの範囲
+MAX_QUERY_TERMS = 256  # クエリで使う重み上位の語数（0で無制限）
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='書き起こしテキストから関連エピソードの索引を作成・検索します')
+    parser.add_argument('--text_dir', type=str, default=TEXT_DIR,
+                        help='書き起こしテキストのディレクトリパス')
+    parser.add_argument('--index', type=str, default=INDEX_FILE,
+                        help='インデックスファイルのパス')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='既存のインデックスを使わずに作り直す')
+    parser.add_argument('--query', type=str, default=None,
+                        help='関連エピソードを探すエピソードID')
+    parser.add_argument('--text', type=str, default=None,
+                        help='自由テキストで関連エピソードを探す')
+    parser.add_argument('-k', '--top_k', type=int, default=5,
+                        help='表示する関連エピソード数')
+    return parser.parse_args()
+
+def episode_id_from_path(path):
+    """ファイル名（{date}_{title}_{episode_id}.txt）からエピソードIDを取り出す"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.rsplit('_', 1)[-1]
+
+def read_transcript(path):
+    """書き起こしファイルを読み、ヘッダーと本文に分ける"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    title = ""
+    body_lines = []
+    for i, line in enumerate(lines):
+        if i == 0 and line.startswith('# '):
+            title = line[2:].strip()
+        elif i == 1 and line.startswith('日付:'):
+            continue
+        else:
+            body_lines.append(line)
+    return title, "\n".join(body_lines)
+
+def normalize_text(text):
+    """NFKC正規化して空白と記号を取り除く"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return re.sub(r'[\s\W_]+', '', text)
+
+def char_ngrams(text, ngram_range=NGRAM_RANGE):
+    """文字n-gramの出現回数を数える"""
+    text = normalize_text(text)
+    counts = Counter()
+    low, high = ngram_range
+    for n in range(low, high + 1):
+        counts.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return counts
+
+class RelatedIndex:
+    """文字n-gramのTF-IDFによる疎な転置インデックス
+
+    各文書の生の出現回数を保持し、重み（1+log tf）*idf とL2ノルムは
+    文書が追加・削除されたときだけ計算し直す。検索は転置リストを使った
+    疎ベクトル同士の内積で、クエリ側の非ゼロ要素だけを走査する。
+    """
+
+    def __init__(self, ngram_range=NGRAM_RANGE):
+        self.ngram_range = tuple(ngram_range)
+        self.docs = {}  # episode_id -> {"file", "title", "mtime", "terms"}
+        self._postings = None  # term -> (doc_ids, weights)
+        self._idf = None
+
+    # --- 永続化 ---
+
+    @classmethod
+    def load(cls, path):
+        """インデックスを読み込む（存在しないか形式が違えば空のインデックス）"""
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                logger.info(f"インデックスの形式が古いため作り直します: {path}")
+                return index
+            index.ngram_range = tuple(data["ngram_range"])
+            index.docs = data["docs"]
+        except Exception as e:
+            logger.error(f"インデックスの読み込みエラー: {e}")
+            index.docs = {}
+        return index
+
+    def save(self, path):
+        """インデックスを書き出す（一時ファイル経由で置き換える）"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "ngram_range": list(self.ngram_range),
+                "docs": self.docs,
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    # --- 更新 ---
+
+    def add(self, episode_id, title, text, file="", mtime=0.0):
+        """文書を追加（同じIDがあれば置き換え）"""
+        self.docs[episode_id] = {
+            "file": file,
+            "title": title,
+            "mtime": mtime,
+            "terms": dict(char_ngrams(text, self.ngram_range)),
+        }
+        self._postings = None
+
+    def remove(self, episode_id):
+        """文書を削除"""
+        if self.docs.pop(episode_id, None) is not None:
+            self._postings = None
+
+    def update_from_dir(self, text_dir):
+        """ディレクトリ内の書き起こしと差分を取り、新規・更新分だけ取り込む"""
+        seen = set()
+        added = 0
+        for path in sorted(glob.glob(os.path.join(text_dir, '*.txt'))):
+            episode_id = episode_id_from_path(path)
+            seen.add(episode_id)
+            mtime = os.path.getmtime(path)
+            doc = self.docs.get(episode_id)
+            if doc and doc["file"] == os.path.basename(path) and doc["mtime"] == mtime:
+                continue
+            title, body = read_transcript(path)
+            self.add(episode_id, title, body, os.path.basename(path), mtime)
+            added += 1
+
+        removed = [episode_id for episode_id in self.docs if episode_id not in seen]
+        for episode_id in removed:
+            self.remove(episode_id)
+        return added, len(removed)
+
+    # --- 検索 ---
+
+    def _finalize(self):
+        """idf・正規化済みの重み・転置リストを作る"""
+        n_docs = len(self.docs)
+        df = Counter()
+        for doc in self.docs.values():
+            df.update(doc["terms"].keys())
+        self._idf = {term: math.log((1 + n_docs) / (1 + count)) + 1.0 for term, count in df.items()}
+
+        postings = {}
+        for episode_id, doc in self.docs.items():
+            weights = self._weigh(doc["terms"])
+            for term, weight in weights.items():
+                entry = postings.get(term)
+                if entry is None:
+                    postings[term] = ([episode_id], [weight])
+                else:
+                    entry[0].append(episode_id)
+                    entry[1].append(weight)
+        self._postings = postings
+
+    def _weigh(self, term_counts):
+        """出現回数を L2 正規化済みの TF-IDF 重みに変換（未知語は無視）"""
+        idf = self._idf
+        weights = {}
+        for term, count in term_counts.items():
+            term_idf = idf.get(term)
+            if term_idf is not None:
+                weights[term] = (1.0 + math.log(count)) * term_idf
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        if norm > 0:
+            for term in weights:
+                weights[term] /= norm
+        return weights
+
+    def similar(self, term_counts, top_k=5, exclude=None, max_query_terms=MAX_QUERY_TERMS):
+        """出現回数ベクトルに近い文書を (score, episode_id) の降順で返す"""
+        if self._postings is None:
+            self._finalize()
+
+        query = self._weigh(term_counts)
+        if max_query_terms and len(query) > max_query_terms:
+            # 重みの大きい語だけで内積を取る（小さい重みの語はスコアへの寄与も小さい）
+            query = dict(heapq.nlargest(max_query_terms, query.items(), key=lambda item: item[1]))
+
+        scores = {}
+        postings = self._postings
+        for term, q_weight in query.items():
+            doc_ids, weights = postings[term]
+            for episode_id, weight in zip(doc_ids, weights):
+                scores[episode_id] = scores.get(episode_id, 0.0) + q_weight * weight
+
+        if exclude is not None:
+            scores.pop(exclude, None)
+        return [(score, episode_id) for episode_id, score in
+                heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])]
+
+    def similar_to_episode(self, episode_id, top_k=5):
+        """登録済みエピソードに近いエピソードを返す"""
+        doc = self.docs.get(episode_id)
+        if doc is None:
+            raise KeyError(episode_id)
+        return self.similar(doc["terms"], top_k=top_k, exclude=episode_id)
+
+    def similar_to_text(self, text, top_k=5):
+        """自由テキストに近いエピソードを返す"""
+        return self.similar(char_ngrams(text, self.ngram_range), top_k=top_k)
+
+def update_index(text_dir=TEXT_DIR, index_path=INDEX_FILE, rebuild=False):
+    """インデックスを読み込み、書き起こしとの差分を反映して保存する"""
+    index = RelatedIndex() if rebuild else RelatedIndex.load(index_path)
+    added, removed = index.update_from_dir(text_dir)
+    if added or removed or not os.path.exists(index_path):
+        index.save(index_path)
+    logger.info(f"インデックス更新: 追加/更新 {added}件, 削除 {removed}件, 合計 {len(index.docs)}件")
+    return index
+
+def main():
+    args = setup_args()
+
+    start_time = time.time()
+    index = update_index(args.text_dir, args.index, args.rebuild)
+    logger.info(f"インデックス準備完了 (所要時間: {time.time() - start_time:.2f}秒)")
+
+    if args.query is None and args.text is None:
+        return
+
+    start_time = time.time()
+    index._finalize()
+    logger.info(f"転置リスト作成 (所要時間: {(time.time() - start_time) * 1000:.1f}ミリ秒)")
+
+    start_time = time.time()
+    try:
+        if args.query is not None:
+            results = index.similar_to_episode(args.query, args.top_k)
+            logger.info(f"基準: {args.query} {index.docs[args.query]['title']}")
+        else:
+            results = index.similar_to_text(args.text, args.top_k)
+    except KeyError:
+        logger.error(f"インデックスにないエピソードIDです: {args.query}")
+        sys.exit(1)
+    logger.info(f"検索完了 (所要時間: {(time.time() - start_time) * 1000:.1f}ミリ秒)")
+
+    for score, episode_id in results:
+        print(f"{score:.4f}\t{episode_id}\t{index.docs[episode_id]['title']}")
+
+if __name__ == "__main__":
+    main()
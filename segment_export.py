@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import argparse
+import logging
+import numpy as np
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('segment_export')
+
+SEGMENTS_DIR = "mp3_segments"  # セグメント単位の書き起こし結果の保存先
+STATS_FILE = os.path.join("output", "segment_stats.json")  # 集計結果の保存先
+LOW_LOGPROB = -1.0  # これより低い avg_logprob を低信頼とみなす
+HIGH_NO_SPEECH = 0.6  # これより高い no_speech_prob を低信頼とみなす
+
+# 列名と型（Whisperのセグメント辞書のキーに対応）
+FLOAT_COLUMNS = ["start", "end", "avg_logprob", "no_speech_prob", "compression_ratio", "temperature"]
+INT_COLUMNS = ["seek"]
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='セグメント単位の書き起こし結果を集計します')
+    parser.add_argument('--segments_dir', type=str, default=SEGMENTS_DIR,
+                        help='セグメントファイルのディレクトリパス')
+    parser.add_argument('--output', type=str, default=STATS_FILE,
+                        help='集計結果のJSONファイルパス')
+    parser.add_argument('--show_spans', action='store_true',
+                        help='低信頼区間を表示する')
+    return parser.parse_args()
+
+def partition_path(segments_dir, date_str, episode_id):
+    """日付パーティションの保存パスを返す（{segments_dir}/date=YYYYMMDD/{episode_id}.npz）"""
+    return os.path.join(segments_dir, f"date={date_str}", f"{episode_id}.npz")
+
+def export_segments(result, segments_dir, date_str, episode_id):
+    """Whisperの結果からセグメントを列ごとの配列にしてnpzで保存する"""
+    segments = result.get("segments", [])
+    columns = {}
+    for name in FLOAT_COLUMNS:
+        columns[name] = np.array([seg.get(name, np.nan) for seg in segments], dtype=np.float32)
+    for name in INT_COLUMNS:
+        columns[name] = np.array([seg.get(name, 0) for seg in segments], dtype=np.int32)
+    columns["n_tokens"] = np.array([len(seg.get("tokens", [])) for seg in segments], dtype=np.int32)
+    columns["text"] = np.array([seg.get("text", "") for seg in segments], dtype=np.str_)
+
+    output_path = partition_path(segments_dir, date_str, episode_id)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # np.savez_compressed は拡張子を自動付与するため、ファイルオブジェクトで渡す
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **columns)
+    os.replace(tmp_path, output_path)
+    logger.info(f"セグメントを保存しました: {output_path} ({len(segments)}件)")
+    return output_path
+
+def load_segments(path, columns=None):
+    """npzファイルから列を読み込む（columns を指定すればその列だけ）"""
+    with np.load(path, allow_pickle=False) as data:
+        names = columns or data.files
+        return {name: data[name] for name in names}
+
+def scan_segments(segments_dir, columns=None):
+    """全パーティションを読み、列を連結した表とエピソード境界を返す"""
+    paths = sorted(glob.glob(os.path.join(segments_dir, "date=*", "*.npz")))
+    episodes = []
+    tables = []
+    for path in paths:
+        table = load_segments(path, columns)
+        date_str = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+        episode_id = os.path.splitext(os.path.basename(path))[0]
+        episodes.append((date_str, episode_id, len(next(iter(table.values()))) if table else 0))
+        tables.append(table)
+
+    if not tables:
+        return {}, []
+    merged = {name: np.concatenate([t[name] for t in tables]) for name in tables[0]}
+    return merged, episodes
+
+def episode_stats(segments_dir):
+    """エピソードごとの話速・無音率・低信頼区間をベクトル演算で求める"""
+    table, episodes = scan_segments(segments_dir, ["start", "end", "avg_logprob", "no_speech_prob", "text"])
+    if not episodes:
+        return []
+
+    counts = np.array([count for _, _, count in episodes])
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    nonempty = counts > 0
+    starts = bounds[:-1][nonempty]
+
+    durations = np.maximum(table["end"] - table["start"], 0.0)
+    chars = np.char.str_len(np.char.strip(table["text"])).astype(np.float64)
+    low_conf = (table["avg_logprob"] < LOW_LOGPROB) | (table["no_speech_prob"] > HIGH_NO_SPEECH)
+
+    # エピソード単位の集計（reduceat は空区間を扱えないため空でない区間だけ集計）
+    speech = np.zeros(len(episodes))
+    total_chars = np.zeros(len(episodes))
+    total_time = np.zeros(len(episodes))
+    low_time = np.zeros(len(episodes))
+    mean_logprob = np.full(len(episodes), np.nan)
+    if len(starts):
+        speech[nonempty] = np.add.reduceat(durations, starts)
+        total_chars[nonempty] = np.add.reduceat(chars, starts)
+        total_time[nonempty] = np.maximum.reduceat(table["end"], starts)
+        low_time[nonempty] = np.add.reduceat(np.where(low_conf, durations, 0.0), starts)
+        mean_logprob[nonempty] = np.add.reduceat(table["avg_logprob"] * durations, starts) / np.maximum(speech[nonempty], 1e-9)
+
+    stats = []
+    for i, (date_str, episode_id, count) in enumerate(episodes):
+        lo, hi = bounds[i], bounds[i + 1]
+        spans = [[float(s), float(e)] for s, e in zip(table["start"][lo:hi][low_conf[lo:hi]],
+                                                      table["end"][lo:hi][low_conf[lo:hi]])]
+        stats.append({
+            "date": date_str,
+            "episode_id": episode_id,
+            "segments": int(count),
+            "duration_sec": round(float(total_time[i]), 2),
+            "speech_sec": round(float(speech[i]), 2),
+            "silence_ratio": round(float(1.0 - speech[i] / total_time[i]), 4) if total_time[i] > 0 else None,
+            "chars_per_sec": round(float(total_chars[i] / speech[i]), 3) if speech[i] > 0 else None,
+            "mean_logprob": None if np.isnan(mean_logprob[i]) else round(float(mean_logprob[i]), 4),
+            "low_confidence_sec": round(float(low_time[i]), 2),
+            "low_confidence_spans": spans,
+        })
+    return stats
+
+def main():
+    args = setup_args()
+
+    stats = episode_stats(args.segments_dir)
+    logger.info(f"集計対象エピソード数: {len(stats)}")
+
+    for row in stats:
+        print(f"{row['date']}\t{row['episode_id']}\t{row['duration_sec']:.0f}秒\t"
+              f"無音率 {row['silence_ratio']}\t話速 {row['chars_per_sec']}文字/秒\t"
+              f"低信頼 {row['low_confidence_sec']:.0f}秒")
+        if args.show_spans:
+            for start, end in row["low_confidence_spans"]:
+                print(f"\t\t{start:.1f} - {end:.1f}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    logger.info(f"集計結果を保存しました: {args.output}")
+
+if __name__ == "__main__":
+    main()
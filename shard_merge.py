@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from episode_index import INDEX_FILE, EpisodeIndex, write_index
+
+MANIFEST = "shard_merge.json"  # 保存先に書く、基準のコミットと変更したファイルの一覧
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(
+        description='シャードごとのジョブの変更を保存し、最新のブランチに取り込み直します'
+                    '（複数のランナーが同じJSONを更新しても、プッシュの競合で他のシャードの結果を消さない）')
+    parser.add_argument('command', choices=['save', 'apply'],
+                        help='save: 基準のコミットからの変更を保存する / apply: 保存した変更を作業ツリーに取り込む')
+    parser.add_argument('shard_dir', help='変更の保存先ディレクトリ')
+    parser.add_argument('paths', nargs='*', default=['.'],
+                        help='save で対象にするパス')
+    return parser.parse_args()
+
+def _git(*args):
+    return subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE).stdout
+
+def changed_paths(paths):
+    """作業ツリーで変更・追加・削除されたファイルを (変更したファイル, 削除したファイル) で返す（.gitignore の対象は除く）"""
+    output = _git("status", "--porcelain", "-z", "--untracked-files=all", "--no-renames", "--", *paths)
+    changed, deleted = [], []
+    for record in output.decode("utf-8").split("\0"):
+        if not record:
+            continue
+        status, path = record[:2], record[3:]
+        (deleted if "D" in status else changed).append(path)
+    return changed, deleted
+
+def save(shard_dir, paths):
+    """基準のコミットと、そこからの変更を shard_dir に写す"""
+    changed, deleted = changed_paths(paths)
+    for path in changed:
+        target = os.path.join(shard_dir, "files", path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(path, target)
+    manifest = {"base": _git("rev-parse", "HEAD").decode().strip(), "changed": changed, "deleted": deleted}
+    with open(os.path.join(shard_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"シャードの変更を保存しました: 変更 {len(changed)}件, 削除 {len(deleted)}件")
+    return manifest
+
+def _base_bytes(base, path):
+    """基準のコミットでのファイルの中身（なければ None）"""
+    try:
+        return subprocess.run(["git", "show", f"{base}:{path}"], check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    except subprocess.CalledProcessError:
+        return None
+
+def _base_json(base, path, default):
+    """基準のコミットでのJSONファイルの内容（なければ default）"""
+    data = _base_bytes(base, path)
+    return default if data is None else json.loads(data.decode("utf-8"))
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def merge_list(base, ours, theirs):
+    """シャードが加えた要素を足し、シャードが消した要素を除く（URLリスト・履歴）"""
+    base = set(base)
+    removed = base - set(theirs)
+    merged = [item for item in ours if item not in removed]
+    known = set(merged)
+    for item in theirs:
+        if item not in base and item not in known:
+            merged.append(item)
+            known.add(item)
+    return merged
+
+def merge_value(base, ours, theirs):
+    """シャードが変えた値を最新の値に反映する
+
+    整数は件数として増えた分を足し、小数は時刻として新しい方を採る。それ以外はシャードの値にする。
+    """
+    if isinstance(theirs, bool) or isinstance(ours, bool):
+        return theirs
+    if isinstance(theirs, int) and isinstance(ours, int) and isinstance(base, int):
+        return ours + theirs - base
+    if isinstance(theirs, float) and isinstance(ours, (int, float)):
+        return max(ours, theirs)
+    return theirs
+
+def merge_dict(base, ours, theirs):
+    """キーごとに、シャードが変えたものだけを反映する（エピソードIDごとの記録・チャンネルの状態）"""
+    merged = dict(ours)
+    for key in set(base) | set(theirs):
+        if key not in theirs:
+            merged.pop(key, None)
+        elif theirs[key] != base.get(key):
+            if key in ours and not isinstance(theirs[key], (dict, list)):
+                merged[key] = merge_value(base.get(key), ours[key], theirs[key])
+            else:
+                merged[key] = theirs[key]
+    return merged
+
+def merge_json(base, ours, theirs):
+    if isinstance(theirs, list) and isinstance(ours, list):
+        return merge_list(base if isinstance(base, list) else [], ours, theirs)
+    if isinstance(theirs, dict) and isinstance(ours, dict):
+        return merge_dict(base if isinstance(base, dict) else {}, ours, theirs)
+    return theirs
+
+def _index_entries(path):
+    """索引の件をエピソードID → 件で、走査済みかと一緒に返す（なければ None）"""
+    index = EpisodeIndex.open(path)
+    if index is None:
+        return None, False
+    with index:
+        return {entry["episode_id"]: entry for entry in index}, index.complete
+
+def merge_index(base_data, path, source):
+    """エピソードの索引を件ごとに取り込む（両方が走査済みのときだけ走査済みにする）"""
+    ours, ours_complete = _index_entries(path)
+    if ours is None:
+        shutil.copy2(source, path)
+        return
+    base = {}
+    if base_data is not None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base_path = os.path.join(tmp_dir, "base.bin")
+            with open(base_path, "wb") as f:
+                f.write(base_data)
+            base = _index_entries(base_path)[0] or {}
+    theirs, theirs_complete = _index_entries(source)
+    merged = merge_dict(base, ours, theirs or {})
+    write_index(path, merged.values(), ours_complete and theirs_complete)
+
+def apply(shard_dir):
+    """保存した変更を現在の作業ツリー（最新のブランチ）に取り込む。取り込んだパスを返す"""
+    with open(os.path.join(shard_dir, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    base = manifest["base"]
+    for path in manifest["changed"]:
+        source = os.path.join(shard_dir, "files", path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if path.endswith(".json"):
+            theirs = _load_json(source, None)
+            ours = _load_json(path, None)
+            if ours is not None:
+                merged = merge_json(_base_json(base, path, None), ours, theirs)
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(merged, f, ensure_ascii=False, indent=2)
+                continue
+        if os.path.normpath(path) == os.path.normpath(INDEX_FILE):
+            merge_index(_base_bytes(base, path), path, source)
+            continue
+        shutil.copy2(source, path)
+    for path in manifest["deleted"]:
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"シャードの変更を取り込みました: 変更 {len(manifest['changed'])}件, 削除 {len(manifest['deleted'])}件")
+    return manifest["changed"] + manifest["deleted"]
+
+def main():
+    args = setup_args()
+    os.makedirs(args.shard_dir, exist_ok=True)
+    if args.command == "save":
+        save(args.shard_dir, args.paths)
+    else:
+        apply(args.shard_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from instrumentation import span
+from segment_export import LOW_LOGPROB, HIGH_NO_SPEECH
+
+logger = logging.getLogger('speculative')
+
+SAMPLE_RATE = 16000  # whisper.load_audio のサンプリング周波数
+HIGH_COMPRESSION = 2.4  # これより高い compression_ratio は繰り返し（幻聴）を疑う（Whisperの既定の閾値と同じ）
+MERGE_GAP_SEC = 1.0  # 低信頼の区間がこれより近ければ1つにまとめて再デコードする
+PAD_SEC = 1.0  # 再デコードでは前後にこれだけ余分に音声を渡して文脈にする
+MIN_SPAN_SEC = 4.0  # 再デコードする区間の最短の長さ（短すぎると大きいモデルでも精度が出ない）
+MAX_REDECODE_RATIO = 0.6  # 低信頼の区間がこの割合を超えたら、区間に分けず全体を大きいモデルで書き起こす
+PROMPT_CHARS = 100  # 再デコードの initial_prompt に渡す直前の下書きの文字数
+
+def is_low_confidence(segment):
+    """下書きのセグメントが大きいモデルでの再デコードを要するか"""
+    text = segment.get("text", "").strip()
+    if not text:
+        return False
+    if segment.get("avg_logprob", 0.0) < LOW_LOGPROB:
+        return True
+    if segment.get("compression_ratio", 0.0) > HIGH_COMPRESSION:
+        return True
+    # 無音らしいのに文字が出ているセグメントは幻聴を疑う
+    return segment.get("no_speech_prob", 0.0) > HIGH_NO_SPEECH
+
+def low_confidence_spans(segments, duration):
+    """低信頼のセグメントを近いものどうしでまとめ、再デコードする区間 [開始, 終了] のリストを返す"""
+    spans = []
+    for segment in segments:
+        if not is_low_confidence(segment):
+            continue
+        start, end = segment["start"], segment["end"]
+        if spans and start - spans[-1][1] <= MERGE_GAP_SEC:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+
+    # 短い区間は中心を保ったまま広げ、広げて重なったものはまとめ直す
+    widened = []
+    for start, end in spans:
+        if end - start < MIN_SPAN_SEC:
+            center = (start + end) / 2
+            start, end = max(0.0, center - MIN_SPAN_SEC / 2), min(duration, center + MIN_SPAN_SEC / 2)
+        if widened and start <= widened[-1][1]:
+            widened[-1][1] = max(widened[-1][1], end)
+        else:
+            widened.append([start, end])
+    return widened
+
+def _inside(segment, spans):
+    """セグメントの中点が再デコードする区間のどれかに入るか"""
+    middle = (segment["start"] + segment["end"]) / 2
+    return any(start <= middle < end for start, end in spans)
+
+def splice(draft_segments, redecoded_segments, spans):
+    """下書きのうち再デコードした区間に入るセグメントを差し替え、時刻順に並べる"""
+    kept = [dict(segment, source="draft") for segment in draft_segments if not _inside(segment, spans)]
+    replaced = [dict(segment, source="final") for segment in redecoded_segments]
+    segments = sorted(kept + replaced, key=lambda segment: segment["start"])
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    return segments
+
+def _prompt_before(segments, time_sec):
+    """再デコードの文脈として、区間の直前までの下書きの末尾を返す"""
+    text = "".join(segment["text"] for segment in segments if segment["end"] <= time_sec)
+    return text[-PROMPT_CHARS:] or None
+
+def transcribe_speculative(audio, draft_model, final_model, draft_name, final_name, language="ja",
+                           initial_prompt=None):
+    """小さいモデルで下書きし、低信頼の区間だけを大きいモデルで書き直す
+
+    audio は whisper.load_audio で読んだ16kHzの配列。戻り値は Whisper の結果と同じ形で、
+    セグメントには source（draft / final）が付き、result["speculative"] に内訳が入る。
+    initial_prompt は窓ごとに書き起こすときの直前の窓の書き起こし。
+    """
+    duration = len(audio) / SAMPLE_RATE
+    with span("inference", model=draft_name, audio_sec=duration, phase="draft"):
+        draft = draft_model.transcribe(audio, language=language, initial_prompt=initial_prompt)
+    draft_segments = draft.get("segments", [])
+    spans = low_confidence_spans(draft_segments, duration)
+    span_sec = sum(end - start for start, end in spans)
+    summary = {"draft_model": draft_name, "final_model": final_name, "duration_sec": round(duration, 2),
+               "spans": len(spans), "redecoded_sec": round(span_sec, 2), "full_redecode": False}
+
+    if duration > 0 and span_sec / duration > MAX_REDECODE_RATIO:
+        # ほとんどが低信頼なら、区間ごとに切るより全体を1回で書き起こす方が速く正確
+        logger.info(f"低信頼の区間が {100 * span_sec / duration:.0f}% のため全体を {final_name} で書き起こします")
+        with span("inference", model=final_name, audio_sec=duration, phase="final"):
+            result = final_model.transcribe(audio, language=language, initial_prompt=initial_prompt)
+        for segment in result.get("segments", []):
+            segment["source"] = "final"
+        summary.update(full_redecode=True, spans=1, redecoded_sec=round(duration, 2))
+        result["speculative"] = summary
+        return result
+
+    redecoded = []
+    for start, end in spans:
+        clip_start = max(0.0, start - PAD_SEC)
+        clip_end = min(duration, end + PAD_SEC)
+        clip = audio[int(clip_start * SAMPLE_RATE):int(clip_end * SAMPLE_RATE)]
+        with span("inference", model=final_name, audio_sec=clip_end - clip_start, phase="redecode"):
+            result = final_model.transcribe(clip, language=language, condition_on_previous_text=False,
+                                            initial_prompt=_prompt_before(draft_segments, start) or initial_prompt)
+        for segment in result.get("segments", []):
+            segment = dict(segment, start=segment["start"] + clip_start, end=segment["end"] + clip_start)
+            # 文脈として余分に渡した前後の部分は下書きの方を使う
+            if start <= (segment["start"] + segment["end"]) / 2 < end:
+                redecoded.append(segment)
+
+    segments = splice(draft_segments, redecoded, spans)
+    logger.info(f"低信頼の区間 {len(spans)}件 ({span_sec:.1f}秒 / {duration:.1f}秒) を {final_name} で再デコードしました")
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments,
+            "language": draft.get("language", language), "speculative": summary}
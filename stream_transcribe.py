@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+import logging
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+from instrumentation import span
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('stream_transcribe')
+
+SAMPLE_RATE = 16000  # Whisperに渡すサンプリング周波数
+WINDOW_SEC = 300.0  # 1回に書き起こす窓の長さ（メモリの上限はこれで決まる）
+OVERLAP_SEC = 10.0  # 隣の窓と重ねる長さ（境界で切れた発話を両方の窓で書き起こす）
+PROMPT_CHARS = 200  # 次の窓の initial_prompt に引き継ぐ直前の書き起こしの文字数
+
+def peak_rss_mb():
+    """プロセスの最大常駐メモリ（MB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def stream_windows(path, window_sec=WINDOW_SEC, overlap_sec=OVERLAP_SEC, sample_rate=SAMPLE_RATE):
+    """FFmpegのパイプからPCMを読み、(窓の開始秒, 窓の配列, 最後の窓か) を順に返す
+
+    窓の配列は使い回すバッファのビューなので、次の窓を要求する前に使い終えること。
+    重なりの部分はバッファの先頭に移してから続きを読み込む。
+    """
+    if not 0 <= overlap_sec < window_sec:
+        raise ValueError(f"重なりは 0 以上、窓の長さ未満にしてください: {overlap_sec}")
+    window = int(window_sec * sample_rate)
+    overlap = int(overlap_sec * sample_rate)
+    buffer = np.empty(window, dtype=np.float32)
+    view = memoryview(buffer).cast("B")
+    command = ["ffmpeg", "-nostdin", "-v", "error", "-i", path,
+               "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"]
+    # 壊れたファイルではフレームごとのエラーでパイプが埋まり、FFmpegが止まるので、標準エラーは一時ファイルに受ける
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, bufsize=0)
+    try:
+        start_sample = 0
+        filled = 0
+        while True:
+            # 窓が埋まるか入力が終わるまで読む（float32 の途中で切れた分も次の読み込みで埋まる）
+            while filled < len(view):
+                read = process.stdout.readinto(view[filled:])
+                if not read:
+                    break
+                filled += read
+            samples = filled // 4
+            finished = filled < len(view)
+            # 最後が重なりだけでも返す（前の窓は境界より後ろを採っていないため）
+            if samples:
+                yield start_sample / sample_rate, buffer[:samples], finished
+            if finished:
+                break
+            # 重なりの部分を先頭に移して、続きを読む
+            buffer[:overlap] = buffer[window - overlap:]
+            filled = overlap * 4
+            start_sample += window - overlap
+        process.stdout.close()
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"FFmpegでの読み込みに失敗しました: {stderr.read().decode(errors='replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr.close()
+
+def stream_transcribe(path, transcribe_window, window_sec=WINDOW_SEC, overlap_sec=OVERLAP_SEC):
+    """長い音声を窓ごとに書き起こし、重なりを除いてつなげる
+
+    transcribe_window(audio, prompt) は窓の配列と直前の書き起こしの末尾を受け取り、
+    窓の先頭からの時刻のWhisperの結果を返す関数。隣の窓との重なりは、中点より前を
+    前の窓、後ろを次の窓のセグメントで採る。
+    """
+    segments = []
+    prompt = None
+    windows = 0
+    language = None
+    pending_cut = 0.0  # 前の窓から引き継いだ境界（この時刻より前は採用済み）
+    for offset, audio, finished in stream_windows(path, window_sec, overlap_sec):
+        windows += 1
+        window_end = offset + len(audio) / SAMPLE_RATE
+        # 次の窓との境界は重なりの中点（最後の窓は終わりまで）
+        cut = window_end if finished else window_end - overlap_sec / 2
+        with span("window", index=windows - 1, audio_sec=len(audio) / SAMPLE_RATE) as s:
+            result = transcribe_window(audio, prompt)
+            s["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        language = language or result.get("language")
+        for segment in result.get("segments", []):
+            start = segment["start"] + offset
+            end = segment["end"] + offset
+            middle = (start + end) / 2
+            if pending_cut <= middle < cut:
+                segments.append(dict(segment, start=start, end=end, id=len(segments)))
+        pending_cut = cut
+        prompt = "".join(segment["text"] for segment in segments)[-PROMPT_CHARS:] or None
+        logger.info(f"窓 {windows}: {offset:.0f}〜{window_end:.0f}秒 "
+                    f"(累計 {len(segments)}セグメント, 最大メモリ {peak_rss_mb():.0f}MB)")
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments,
+            "language": language, "stream": {"windows": windows, "window_sec": window_sec, "overlap_sec": overlap_sec}}
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='長い音声をFFmpegから窓ごとに読んで書き起こし、最大メモリを表示します')
+    parser.add_argument('path', help='入力の音声ファイル')
+    parser.add_argument('--model', type=str, default='medium',
+                        help='Whisperモデルのサイズ')
+    parser.add_argument('--window_sec', type=float, default=WINDOW_SEC,
+                        help='窓の長さ（秒）')
+    parser.add_argument('--overlap_sec', type=float, default=OVERLAP_SEC,
+                        help='隣の窓と重ねる長さ（秒）')
+    parser.add_argument('--read_only', action='store_true',
+                        help='Whisperを使わず読み込みだけを行い、全体を一度に読む場合と最大メモリを比べる')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    start = time.perf_counter()
+    if args.read_only:
+        samples = 0
+        for _, audio, _ in stream_windows(args.path, args.window_sec, args.overlap_sec):
+            samples += len(audio)
+        streamed_rss = peak_rss_mb()
+        print(f"窓ごとの読み込み: {samples / SAMPLE_RATE:.0f}秒分, {time.perf_counter() - start:.2f}秒, "
+              f"最大メモリ {streamed_rss:.0f}MB")
+        from audio_preprocess import load_audio
+        audio = load_audio(args.path)
+        print(f"全体を一度に読み込み: {len(audio) / SAMPLE_RATE:.0f}秒分 ({audio.nbytes / (1024 * 1024):.0f}MB), "
+              f"最大メモリ {peak_rss_mb():.0f}MB")
+        return
+
+    from transcribe import load_model
+    model = load_model(args.model)
+    result = stream_transcribe(
+        args.path,
+        lambda audio, prompt: model.transcribe(audio, language="ja", initial_prompt=prompt),
+        args.window_sec, args.overlap_sec)
+    print(result["text"])
+    logger.info(f"書き起こし完了: {result['stream']['windows']}窓, {time.perf_counter() - start:.1f}秒, "
+                f"最大メモリ {peak_rss_mb():.0f}MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from audio_verify import load_bad_audio, mark_bad, same_audio
+from transcribe import get_pending_files
+
+def _bad_result(path):
+    return {"path": path, "problems": ["壊れています"], "duration_sec": 0.0, "expected_sec": None}
+
+def test_bad_file_stays_skipped_after_checkout(tmp_path):
+    mp3_dir = str(tmp_path / "mp3_downloads")
+    os.makedirs(mp3_dir)
+    mp3_file = os.path.join(mp3_dir, "20240101_壊れた放送_100000.mp3")
+    with open(mp3_file, "wb") as f:
+        f.write(b"\x00" * 2000)
+    bad_audio_file = str(tmp_path / "bad_audio.json")
+    mark_bad("100000", _bad_result(mp3_file), "transcriber", bad_audio_file)
+
+    # チェックアウトし直すと更新時刻は記録より後になるが、中身が同じなら対象外のまま
+    later = load_bad_audio(bad_audio_file)["100000"]["checked_at"] + 3600
+    os.utime(mp3_file, (later, later))
+    index_file = str(tmp_path / "episode_index.bin")
+    text_dir = str(tmp_path / "mp3_text")
+    assert get_pending_files(mp3_dir, text_dir, bad_audio_file, index_file) == []
+
+def test_redownloaded_file_is_pending_again(tmp_path):
+    mp3_file = str(tmp_path / "20240101_放送_100000.mp3")
+    with open(mp3_file, "wb") as f:
+        f.write(b"\x00" * 2000)
+    bad_audio_file = str(tmp_path / "bad_audio.json")
+    mark_bad("100000", _bad_result(mp3_file), "transcriber", bad_audio_file)
+    entry = load_bad_audio(bad_audio_file)["100000"]
+    assert same_audio(entry, mp3_file)
+
+    with open(mp3_file, "wb") as f:
+        f.write(b"\x01" * 2000)
+    assert not same_audio(entry, mp3_file)
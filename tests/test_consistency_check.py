@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from consistency_check import ConsistencyChecker
+
+CATALOG = {
+    "100000": {"title": "猫の飼い方について"},
+    "100001": {"title": "株式投資の始め方と注意点"},
+}
+# 100000 のファイルに 100001 の音声が付いている
+HEAD_TEXT = "今日は株式投資の始め方と注意点についてお話しします。株式投資の始め方と注意点を順番に見ていきましょう。"
+
+def _write_mp3(path, fill):
+    with open(path, "wb") as f:
+        f.write(bytes([fill]) * 4000)
+
+def _checker(tmp_path, monkeypatch, calls):
+    checker = ConsistencyChecker(catalog=CATALOG, check_file=str(tmp_path / "consistency_check.json"),
+                                 text_dir=None, segments_dir=None, fetch_pages=False)
+
+    def transcribe_head(mp3_file, audio=None):
+        calls.append(mp3_file)
+        return HEAD_TEXT
+    monkeypatch.setattr(checker, "transcribe_head", transcribe_head)
+    return checker
+
+def test_head_cache_survives_checkout(tmp_path, monkeypatch):
+    mp3_file = str(tmp_path / "20240101_猫の飼い方について_100000.mp3")
+    _write_mp3(mp3_file, 1)
+    calls = []
+    checker = _checker(tmp_path, monkeypatch, calls)
+    checker.check(mp3_file)
+    checker.save()
+
+    # チェックアウトし直して更新時刻が変わっても、同じ音声なら先頭を書き起こし直さない
+    later = os.path.getmtime(mp3_file) + 3600
+    os.utime(mp3_file, (later, later))
+    result = _checker(tmp_path, monkeypatch, calls).check(mp3_file)
+    assert result["source"] == "cache"
+    assert len(calls) == 1
+
+def test_requeue_counts_only_new_audio(tmp_path, monkeypatch):
+    mp3_file = str(tmp_path / "20240101_猫の飼い方について_100000.mp3")
+    bad_audio_file = str(tmp_path / "bad_audio.json")
+    _write_mp3(mp3_file, 1)
+    checker = _checker(tmp_path, monkeypatch, [])
+    result = checker.check(mp3_file)
+    assert result["status"] == "mismatch"
+    checker.requeue(mp3_file, result, "test", bad_audio_file)
+
+    # 再ダウンロードしても同じ音声なら、回数を増やさずにそのまま書き起こす
+    result = checker.check(mp3_file)
+    assert result["status"] == "accepted"
+    assert checker.cache["100000"]["requeued"] == 1
+
+    # 違う音声が届いて、まだ食い違っていれば回数を増やす
+    _write_mp3(mp3_file, 2)
+    result = checker.check(mp3_file)
+    assert result["status"] == "mismatch"
+    checker.requeue(mp3_file, result, "test", bad_audio_file)
+    assert checker.cache["100000"]["requeued"] == 2
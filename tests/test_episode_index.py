@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import downloader
+import episode_index
+from episode_index import EpisodeIndex, make_entry, sync_index, update_index, write_index
+from transcribe import get_pending_files
+
+def _make_mp3_files(mp3_dir, count):
+    os.makedirs(mp3_dir)
+    paths = []
+    for i in range(count):
+        path = os.path.join(mp3_dir, f"20240101_テスト放送{i}_{100000 + i}.mp3")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xfb" + bytes(100))
+        paths.append(path)
+    return paths
+
+def _no_scan(pattern):
+    raise AssertionError(f"MP3ディレクトリを走査しました: {pattern}")
+
+def test_get_returns_each_entry(tmp_path):
+    index_file = str(tmp_path / "episode_index.bin")
+    entries = [make_entry(str(i), f"20240101_t_{i}.mp3", f"タイトル{i}", "20240101") for i in range(100)]
+    write_index(index_file, entries)
+    with EpisodeIndex(index_file) as index:
+        assert len(index) == 100
+        assert index.get("42")["title"] == "タイトル42"
+        assert index.get("100") is None
+        assert [entry["episode_id"] for entry in index] == [str(i) for i in range(100)]
+
+def test_update_without_scan_does_not_mark_index_complete(tmp_path):
+    # ダウンロードした1件だけを書いた索引で、ほかの未書き起こしのファイルを見落とさない
+    mp3_dir = str(tmp_path / "mp3_downloads")
+    paths = _make_mp3_files(mp3_dir, 4)
+    index_file = str(tmp_path / "episode_index.bin")
+    update_index(index_file, [make_entry("100003", paths[3], "テスト放送3", "20240101")])
+    with EpisodeIndex(index_file) as index:
+        assert not index.complete
+
+    pending = get_pending_files(mp3_dir, str(tmp_path / "mp3_text"), str(tmp_path / "bad_audio.json"), index_file)
+    assert sorted(pending) == sorted(paths)
+
+def test_update_scans_once_then_reflects_removals(tmp_path, monkeypatch):
+    mp3_dir = str(tmp_path / "mp3_downloads")
+    paths = _make_mp3_files(mp3_dir, 3)
+    index_file = str(tmp_path / "episode_index.bin")
+    update_index(index_file, [make_entry("100001", paths[1], "新しいタイトル", "20240101")], mp3_dir=mp3_dir)
+    with EpisodeIndex(index_file) as index:
+        assert index.complete
+        assert len(index) == 3
+
+    # 走査済みになったあとは走査せず、削除したファイルは書き手が索引から消す
+    monkeypatch.setattr(episode_index.glob, "glob", _no_scan)
+    os.remove(paths[0])
+    update_index(index_file, [], removed=["100000"], mp3_dir=mp3_dir)
+    with sync_index(index_file, mp3_dir) as index:
+        assert len(index) == 2
+        assert index.get("100000") is None
+        assert index.get("100001")["title"] == "新しいタイトル"
+
+def test_transcriber_reads_downloader_index_without_scan(tmp_path, monkeypatch):
+    mp3_dir = str(tmp_path / "mp3_downloads")
+    paths = _make_mp3_files(mp3_dir, 3)
+    index_file = str(tmp_path / "episode_index.bin")
+    monkeypatch.setattr(downloader, "MP3_DIR", mp3_dir)
+    monkeypatch.setattr(downloader, "EPISODE_INDEX_FILE", index_file)
+    result = {"duration_sec": 1.0, "size": 102}
+    for i, path in enumerate(paths):
+        downloader.record_episode(path, {"id": str(100000 + i), "title": f"テスト放送{i}", "date": "20240101"},
+                                  f"https://voicy.jp/channel/1/{100000 + i}", result)
+    downloader.save_episode_index()
+
+    # チェックアウトし直すとディレクトリの更新時刻は変わるが、コミットした索引をそのまま使う
+    later = os.stat(mp3_dir).st_mtime + 3600
+    os.utime(mp3_dir, (later, later))
+    monkeypatch.setattr(episode_index.glob, "glob", _no_scan)
+    pending = get_pending_files(mp3_dir, str(tmp_path / "mp3_text"), str(tmp_path / "bad_audio.json"), index_file)
+    assert sorted(pending) == sorted(paths)
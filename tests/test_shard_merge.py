@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import subprocess
+
+import shard_merge
+from channels import in_shard
+from episode_index import EpisodeIndex, make_entry, write_index
+from transcribe import get_pending_files
+
+def _git(repo, *args):
+    subprocess.run(["git", *args], cwd=repo, check=True, stdout=subprocess.DEVNULL)
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def test_merge_keeps_both_shards_entries():
+    base = {"100": {"status": "ok"}, "count": 1}
+    ours = {"100": {"status": "ok"}, "200": {"status": "bad"}, "count": 2}
+    theirs = {"300": {"status": "ok"}, "count": 3}
+    merged = shard_merge.merge_json(base, ours, theirs)
+    # 他のシャードが足した 200 は残り、このシャードが消した 100 は消え、件数は両方の増分を足す
+    assert merged == {"200": {"status": "bad"}, "300": {"status": "ok"}, "count": 4}
+    assert shard_merge.merge_list(["a", "b"], ["a", "b", "c"], ["b", "d"]) == ["b", "c", "d"]
+
+def test_apply_on_newer_branch(tmp_path, monkeypatch):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.email", "test@example.com")
+    _git(repo, "config", "user.name", "test")
+    history = str(repo / "download_history.json")
+    _write_json(history, ["a"])
+    _git(repo, "add", "download_history.json")
+    _git(repo, "commit", "-q", "-m", "base")
+    monkeypatch.chdir(repo)
+
+    # このシャードは b と新しいファイルを足す
+    _write_json(history, ["a", "b"])
+    (repo / "new.txt").write_text("シャード", encoding="utf-8")
+    shard_dir = str(tmp_path / "shard")
+    os.makedirs(shard_dir)
+    shard_merge.save(shard_dir, ["."])
+
+    # その間に他のシャードが c をプッシュしていた
+    _git(repo, "checkout", "-q", "--", "download_history.json")
+    os.remove(repo / "new.txt")
+    _write_json(history, ["a", "c"])
+    _git(repo, "commit", "-q", "-am", "other shard")
+
+    shard_merge.apply(shard_dir)
+    with open(history, "r", encoding="utf-8") as f:
+        assert json.load(f) == ["a", "c", "b"]
+    assert (repo / "new.txt").read_text(encoding="utf-8") == "シャード"
+
+def test_shards_split_pending_files(tmp_path):
+    mp3_dir = str(tmp_path / "mp3_downloads")
+    os.makedirs(mp3_dir)
+    ids = [str(100000 + i) for i in range(20)]
+    for episode_id in ids:
+        with open(os.path.join(mp3_dir, f"20240101_放送_{episode_id}.mp3"), "wb") as f:
+            f.write(b"\x00" * 100)
+    text_dir = str(tmp_path / "mp3_text")
+    bad_audio_file = str(tmp_path / "bad_audio.json")
+    found = []
+    for shard in [(0, 2), (1, 2)]:
+        index_file = str(tmp_path / f"episode_index_{shard[0]}.bin")
+        pending = get_pending_files(mp3_dir, text_dir, bad_audio_file, index_file, shard=shard)
+        assert all(in_shard(os.path.basename(p).rsplit("_", 1)[1][:-4], shard) for p in pending)
+        found.extend(pending)
+    assert sorted(os.path.basename(p) for p in found) == sorted(f"20240101_放送_{i}.mp3" for i in ids)
+
+def test_index_merge_keeps_other_shards_entries(tmp_path):
+    base_file = str(tmp_path / "base.bin")
+    ours_file = str(tmp_path / "episode_index.bin")
+    theirs_file = str(tmp_path / "theirs.bin")
+    entries = [make_entry(str(100000 + i), f"20240101_放送_{100000 + i}.mp3", f"放送{i}", "20240101") for i in range(4)]
+    write_index(base_file, entries[:2], complete=True)
+    # 他のシャードは 100002 を足し、このシャードは 100003 を足して 100000 を消した
+    write_index(ours_file, entries[:3], complete=True)
+    write_index(theirs_file, entries[1:2] + entries[3:], complete=True)
+    with open(base_file, "rb") as f:
+        shard_merge.merge_index(f.read(), ours_file, theirs_file)
+    with EpisodeIndex(ours_file) as index:
+        assert index.complete
+        assert sorted(entry["episode_id"] for entry in index) == ["100001", "100002", "100003"]
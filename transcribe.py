@@ -3,13 +3,20 @@
 
 import os
 import sys
-import glob
 import time
 import argparse
 import logging
 from pathlib import Path
-import whisper
 import datetime
+from contextlib import nullcontext
+import instrumentation
+import profiling
+from instrumentation import span, import_span
+from audio_verify import (BAD_AUDIO_FILE, verify_mp3, format_result, load_bad_audio, mark_bad, episode_id_from_path,
+                          same_audio)
+from work_queue import QUEUE_FILE, WorkQueue, Heartbeat
+from episode_index import INDEX_FILE, EpisodeIndex, sync_index
+from channels import parse_shard, in_shard
 
 # ロギング設定
 logging.basicConfig(
@@ -26,108 +33,350 @@ def setup_args():
                         help='MP3ファイルのディレクトリパス')
     parser.add_argument('--text_dir', type=str, default='mp3_text', 
                         help='書き起こしテキストの出力先ディレクトリパス')
+    parser.add_argument('--segments_dir', type=str, default='mp3_segments',
+                        help='セグメント単位の書き起こし結果の出力先ディレクトリパス')
+    parser.add_argument('--no_segments', action='store_true',
+                        help='セグメント単位の結果を保存しない')
+    parser.add_argument('--profile', action='store_true',
+                        help='ファイルごとにプロファイルを取得する')
+    parser.add_argument('--profile_dir', type=str, default=profiling.PROFILE_DIR,
+                        help='プロファイル結果の出力先ディレクトリパス')
+    parser.add_argument('--bad_audio_file', type=str, default=BAD_AUDIO_FILE,
+                        help='検査に通らなかったエピソードの記録ファイル（記録済みのファイルは書き起こさない）')
+    parser.add_argument('--index', type=str, default=INDEX_FILE,
+                        help='エピソードのメタデータの索引（ダウンローダーが書いた走査済みの索引ならディレクトリは走査しない）')
+    parser.add_argument('--rescan', action='store_true',
+                        help='索引を使わずにMP3ディレクトリを走査し直す（ダウンローダーを通さずにファイルを置いたとき）')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='i/n 形式で指定すると、エピソードIDのハッシュで i 番目のシャードに割り当てられたファイルだけを'
+                             '書き起こす（別々のランナーで分担するとき）')
+    parser.add_argument('--check_pending', action='store_true',
+                        help='未処理ファイル数だけを表示して終了する（Whisperは読み込まない）')
+    parser.add_argument('--queue', type=str, nargs='?', const=QUEUE_FILE, default=None,
+                        help=f'作業キュー（SQLite）から1件ずつ借りて処理する。複数のワーカーで同じキューを使っても'
+                             f'同じファイルを重複して書き起こさない（パス省略時は {QUEUE_FILE}）')
     parser.add_argument('--limit', type=int, default=10, 
                         help='一度に処理するファイル数の上限')
     parser.add_argument('--model', type=str, default='medium', 
                         help='Whisperモデルのサイズ (tiny, base, small, medium, large)')
-    return parser.parse_args()
-
-def get_mp3_files(mp3_dir):
-    """MP3ファイルの一覧を取得"""
-    mp3_files = glob.glob(os.path.join(mp3_dir, '*.mp3'))
-    logger.info(f"MP3ファイル数: {len(mp3_files)}")
-    return mp3_files
-
-def get_processed_files(text_dir):
-    """既に処理済みのファイル一覧を取得"""
-    if not os.path.exists(text_dir):
-        os.makedirs(text_dir)
-        return []
+    parser.add_argument('--draft_model', type=str, default=None,
+                        help='指定するとこのモデルで下書きし、低信頼の区間だけを --model で書き直す（例: small）')
+    parser.add_argument('--trim_silence', action='store_true',
+                        help='書き起こしの前に長い無音を詰める（タイムスタンプは元の音声の時刻に戻す）')
+    parser.add_argument('--tempo', type=float, default=1.0,
+                        help='書き起こしの前に音程を変えずに速くする倍率（1.0〜2.0、1.25〜1.5 が目安）')
+    parser.add_argument('--check_consistency', action='store_true',
+                        help='書き起こしの前に先頭を小さいモデルで書き起こしてタイトル・説明文と照合し、'
+                             '別のエピソードの音声なら書き起こさずに再ダウンロード対象にする')
+    parser.add_argument('--check_model', type=str, default='tiny',
+                        help='--check_consistency で先頭の書き起こしに使うモデル')
+    parser.add_argument('--stream_over_sec', type=float, default=None,
+                        help='この長さ（秒）を超える音声は全体を読み込まず、FFmpegから窓ごとに読んで書き起こす'
+                             '（最大メモリが音声の長さによらず一定になる。0なら常に）')
+    parser.add_argument('--window_sec', type=float, default=300.0,
+                        help='窓ごとに書き起こすときの窓の長さ（秒）')
+    args = parser.parse_args()
+    if not 1.0 <= args.tempo <= 2.0:
+        parser.error(f"--tempo は 1.0 以上 2.0 以下で指定してください: {args.tempo}")
+    return args
+
+# 読み込み済みのWhisperモデル（同じ実行の中ではファイルごとに読み直さない）
+_models = {}
+
+def load_model(model_name='medium'):
+    """Whisperモデルを読み込む（whisper と torch は最初に必要になった時点で読み込む）"""
+    if model_name not in _models:
+        with import_span("whisper"):
+            import whisper
+        logger.info(f"モデル {model_name} を読み込み中...")
+        with span("model_load", model=model_name):
+            _models[model_name] = whisper.load_model(model_name)
+    return _models[model_name]
+
+def transcribe_audio(audio_path, model_name='medium', draft_model=None, preprocess_options=None,
+                     stream=False, window_sec=300.0):
+    """音声ファイルを書き起こし
+
+    draft_model を指定すると2段階で書き起こし、preprocess_options（trim_silence / tempo）を
+    指定すると無音を詰めて速くした音声を書き起こしてから時刻を元の音声に戻す。
+    stream=True なら window_sec ごとに読んで書き起こし、直前の窓の書き起こしを文脈として引き継ぐ。
+    """
+    model = load_model(model_name)
     
-    processed_files = []
-    text_files = glob.glob(os.path.join(text_dir, '*.txt'))
+    if not draft_model and not preprocess_options and not stream:
+        logger.info(f"書き起こし中: {audio_path}")
+        with span("inference", model=model_name, file=os.path.basename(audio_path)) as s:
+            result = model.transcribe(audio_path, language="ja")
+            # 実時間係数を出すため、最後のセグメントの終了時刻を音声の長さとみなす
+            if result.get("segments"):
+                s["audio_sec"] = result["segments"][-1]["end"]
+        return result
     
-    for text_file in text_files:
-        # テキストファイル名からMP3ファイル名を復元
-        base_name = os.path.basename(text_file).replace('.txt', '.mp3')
-        processed_files.append(base_name)
+    def decode(audio, prompt=None):
+        return decode_audio(audio, model, model_name, draft_model, preprocess_options, prompt)
     
-    logger.info(f"処理済みファイル数: {len(processed_files)}")
-    return processed_files
-
-def transcribe_audio(audio_path, model_name='medium'):
-    """音声ファイルを書き起こし"""
-    logger.info(f"モデル {model_name} を読み込み中...")
-    model = whisper.load_model(model_name)
+    if stream:
+        with import_span("stream_transcribe"):
+            from stream_transcribe import stream_transcribe
+        logger.info(f"書き起こし中（{window_sec:.0f}秒ごとに読み込み）: {audio_path}")
+        return stream_transcribe(audio_path, decode, window_sec)
     
+    import whisper
+    with span("load_audio", file=os.path.basename(audio_path)):
+        audio = whisper.load_audio(audio_path)
     logger.info(f"書き起こし中: {audio_path}")
-    result = model.transcribe(audio_path, language="ja")
+    return decode(audio)
+
+def decode_audio(audio, model, model_name, draft_model=None, preprocess_options=None, prompt=None):
+    """読み込んだ音声（または窓）を前処理・2段階の指定に従って書き起こす（時刻は audio の先頭から）"""
+    time_map = None
+    if preprocess_options:
+        with import_span("audio_preprocess"):
+            from audio_preprocess import preprocess, format_stats
+        with span("preprocess") as s:
+            audio, time_map, stats = preprocess(audio, **preprocess_options)
+            s["audio_sec"] = stats["original_sec"]
+        logger.info(format_stats(stats))
+    
+    if draft_model:
+        with import_span("speculative"):
+            from speculative import transcribe_speculative
+        draft = load_model(draft_model)
+        result = transcribe_speculative(audio, draft, model, draft_model, model_name, initial_prompt=prompt)
+        summary = result["speculative"]
+        logger.info(f"{draft_model} で下書きし、{summary['redecoded_sec']:.1f}秒 / {summary['duration_sec']:.1f}秒 "
+                    f"({summary['spans']}区間) を {model_name} で再デコードしました")
+    else:
+        with span("inference", model=model_name) as s:
+            result = model.transcribe(audio, language="ja", initial_prompt=prompt)
+            s["audio_sec"] = len(audio) / 16000
     
-    return result["text"]
+    if time_map is not None:
+        time_map.project_result(result)
+        result["preprocess"] = stats
+    return result
+
+def write_outputs(mp3_file, result, text_dir, segments_dir=None, episode=None):
+    """書き起こしをテキストに保存し、segments_dir を指定すればセグメント単位の結果も保存する
+
+    episode は索引の件で、あればタイトル・日付・保存先をファイル名から推測せずに使う。
+    """
+    base_name = os.path.basename(mp3_file)
+    if episode:
+        output_file = os.path.join(text_dir, episode["text_file"])
+        date_str, title, episode_id = episode["date"], episode["title"], episode["episode_id"]
+    else:
+        output_file = os.path.join(text_dir, base_name.replace('.mp3', '.txt'))
+        # ファイル名から日付とタイトルを抽出
+        file_parts = base_name.split('_', 1)
+        date_str = file_parts[0]
+        title = file_parts[1].rsplit('_', 1)[0] if len(file_parts) > 1 else base_name
+        episode_id = os.path.splitext(base_name)[0].rsplit('_', 1)[-1]
+    with span("write_output", file=base_name), open(output_file, 'w', encoding='utf-8') as f:
+        try:
+            date_obj = datetime.datetime.strptime(date_str, '%Y%m%d')
+            formatted_date = date_obj.strftime('%Y年%m月%d日')
+        except:
+            formatted_date = date_str
+    
+        # ヘッダー情報を追加
+        f.write(f"# {title}\n")
+        f.write(f"日付: {formatted_date}\n\n")
+        f.write(result["text"])
+    
+    # セグメント単位の結果を日付パーティションに保存
+    if segments_dir:
+        with import_span("segment_export"):
+            from segment_export import export_segments
+        export_segments(result, segments_dir, date_str, episode_id)
+    return output_file
 
 def main():
     args = setup_args()
+    if args.check_pending:
+        # ワークフローで依存関係のインストール前に呼び、件数だけを標準出力に出す
+        print(len(get_pending_files(args.mp3_dir, args.text_dir, args.bad_audio_file, args.index, args.shard,
+                                    args.rescan)))
+        return
+    instrumentation.init("transcriber")
+    if args.profile:
+        profiling.enable(args.profile_dir)
+    try:
+        run(args)
+    finally:
+        instrumentation.finish()
+        profiling.finish()
+
+def get_pending_files(mp3_dir, text_dir, bad_audio_file=BAD_AUDIO_FILE, index_file=INDEX_FILE, shard=None,
+                      rescan=False):
+    """未処理のMP3ファイル一覧を取得（索引の件ごとに書き起こしの有無を見て判定し、重いモジュールは読み込まない）
+
+    走査済みの索引（ダウンローダーがファイルの増減を反映してきた索引）なら、ディレクトリは走査しない。
+    検査に通らなかったと記録されたファイルは、その後に再ダウンロードされるまで（音声のハッシュが
+    変わるまで）対象外にする。shard を指定すると受け持ちのエピソードだけを返す。
+    """
+    os.makedirs(text_dir, exist_ok=True)
+    bad_audio = load_bad_audio(bad_audio_file)
+    files_to_process = []
+    skipped_bad = 0
+    with sync_index(index_file, mp3_dir, rescan=rescan) as index:
+        logger.info(f"MP3ファイル数: {len(index)}")
+        for episode in index:
+            if not in_shard(episode["episode_id"], shard):
+                continue
+            if os.path.exists(os.path.join(text_dir, episode["text_file"])):
+                continue
+            mp3_file = os.path.join(mp3_dir, episode["mp3_file"])
+            if not os.path.exists(mp3_file):
+                continue
+            entry = bad_audio.get(episode["episode_id"])
+            if entry and same_audio(entry, mp3_file):
+                skipped_bad += 1
+                continue
+            files_to_process.append(mp3_file)
+    
+    if skipped_bad:
+        logger.info(f"検査に通らなかったため対象外のファイル数: {skipped_bad}")
+    logger.info(f"未処理ファイル数: {len(files_to_process)}")
+    return files_to_process
+
+def run(args):
+    """未処理のMP3ファイルを書き起こす"""
     
     # ディレクトリパスの設定
-    mp3_dir = args.mp3_dir
     text_dir = args.text_dir
     
-    # 処理済みファイルの確認
-    processed_files = get_processed_files(text_dir)
+    files_to_process = get_pending_files(args.mp3_dir, text_dir, args.bad_audio_file, args.index, args.shard,
+                                         args.rescan)
+    startup_sec = instrumentation.mark_startup(pending=len(files_to_process))
+    logger.info(f"起動から処理対象の判定まで: {startup_sec * 1000:.1f}ms")
     
-    # MP3ファイルの取得
-    mp3_files = get_mp3_files(mp3_dir)
+    if not files_to_process:
+        logger.info("処理するファイルがありません")
+        return
     
-    # 未処理のファイルをフィルタリング
-    files_to_process = []
-    for mp3_file in mp3_files:
-        base_name = os.path.basename(mp3_file)
-        if base_name not in processed_files:
-            files_to_process.append(mp3_file)
-    
-    logger.info(f"未処理ファイル数: {len(files_to_process)}")
+    work_queue = None
+    if args.queue:
+        # 未処理のファイルをキューに登録し、処理する分だけ借りる
+        # （完了後に再ダウンロードされたファイルは、更新時刻を見て未処理に戻す）
+        work_queue = WorkQueue(args.queue)
+        added = work_queue.enqueue("transcribe", [
+            (os.path.basename(mp3_file), None, {"path": mp3_file}, os.path.getmtime(mp3_file))
+            for mp3_file in files_to_process])
+        logger.info(f"作業キューに登録しました: 新規 {added}件")
+        logger.info(work_queue.format_report("transcribe"))
+        files_to_process = claim_files(work_queue, args.limit)
+    else:
+        # 処理数の制限
+        files_to_process = files_to_process[:args.limit]
+        logger.info(f"今回処理するファイル数: {len(files_to_process)}")
     
-    # 処理数の制限
-    files_to_process = files_to_process[:args.limit]
-    logger.info(f"今回処理するファイル数: {len(files_to_process)}")
+    try:
+        process_files(files_to_process, args, work_queue)
+    finally:
+        if work_queue:
+            logger.info(work_queue.format_report("transcribe"))
+            work_queue.close()
     
-    # 各ファイルを処理
+    logger.info("すべての処理が完了しました")
+
+def claim_files(work_queue, limit):
+    """作業キューから1件ずつ借りてMP3ファイルのパスを返す（借りるのは処理の直前）"""
+    for _ in range(limit):
+        claimed = work_queue.claim("transcribe", 1)
+        if not claimed:
+            return
+        key, _, payload, attempts = claimed[0]
+        if attempts > 1:
+            logger.info(f"作業キュー: {attempts}回目の取り出しです（前回は失敗か期限切れ）: {key}")
+        yield payload["path"]
+
+def process_files(files_to_process, args, work_queue=None):
+    """MP3ファイルを順に書き起こす（キューから借りたものは処理中ずっと貸し出しを延ばす）"""
+    text_dir = args.text_dir
+    preprocess_options = None
+    if args.trim_silence or args.tempo != 1.0:
+        preprocess_options = {"trim_silence": args.trim_silence, "tempo": args.tempo}
+    checker = None
+    if args.check_consistency:
+        with import_span("consistency_check"):
+            from consistency_check import ConsistencyChecker
+        checker = ConsistencyChecker(text_dir=text_dir, segments_dir=args.segments_dir, model_name=args.check_model)
+    # 索引は書き起こしの間ずっと開いておき、ファイルごとにエピソードIDで1件だけ引く
+    index = EpisodeIndex.open(args.index)
+    try:
+        transcribe_files(files_to_process, args, work_queue, preprocess_options, checker, index)
+    finally:
+        if index:
+            index.close()
+        if checker:
+            checker.save()
+            logger.info(checker.format_report())
+
+def transcribe_files(files_to_process, args, work_queue, preprocess_options, checker, index=None):
+    """process_files の本体（checker を指定すれば書き起こしの前に内容とタイトルを照合する）"""
+    text_dir = args.text_dir
     for mp3_file in files_to_process:
+        base_name = os.path.basename(mp3_file)
+        lease = Heartbeat(work_queue, "transcribe", [base_name]) if work_queue else nullcontext()
+        episode = index.get(episode_id_from_path(mp3_file)) if index else None
+        if episode and episode["mp3_file"] != base_name:
+            episode = None  # 索引を書いたあとに別の名前で保存し直されたファイル
         try:
             start_time = time.time()
-            base_name = os.path.basename(mp3_file)
-            output_file = os.path.join(text_dir, base_name.replace('.mp3', '.txt'))
+            with lease, profiling.profile(f"file_{os.path.splitext(base_name)[0]}"), \
+                    span("file", file=base_name) as file_span:
+                logger.info(f"処理開始: {base_name}")
             
-            logger.info(f"処理開始: {base_name}")
+                # 壊れたファイルでWhisperを回さないよう、先にフレームを検査する
+                with span("verify", file=base_name) as s:
+                    check = verify_mp3(mp3_file)
+                    s["audio_sec"] = check["duration_sec"]
+                    if not check["ok"]:
+                        s["status"] = "invalid"
+                if not check["ok"]:
+                    attempts = mark_bad(episode_id_from_path(mp3_file), check, "transcriber", args.bad_audio_file)
+                    logger.warning(f"音声の検査に通らないため書き起こしません（再ダウンロード対象, {attempts}回目）: "
+                                   f"{format_result(check)}")
+                    # 再ダウンロードされるまでキューでも完了扱いにする
+                    if work_queue:
+                        work_queue.complete("transcribe", base_name)
+                    continue
+                
+                # 別のエピソードの音声が付いていれば、高いモデルで書き起こす前に再ダウンロードに回す
+                if checker:
+                    from consistency_check import format_check
+                    consistency = checker.check(mp3_file, episode=episode)
+                    logger.info(format_check(consistency))
+                    if consistency["status"] == "mismatch":
+                        attempts = checker.requeue(mp3_file, consistency, "transcriber", args.bad_audio_file)
+                        logger.warning(f"タイトルと内容が一致しないため書き起こしません（再ダウンロード対象, {attempts}回目）")
+                        if work_queue:
+                            work_queue.complete("transcribe", base_name)
+                        continue
             
-            # 書き起こし実行
-            transcription = transcribe_audio(mp3_file, args.model)
+                # 書き起こし実行
+                # 長い音声は窓ごとに読み、最大メモリを音声の長さによらず一定にする
+                stream = args.stream_over_sec is not None and check["duration_sec"] > args.stream_over_sec
+                result = transcribe_audio(mp3_file, args.model, args.draft_model, preprocess_options,
+                                          stream, args.window_sec)
+                # ファイル単位の実時間係数は元の音声の長さで出す（前処理で短くした分も効果として見える）
+                if result.get("segments"):
+                    file_span["audio_sec"] = result["segments"][-1]["end"]
             
-            # 結果をファイルに保存
-            with open(output_file, 'w', encoding='utf-8') as f:
-                # ファイル名から日付とタイトルを抽出
-                file_parts = base_name.split('_', 1)
-                date_str = file_parts[0]
-                try:
-                    date_obj = datetime.datetime.strptime(date_str, '%Y%m%d')
-                    formatted_date = date_obj.strftime('%Y年%m月%d日')
-                except:
-                    formatted_date = date_str
-                
-                title = file_parts[1].rsplit('_', 1)[0] if len(file_parts) > 1 else base_name
-                
-                # ヘッダー情報を追加
-                f.write(f"# {title}\n")
-                f.write(f"日付: {formatted_date}\n\n")
-                f.write(transcription)
+                # 結果をファイルに保存
+                write_outputs(mp3_file, result, text_dir, None if args.no_segments else args.segments_dir, episode)
+            
+                elapsed_time = time.time() - start_time
+                logger.info(f"処理完了: {base_name} (所要時間: {elapsed_time:.2f}秒)")
             
-            elapsed_time = time.time() - start_time
-            logger.info(f"処理完了: {base_name} (所要時間: {elapsed_time:.2f}秒)")
+            if work_queue and (not work_queue.complete("transcribe", base_name) or lease.lost):
+                logger.warning(f"作業キュー: 処理中に貸し出し期限が切れていました: {base_name}")
             
         except Exception as e:
             logger.error(f"エラー発生: {base_name} - {str(e)}")
-    
-    logger.info("すべての処理が完了しました")
+            if work_queue:
+                work_queue.fail("transcribe", base_name, str(e))
 
 if __name__ == "__main__":
     main()
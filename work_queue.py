@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import fcntl
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+QUEUE_FILE = os.path.join("output", "work_queue.db")  # 作業キューのSQLiteファイル
+LEASE_SEC = 600  # 取り出した作業の貸し出し期間（この間にハートビートがなければ他のワーカーが取り直す）
+HEARTBEAT_SEC = LEASE_SEC / 4  # 貸し出しを延長する間隔
+MAX_ATTEMPTS = 5  # これを超えて失敗した作業は failed にして取り出さない
+RETRY_DELAY_SEC = 300  # 失敗した作業を再び取り出せるまでの待ち時間（試行回数に比例して延ばす）
+
+STATES = ("pending", "leased", "done", "failed")
+
+@contextmanager
+def file_lock(path):
+    """path.lock を排他ロックし、JSONファイルの読み書きを複数プロセスの間で直列にする"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """SQLiteに置いた作業キュー（期限付きの貸し出しで複数ワーカーが重複なく取り出す）
+
+    作業は (キュー名, キー) で一意。claim で貸し出し、処理中は heartbeat で期限を延ばし、
+    complete / fail で返す。期限切れの貸し出しは次の claim で取り直される。
+    WALモードで開くので、共有できるのは同じマシンのプロセスどうしだけ（ネットワーク上の
+    ファイルシステムでは使えない）。別々のランナーで分担するときは、ダウンローダーの
+    --episode_shard と書き起こしの --shard でエピソードを分け、結果は shard_merge.py で取り込む。
+    """
+
+    def __init__(self, path=QUEUE_FILE, lease_sec=LEASE_SEC, max_attempts=MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY_SEC, worker_id=None):
+        self.path = path
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.worker_id = worker_id or default_worker_id()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # ハートビートのスレッドからも使うので、接続はロックで守って共有する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                queue TEXT NOT NULL,
+                key TEXT NOT NULL,
+                grp TEXT,
+                payload TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (queue, key)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_claim ON items (queue, state, lease_until)")
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みロックを先に取るトランザクション（取り出しの競合を防ぐ）"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, queue, items):
+        """作業を登録し、新しく増えた件数を返す
+
+        items は (キー, グループ, payload, not_before) の並び。グループはチャンネルIDなど、
+        claim で絞り込むための値（なければNone）。登録済みの作業はそのままだが、
+        done / failed になった時刻が not_before より前なら pending に戻す（再ダウンロードなど）。
+        """
+        now = time.time()
+        added = 0
+        with self._transaction() as conn:
+            for key, group, payload, not_before in items:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO items (queue, key, grp, payload, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (queue, key, group, json.dumps(payload, ensure_ascii=False), now, now))
+                if cursor.rowcount:
+                    added += 1
+                elif not_before:
+                    conn.execute(
+                        "UPDATE items SET state = 'pending', attempts = 0, owner = NULL, lease_until = 0, "
+                        "payload = ?, updated_at = ? "
+                        "WHERE queue = ? AND key = ? AND state IN ('done', 'failed') AND updated_at < ?",
+                        (json.dumps(payload, ensure_ascii=False), now, queue, key, not_before))
+        return added
+
+    def claim(self, queue, limit=1, groups=None):
+        """未処理か貸し出し期限切れの作業を登録順に最大 limit 件借りる
+
+        groups を渡すとそのグループの作業だけを借りる。(キー, グループ, payload, 試行回数) のリストを返す。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # 上限まで試して期限切れになった作業（処理中に落ち続けるもの）は取り直さない
+            conn.execute(
+                "UPDATE items SET state = 'failed', owner = NULL, error = COALESCE(error, 'lease expired'), "
+                "updated_at = ? WHERE queue = ? AND state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, queue, now, self.max_attempts))
+            # pending の lease_until は失敗後の再試行を待つ期限
+            sql = ("SELECT key, grp, payload, attempts FROM items WHERE queue = ? AND attempts < ? "
+                   "AND state IN ('pending', 'leased') AND lease_until <= ?")
+            params = [queue, self.max_attempts, now]
+            if groups is not None:
+                sql += f" AND grp IN ({', '.join('?' * len(groups))})"
+                params.extend(groups)
+            rows = conn.execute(sql + " ORDER BY rowid LIMIT ?", params + [limit]).fetchall()
+            for key, _, _, _ in rows:
+                conn.execute(
+                    "UPDATE items SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE queue = ? AND key = ?",
+                    (self.worker_id, now + self.lease_sec, now, queue, key))
+        return [(key, group, json.loads(payload), attempts + 1) for key, group, payload, attempts in rows]
+
+    def heartbeat(self, queue, keys):
+        """借りている作業の期限を延ばし、延ばせた件数を返す（他のワーカーに取り直された分は延ばせない）"""
+        now = time.time()
+        extended = 0
+        with self._transaction() as conn:
+            for key in keys:
+                extended += conn.execute(
+                    "UPDATE items SET lease_until = ? WHERE queue = ? AND key = ? AND state = 'leased' AND owner = ?",
+                    (now + self.lease_sec, queue, key, self.worker_id)).rowcount
+        return extended
+
+    def complete(self, queue, key):
+        """作業を完了にする（まだ自分が借りていたらTrue）"""
+        now = time.time()
+        with self._transaction() as conn:
+            owned = conn.execute(
+                "UPDATE items SET state = 'done', owner = NULL, lease_until = 0, error = NULL, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND state = 'leased' AND owner = ?",
+                (now, queue, key, self.worker_id)).rowcount > 0
+            if not owned:
+                # 期限切れで他のワーカーに取り直されていても、終わった結果は残す
+                conn.execute(
+                    "UPDATE items SET state = 'done', owner = NULL, lease_until = 0, error = NULL, updated_at = ? "
+                    "WHERE queue = ? AND key = ? AND state != 'done'",
+                    (now, queue, key))
+        return owned
+
+    def fail(self, queue, key, error=None):
+        """作業を失敗として返す（試行回数が上限に達したら failed、それまでは待ち時間の後に pending で取り出せる）"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_until = ? + attempts * ?, error = ?, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND state = 'leased' AND owner = ?",
+                (self.max_attempts, now, self.retry_delay, error, now, queue, key, self.worker_id)).rowcount > 0
+
+    def reclaim(self, queue=None):
+        """貸し出し期限が切れた作業を pending（試行回数が上限なら failed）に戻し、件数を返す
+
+        claim でも取り直されるので、集計や手動の整理に使う。
+        """
+        now = time.time()
+        sql = ("UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+               "owner = NULL, lease_until = 0, updated_at = ? WHERE state = 'leased' AND lease_until < ?")
+        params = [self.max_attempts, now, now]
+        if queue is not None:
+            sql += " AND queue = ?"
+            params.append(queue)
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def stats(self, queue=None):
+        """キューごと・状態ごとの件数を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT queue, state, COUNT(*) FROM items GROUP BY queue, state").fetchall()
+        counts = {}
+        for name, state, count in rows:
+            if queue is None or name == queue:
+                counts.setdefault(name, dict.fromkeys(STATES, 0))[state] = count
+        return counts
+
+    def failed_items(self, queue=None):
+        """失敗した作業の (キュー名, キー, 試行回数, エラー) を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT queue, key, attempts, error FROM items WHERE state = 'failed' ORDER BY queue, updated_at"
+            ).fetchall()
+        return [row for row in rows if queue is None or row[0] == queue]
+
+    def format_report(self, queue):
+        counts = self.stats(queue).get(queue, dict.fromkeys(STATES, 0))
+        return (f"作業キュー {queue}: 未処理 {counts['pending']}件, 処理中 {counts['leased']}件, "
+                f"完了 {counts['done']}件, 失敗 {counts['failed']}件 ({self.path})")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Heartbeat:
+    """with の間、借りている作業の期限を別スレッドで延ばし続ける"""
+
+    def __init__(self, work_queue, queue, keys, interval=None):
+        self.work_queue = work_queue
+        self.queue = queue
+        self.keys = list(keys)
+        self.interval = interval or min(HEARTBEAT_SEC, work_queue.lease_sec / 4)
+        self.lost = False  # 他のワーカーに取り直された作業があった
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.work_queue.heartbeat(self.queue, self.keys) < len(self.keys):
+                    self.lost = True
+            except sqlite3.Error as e:
+                print(f"作業キューのハートビートエラー: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="queue-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+def setup_args():
+    """コマンドライン引数の設定"""
+    parser = argparse.ArgumentParser(description='作業キューの状態を表示・整理します')
+    parser.add_argument('command', choices=['stats', 'reclaim', 'failed'],
+                        help='stats: 件数を表示 / reclaim: 期限切れの貸し出しを戻す / failed: 失敗した作業を表示')
+    parser.add_argument('--queue_file', type=str, default=QUEUE_FILE,
+                        help='作業キューのSQLiteファイル')
+    parser.add_argument('--queue', type=str, default=None,
+                        help='対象のキュー名（download / transcribe、省略時はすべて）')
+    return parser.parse_args()
+
+def main():
+    args = setup_args()
+    work_queue = WorkQueue(args.queue_file)
+    try:
+        if args.command == "reclaim":
+            print(f"期限切れの貸し出しを戻しました: {work_queue.reclaim(args.queue)}件")
+        elif args.command == "failed":
+            for name, key, attempts, error in work_queue.failed_items(args.queue):
+                print(f"{name}\t{key}\t{attempts}回\t{error or ''}")
+        for name in sorted(work_queue.stats(args.queue)):
+            print(work_queue.format_report(name))
+    finally:
+        work_queue.close()
+
+if __name__ == "__main__":
+    main()